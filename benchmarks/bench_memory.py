@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.bench_suite import quiet_settings, rendered_groups, traced_peak
+from benchmarks.fake_client import FakeTelegramClient, SyntheticChat
+from core import database
+from core.database import MessageModel, iter_message_groups, message_group_stats
+from core.export_output import FolderOutput
+from core.exporter import ChatExporter
+from core.html_generator import HtmlGenerator
+from core.merger import Merger
+from core.metrics import ExportMetrics
+
+
+# Groups in the layout messages had before MessageRecord: a dict per message with nested dicts for the
+# reply preview, the forward and every media file.
+def dict_groups(db):
+    query = (MessageModel
+             .select(MessageModel.telegram_message_id, MessageModel.grouped_id, MessageModel.date,
+                     MessageModel.sender, MessageModel.text, MessageModel.reply_to, MessageModel.forwarded_from,
+                     MessageModel.media_path, MessageModel.media_type, MessageModel.media_placeholder,
+                     MessageModel.action_text)
+             .order_by(MessageModel.date, MessageModel.telegram_message_id))
+    current, current_key = None, None
+    for (msg_id, grouped_id, date, sender, text, reply_to, forwarded_from, media_path, media_type, placeholder,
+         action_text) in db.execute(query):
+        key = grouped_id or msg_id
+        if key != current_key:
+            if current is not None:
+                yield current
+            current_key = key
+            current = {'date': database.parse_date(date), 'from': sender, 'text': text,
+                       'reply_to': json.loads(reply_to) if reply_to else None,
+                       'forwarded': json.loads(forwarded_from) if forwarded_from else None,
+                       'media_files': [], 'media_placeholder': placeholder, 'action_text': action_text}
+        if text:
+            current['text'] = text
+        if media_path:
+            current['media_files'].append({'path': media_path, 'type': media_type})
+    if current is not None:
+        yield current
+
+
+def retained_mb(groups) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        held = list(groups)
+        size = tracemalloc.get_traced_memory()[0]
+        del held
+        return size / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def merge_peak_mb(workdir: Path, title: str, db) -> float:
+    count = message_group_stats(db)[0]
+    first, second = workdir / "exports" / "Memory_1", workdir / "exports" / "Memory_2"
+    for folder, skip, limit in ((first, 0, count * 3 // 5), (second, count * 2 // 5, None)):
+        folder.mkdir(parents=True)
+        with open(folder / "messages.html", 'w', encoding='utf-8') as f:
+            HtmlGenerator(title, rendered_groups(db, skip, limit), total_messages=count).write(f)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return traced_peak(Merger(str(first), str(second)).merge)
+    finally:
+        os.chdir(cwd)
+
+
+def run(args) -> dict:
+    chat = SyntheticChat(messages=args.messages, reply_ratio=args.reply_ratio, forward_ratio=args.forward_ratio,
+                         album_ratio=args.album_ratio, media_size=args.media_size, seed=args.seed)
+    client = FakeTelegramClient(chat)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        exporter = ChatExporter(client, quiet_settings())
+        exporter.output = FolderOutput(tmp / "export")
+        exporter.metrics = ExportMetrics(client.chat.title)
+        exporter._init_db()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                asyncio.run(exporter._data_ingestion_pass(client.chat, args.media, None, None, None))
+                render_peak = traced_peak(exporter._html_generation_pass, client.chat.title, args.messages, None,
+                                          None)
+            return {
+                'dicts_mb': retained_mb(dict_groups(exporter.db)),
+                'records_mb': retained_mb(iter_message_groups(exporter.db)),
+                'render_peak_mb': render_peak,
+                'merge_peak_mb': merge_peak_mb(tmp, client.chat.title, exporter.db),
+            }
+        finally:
+            exporter.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory held by message records while rendering and merging.")
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--reply-ratio', type=float, default=0.2)
+    parser.add_argument('--forward-ratio', type=float, default=0.1)
+    parser.add_argument('--album-ratio', type=float, default=0.05)
+    parser.add_argument('--media', action='store_true', help="download the synthetic media as well")
+    parser.add_argument('--media-size', type=int, default=1024)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"{args.messages} messages")
+    print(f"  all groups held as dicts:    {result['dicts_mb']:8.1f} MB")
+    print(f"  all groups held as records:  {result['records_mb']:8.1f} MB "
+          f"({1 - result['records_mb'] / result['dicts_mb']:.0%} less)")
+    print(f"  render pass peak:            {result['render_peak_mb']:8.1f} MB")
+    print(f"  merge peak:                  {result['merge_peak_mb']:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from peewee import SqliteDatabase
+
+from core import database
+from core.database import MessageModel, open_database, finish_ingest, insert_messages
+from core.export_output import FolderOutput
+from core.exporter import ChatExporter
+from core.html_generator import HtmlGenerator
+from core.message_record import MediaFile, MessageRecord
+
+
+class LegacyMessageModel(MessageModel):
+    class Meta:
+        indexes = ()
+
+
+def synthetic_rows(count: int, album_ratio: float, seed: int = 42):
+    rnd = random.Random(seed)
+    date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    msg_id = 1
+    while msg_id <= count:
+        date += timedelta(seconds=rnd.randint(1, 600))
+        album_size = rnd.randint(2, 10) if rnd.random() < album_ratio else 1
+        grouped_id = rnd.getrandbits(60) if album_size > 1 else None
+        for i in range(min(album_size, count - msg_id + 1)):
+            has_media = album_size > 1 or rnd.random() < 0.3
+            yield {
+                'telegram_message_id': msg_id,
+                'grouped_id': grouped_id,
+                'date': date,
+                'sender': f"User {rnd.randint(1, 50)} [@user{rnd.randint(1, 50)}]",
+                'text': f"Message {msg_id} " + "lorem ipsum " * rnd.randint(0, 20) if i == 0 else '',
+                'reply_to': json.dumps({'text': 'quoted', 'from': 'Someone'}) if rnd.random() < 0.1 else None,
+                'forwarded_from': json.dumps({'from': 'Channel'}) if rnd.random() < 0.05 else None,
+                'media_path': f"media/photo/photo_{msg_id}.jpg" if has_media else None,
+                'media_type': 'photo' if has_media else None,
+                'media_placeholder': None,
+                'action_text': None
+            }
+            msg_id += 1
+
+
+def legacy_ingest(db: SqliteDatabase, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= 200:
+            LegacyMessageModel.insert_many(batch).execute()
+            batch.clear()
+    if batch:
+        LegacyMessageModel.insert_many(batch).execute()
+
+
+def legacy_group_messages() -> list:
+    messages_map = {}
+    for msg_record in LegacyMessageModel.select().order_by(LegacyMessageModel.date.asc()):
+        key = msg_record.grouped_id if msg_record.grouped_id else msg_record.telegram_message_id
+        if key not in messages_map:
+            messages_map[key] = {
+                'date': database.parse_date(msg_record.date),
+                'from': msg_record.sender,
+                'text': msg_record.text,
+                'reply_to': json.loads(msg_record.reply_to) if msg_record.reply_to else None,
+                'forwarded': json.loads(msg_record.forwarded_from) if msg_record.forwarded_from else None,
+                'media_files': [],
+                'media_placeholder': msg_record.media_placeholder,
+                'action_text': msg_record.action_text
+            }
+        if msg_record.text:
+            messages_map[key]['text'] = msg_record.text
+        if msg_record.media_path:
+            messages_map[key]['media_files'].append({'path': msg_record.media_path, 'type': msg_record.media_type})
+    return list(messages_map.values())
+
+
+# The page is rendered from records; the legacy dicts are converted just before.
+def legacy_record(msg: dict) -> MessageRecord:
+    reply, forwarded = msg['reply_to'] or {}, msg['forwarded'] or {}
+    return MessageRecord(msg['date'], msg['from'], msg['text'], reply.get('from'), reply.get('text'),
+                         forwarded.get('from'), tuple(MediaFile(m['path'], m['type']) for m in msg['media_files']),
+                         msg['media_placeholder'], msg['action_text'])
+
+
+def timed(label: str, func, *args, memory: bool = False):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    line = f"  {label:<28} {elapsed:8.3f}s"
+    if memory:
+        # A second, traced run: tracemalloc slows the code down too much to time it in the same pass.
+        tracemalloc.start()
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        line += f"  peak {peak / (1024 * 1024):8.1f} MB"
+    print(line)
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and current export render paths.")
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--album-ratio', type=float, default=0.05)
+    parser.add_argument('--memory', action='store_true', help="also report peak traced memory of each render step")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        print(f"Synthetic table: {args.rows} rows, album ratio {args.album_ratio}")
+
+        print("\nLegacy (default pragmas, no indexes, grouping in Python):")
+        legacy_db = SqliteDatabase(tmp / "legacy.db")
+        legacy_db.bind([LegacyMessageModel])
+        legacy_db.create_tables([LegacyMessageModel])
+        timed("ingest", legacy_ingest, legacy_db, synthetic_rows(args.rows, args.album_ratio))
+        legacy_messages, legacy_group_time = timed("group albums", legacy_group_messages, memory=args.memory)
+        legacy_html = HtmlGenerator("Benchmark", [legacy_record(m) for m in legacy_messages
+                                                    if m['text'] or m['media_files']])
+        timed("render html", legacy_html.generate, memory=args.memory)
+        legacy_db.close()
+
+        print("\nCurrent (WAL, indexes, streaming album grouping):")
+        db = open_database(tmp / "current.db")
+        rows = list(synthetic_rows(args.rows, args.album_ratio))
+        timed("ingest", insert_messages, db, rows)
+        finish_ingest(db)
+        group_count, group_time = timed("group albums", lambda: sum(1 for _ in database.iter_message_groups(db)),
+                                        memory=args.memory)
+
+        exporter = ChatExporter(None, None)
+        exporter.output = FolderOutput(tmp)
+        exporter.db = db
+        timed("full render pass", exporter._html_generation_pass, "Benchmark", len(rows), None, None,
+              memory=args.memory)
+        db.close()
+
+        print(f"\nGroups: legacy {len(legacy_messages)}, current {group_count}")
+        print(f"Album grouping speedup: {legacy_group_time / group_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Packages the application must not load before a session or export needs them.
+DEFERRED_PACKAGES = ('telethon', 'bs4', 'lxml', 'peewee', 'tqdm', 'pyarrow', 'zstandard')
+
+
+# One fresh interpreter importing ``module`` under ``-X importtime``: returns the module's cumulative
+# import time in microseconds and the cumulative time of every module that was imported.
+def measure(module: str) -> tuple:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times[module], times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the application against a budget.")
+    parser.add_argument('--module', default='main', help="module whose import is measured")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters to measure; the median is used")
+    parser.add_argument('--budget-ms', type=float, default=150, help="allowed median import time")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest imports to list")
+    args = parser.parse_args()
+
+    totals, times = [], {}
+    for _ in range(args.runs):
+        total, times = measure(args.module)
+        totals.append(total)
+    median_ms = statistics.median(totals) / 1000
+
+    print(f"import {args.module}: median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(totals) / 1000:.1f}, max {max(totals) / 1000:.1f}), budget {args.budget_ms:.0f} ms")
+    print(f"\nSlowest imports (cumulative, last run):")
+    for name, cumulative in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+    ok = True
+    eager = sorted({name.split('.')[0] for name in times} & set(DEFERRED_PACKAGES))
+    if eager:
+        ok = False
+        print(f"\n❌ Loaded at startup although they should be deferred: {', '.join(eager)}")
+    if median_ms > args.budget_ms:
+        ok = False
+        print(f"\n❌ Import time {median_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    if ok:
+        print("\n✅ Startup within budget")
+    else:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
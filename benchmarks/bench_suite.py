@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.fake_client import FakeTelegramClient, SyntheticChat
+from core import utils
+from core.database import iter_message_groups, message_group_stats
+from core.export_output import FolderOutput
+from core.exporter import ChatExporter
+from core.html_generator import HtmlGenerator
+from core.merger import Merger
+from core.message_record import page_records
+from core.metrics import ExportMetrics
+from core.settings import DelaySettings
+
+BENCHMARKS = ('ingest', 'render', 'format', 'merge')
+
+# Results that are timings (lower is better); everything else in a result is informational.
+TIMED_KEYS = ('ingest_seconds', 'render_seconds', 'format_us_per_message', 'merge_seconds')
+
+
+def quiet_settings() -> DelaySettings:
+    settings = DelaySettings()
+    settings.delay_between_messages = 0
+    settings.delay_between_media = 0
+    settings.retry_delay = 0
+    return settings
+
+
+def traced_peak(func, *args) -> float:
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def rendered_groups(db, skip: int = 0, limit: int = None):
+    return itertools.islice(page_records(iter_message_groups(db)), skip, None if limit is None else skip + limit)
+
+
+def bench_ingest(exporter: ChatExporter, client: FakeTelegramClient, args) -> dict:
+    # tqdm and the progress prints would dominate small runs, so they go nowhere.
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        started = time.perf_counter()
+        count = asyncio.run(exporter._data_ingestion_pass(client.chat, args.media, None, None, None,
+                                                          args.media_types, args.media_only))
+        elapsed = time.perf_counter() - started
+    return {'ingest_seconds': round(elapsed, 3), 'ingest_messages_per_second': round(count / elapsed),
+            'rpc_requests': sum(exporter.metrics.rpc_counts.values()), 'flood_waits': exporter.metrics.flood_waits,
+            'media_files': exporter.metrics.media_files}
+
+
+def bench_render(exporter: ChatExporter, client: FakeTelegramClient, memory: bool) -> dict:
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        exporter._html_generation_pass(client.chat.title, client.config.messages, None, None)
+        result = {'render_seconds': round(time.perf_counter() - started, 3)}
+        if memory:
+            result['render_peak_mb'] = round(
+                traced_peak(exporter._html_generation_pass, client.chat.title, client.config.messages, None, None), 1)
+    return result
+
+
+def bench_format(client: FakeTelegramClient, sample: int) -> dict:
+    texts = [client.build_message(msg_id).text for msg_id in range(1, min(sample, client.config.messages) + 1)]
+    started = time.perf_counter()
+    for text in texts:
+        utils.format_text(text)
+    elapsed = time.perf_counter() - started
+    return {'format_us_per_message': round(elapsed / len(texts) * 1_000_000, 2)}
+
+
+def bench_merge(workdir: Path, title: str, db) -> dict:
+    # Two exports overlapping on a fifth of the chat, as an append export would produce.
+    count = message_group_stats(db)[0]
+    first, second = workdir / "exports" / "Synthetic_1", workdir / "exports" / "Synthetic_2"
+    for folder, skip, limit in ((first, 0, count * 3 // 5), (second, count * 2 // 5, None)):
+        folder.mkdir(parents=True)
+        with open(folder / "messages.html", 'w', encoding='utf-8') as f:
+            HtmlGenerator(title, rendered_groups(db, skip, limit), total_messages=count).write(f)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            Merger(str(first), str(second)).merge()
+            elapsed = time.perf_counter() - started
+    finally:
+        os.chdir(cwd)
+    return {'merge_seconds': round(elapsed, 3)}
+
+
+def run_size(size: int, args) -> dict:
+    chat = SyntheticChat(messages=size, media_ratio=args.media_ratio, album_ratio=args.album_ratio,
+                         reply_ratio=args.reply_ratio, forward_ratio=args.forward_ratio,
+                         flood_wait_ratio=args.flood_wait_ratio,
+                         flood_wait_seconds=args.flood_wait_seconds, media_size=args.media_size, seed=args.seed)
+    client = FakeTelegramClient(chat)
+    result = {'messages': size}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        exporter = ChatExporter(client, quiet_settings())
+        exporter.output = FolderOutput(tmp / "export")
+        exporter.metrics = ExportMetrics(client.chat.title)
+        exporter.metrics.instrument(client)
+        exporter._init_db()
+        try:
+            if {'ingest', 'render', 'merge'} & set(args.only):
+                result.update(bench_ingest(exporter, client, args))
+            if 'render' in args.only:
+                result.update(bench_render(exporter, client, args.memory))
+            if 'format' in args.only:
+                result.update(bench_format(client, args.format_sample))
+            if 'merge' in args.only:
+                result.update(bench_merge(tmp, client.chat.title, exporter.db))
+        finally:
+            exporter.metrics.release()
+            exporter.db.close()
+    return result
+
+
+def compare(results: list, baseline_path: Path, tolerance: float) -> bool:
+    baseline = {entry['messages']: entry for entry in json.loads(baseline_path.read_text(encoding='utf-8'))}
+    ok = True
+    print(f"\nCompared with {baseline_path} (tolerance {tolerance:.0%}):")
+    for entry in results:
+        previous = baseline.get(entry['messages'])
+        if not previous:
+            continue
+        for key in TIMED_KEYS:
+            if key not in entry or not previous.get(key):
+                continue
+            change = entry[key] / previous[key] - 1
+            regressed = change > tolerance
+            ok = ok and not regressed
+            print(f"  {entry['messages']:>9} {key:<24} {previous[key]:>10} -> {entry[key]:>10}  {change:+7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline export benchmarks driven by a synthetic Telegram chat.")
+    parser.add_argument('--sizes', default='10000,100000',
+                        help="comma separated chat sizes, e.g. 10000,100000,1000000")
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help=f"subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--media', action='store_true', help="download the synthetic media during ingestion")
+    parser.add_argument('--media-types', help="comma separated media types to download, e.g. photo,video")
+    parser.add_argument('--media-only', action='store_true',
+                        help="ingest only the messages with the selected media, filtered by the (fake) server")
+    parser.add_argument('--media-ratio', type=float, default=0.2)
+    parser.add_argument('--media-size', type=int, default=64 * 1024, help="average media size in bytes")
+    parser.add_argument('--album-ratio', type=float, default=0.03)
+    parser.add_argument('--reply-ratio', type=float, default=0.1)
+    parser.add_argument('--forward-ratio', type=float, default=0.05)
+    parser.add_argument('--flood-wait-ratio', type=float, default=0.0,
+                        help="share of requests answered with a FloodWait")
+    parser.add_argument('--flood-wait-seconds', type=int, default=0,
+                        help="length of each injected FloodWait; media retries really sleep this long")
+    parser.add_argument('--format-sample', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--memory', action='store_true', help="also report peak traced memory of the render pass")
+    parser.add_argument('--save', type=Path, help="write the results to this JSON file")
+    parser.add_argument('--compare', type=Path, help="compare with results saved earlier with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown before flagging, e.g. 0.2")
+    args = parser.parse_args()
+    args.only = [name.strip() for name in args.only.split(',') if name.strip()]
+    if args.media_types:
+        args.media_types = [name.strip() for name in args.media_types.split(',') if name.strip()]
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        print(f"Synthetic chat with {size} messages...")
+        result = run_size(size, args)
+        for key, value in result.items():
+            if key != 'messages':
+                print(f"  {key:<28} {value}")
+        results.append(result)
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2), encoding='utf-8')
+        print(f"\nResults saved to {args.save}")
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_suite import quiet_settings
+from benchmarks.fake_client import FakeTelegramClient, SyntheticChat
+from core.exporter import ChatExporter
+from core.metrics import ExportMetrics
+from core.sync import ExportSync
+
+
+def page_body(folder: Path) -> str:
+    html = (folder / "messages.html").read_text(encoding='utf-8')
+    return html[html.index('<div class="messages">'):]
+
+
+async def export(client: FakeTelegramClient) -> ChatExporter:
+    exporter = ChatExporter(client, quiet_settings())
+    await exporter.export_chat(client.chat, False, output_formats=['html', 'jsonl'])
+    return exporter
+
+
+async def run(args) -> dict:
+    config = SyntheticChat(messages=args.messages, request_latency=args.latency, seed=args.seed)
+    client = FakeTelegramClient(config)
+    original = await export(client)
+
+    rnd = random.Random(args.seed)
+    ids = range(1, args.messages + 1)
+    client.deleted.update(rnd.sample(ids, int(args.messages * args.delete_ratio)))
+    for msg_id in rnd.sample(ids, int(args.messages * args.edit_ratio)):
+        client.edits[msg_id] = f"edited message {msg_id}"
+
+    sync_client = FakeTelegramClient(config)
+    sync_client.edits, sync_client.deleted = client.edits, client.deleted
+    metrics = ExportMetrics('sync')
+    metrics.instrument(sync_client)
+    started = time.perf_counter()
+    sync = ExportSync(sync_client, quiet_settings(), original.export_folder)
+    sync.open()
+    try:
+        result = await sync.run(sync_client.chat)
+    finally:
+        sync.close()
+        metrics.release()
+    sync_seconds = time.perf_counter() - started
+
+    fresh_client = FakeTelegramClient(config)
+    fresh_client.edits, fresh_client.deleted = client.edits, client.deleted
+    started = time.perf_counter()
+    fresh = await export(fresh_client)
+    export_seconds = time.perf_counter() - started
+
+    return dict(result, sync_seconds=round(sync_seconds, 3), sync_rpc=sum(metrics.rpc_counts.values()),
+                export_seconds=round(export_seconds, 3), export_rpc=sum(fresh.metrics.rpc_counts.values()),
+                identical=page_body(original.export_folder) == page_body(fresh.export_folder))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync edits and deletions into an export vs. exporting again.")
+    parser.add_argument('--messages', type=int, default=50_000)
+    parser.add_argument('--edit-ratio', type=float, default=0.01)
+    parser.add_argument('--delete-ratio', type=float, default=0.005)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every fake request")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                result = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+    print(f"{args.messages} messages, {result['edited']} edited, {result['deleted']} deleted, "
+          f"{result['days']} day(s) rendered again")
+    print(f"  sync:       {result['sync_seconds']:>8.3f} s  {result['sync_rpc']:>7} requests")
+    print(f"  re-export:  {result['export_seconds']:>8.3f} s  {result['export_rpc']:>7} requests")
+    print(f"  page identical to a re-export: {'yes' if result['identical'] else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from telethon.errors import FloodWaitError
+from telethon.extensions import markdown
+from telethon.helpers import TotalList
+from telethon.tl.custom.file import File
+from telethon.tl.functions.channels import GetMessagesRequest
+from telethon.tl.functions.messages import GetDialogsRequest, GetHistoryRequest, SearchRequest
+from telethon.tl.functions.upload import GetFileRequest
+from telethon.tl.functions.users import GetUsersRequest
+from telethon.tl.types import (Channel, ChatPhotoEmpty, Document, DocumentAttributeAudio, DocumentAttributeFilename,
+                               DocumentAttributeSticker, DocumentAttributeVideo, InputMessagesFilterDocument,
+                               InputMessagesFilterEmpty, InputMessagesFilterMusic, InputMessagesFilterPhotos,
+                               InputMessagesFilterPhotoVideo, InputMessagesFilterRoundVoice, InputMessagesFilterVideo,
+                               InputMessagesFilterVoice,
+                               InputPeerEmpty, InputStickerSetEmpty, MessageMediaDocument, MessageMediaPhoto,
+                               PeerChannel, PeerUser, Photo, PhotoCachedSize, PhotoSize,
+                               PhotoSizeProgressive, PhotoStrippedSize, User)
+from telethon.utils import get_peer_id
+
+MEDIA_KINDS = ('photo', 'video', 'document', 'audio', 'voice', 'sticker')
+
+# Media kinds returned by each search filter; filters for kinds the synthetic chat never has match nothing.
+FILTER_KINDS = {
+    InputMessagesFilterPhotos: {'photo'},
+    InputMessagesFilterVideo: {'video'},
+    InputMessagesFilterPhotoVideo: {'photo', 'video'},
+    InputMessagesFilterDocument: {'document'},
+    InputMessagesFilterMusic: {'audio'},
+    InputMessagesFilterVoice: {'voice'},
+    InputMessagesFilterRoundVoice: {'voice'},
+}
+
+HISTORY_PAGE_SIZE = 100
+DOWNLOAD_CHUNK_SIZE = 128 * 1024
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'telegram', 'export', 'chat', 'message', 'media', 'album',
+         'reply', 'forward', 'channel', 'group', 'photo', 'video', 'benchmark')
+
+flood_logger = logging.getLogger('telethon.client.users')
+
+
+def _size_bytes(size) -> int:
+    if isinstance(size, PhotoSizeProgressive):
+        return max(size.sizes)
+    return size.size if isinstance(size, PhotoSize) else len(size.bytes)
+
+
+# What Telethon's download_media makes of its ``thumb`` argument: an index or a type picks one of the sizes,
+# only these size objects are taken as they are, anything else finds nothing.
+def _get_thumb(sizes: list, thumb):
+    if isinstance(thumb, int):
+        return sizes[thumb] if -len(sizes) <= thumb < len(sizes) else None
+    if isinstance(thumb, str):
+        return next((size for size in sizes if size.type == thumb), None)
+    return thumb if isinstance(thumb, (PhotoSize, PhotoCachedSize, PhotoStrippedSize)) else None
+
+
+@dataclass
+class SyntheticChat:
+    messages: int = 10_000
+    media_ratio: float = 0.2
+    media_mix: Dict[str, float] = field(default_factory=lambda: {'photo': 0.6, 'video': 0.15, 'document': 0.15,
+                                                                 'audio': 0.04, 'voice': 0.04, 'sticker': 0.02})
+    media_size: int = 64 * 1024
+    album_ratio: float = 0.03
+    max_album_size: int = 10
+    reply_ratio: float = 0.1
+    forward_ratio: float = 0.05
+    senders: int = 50
+    message_interval: int = 60
+    flood_wait_ratio: float = 0.0
+    flood_wait_seconds: int = 1
+    request_latency: float = 0.0
+    sleep_flood_waits: bool = False
+    seed: int = 42
+
+
+class FakeMessage:
+    def __init__(self, client: 'FakeTelegramClient', msg_id: int, date: datetime, grouped_id: Optional[int],
+                 sender_id: int, text: str):
+        self._client = client
+        self.id = msg_id
+        self.date = date
+        self.grouped_id = grouped_id
+        self.sender_id = sender_id
+        self.set_text(text)
+        self.action = None
+        self.reply_to = None
+        self.forward = None
+        self.edit_date = None
+        self.media = None
+        self.kind = None
+        self.photo = None
+        self.document = None
+        self.video = self.video_note = self.voice = self.audio = self.sticker = self.gif = None
+
+    # Like Telethon: the plain text with its entities, and the markdown rendering of both.
+    def set_text(self, text: str):
+        self.text = text
+        self.message, entities = markdown.parse(text)
+        self.entities = entities or None
+
+    @property
+    def client(self) -> 'FakeTelegramClient':
+        return self._client
+
+    @property
+    def file(self) -> Optional[File]:
+        media = self.photo or self.document
+        return File(media) if media else None
+
+    async def get_sender(self):
+        return self._client.users[self.sender_id]
+
+    async def get_reply_message(self):
+        if not self.reply_to:
+            return None
+        return self._client.build_message(self.reply_to.reply_to_msg_id)
+
+    async def download_media(self, file=None, progress_callback=None, thumb=None, **kwargs):
+        return await self._client.download_media(self, file, progress_callback=progress_callback, thumb=thumb)
+
+
+# Stands in for TelegramClient in the code paths the exporter uses. Every message is derived from its id
+# and the chat seed alone, so chats of millions of messages are generated lazily and reproducibly, and
+# replies can be rebuilt on demand. Requests go through ``_call`` like Telethon's, so RPC counting,
+# latency and FloodWaits (slept through and logged the way Telethon does) behave like the real client.
+class FakeTelegramClient:
+    def __init__(self, chat: Optional[SyntheticChat] = None):
+        self.config = chat or SyntheticChat()
+        self.chat = Channel(id=1_234_567, title="Synthetic Chat", photo=ChatPhotoEmpty(),
+                            date=datetime(2020, 1, 1, tzinfo=timezone.utc), megagroup=True, username='synthetic')
+        self.users = {user_id: User(id=user_id, first_name=f"User {user_id}", username=f"user{user_id}")
+                      for user_id in range(1, self.config.senders + 1)}
+        self.base_date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.bytes_served = 0
+        self._flood_random = random.Random(self.config.seed)
+        kinds = [kind for kind in MEDIA_KINDS if self.config.media_mix.get(kind)]
+        self._media_kinds = kinds
+        self._media_weights = [self.config.media_mix[kind] for kind in kinds]
+        # Media kind by message id, so filtered scans build each skipped message only once.
+        self._kinds: Dict[int, Optional[str]] = {}
+        # Changes made to the chat after the fact: new texts of edited messages and ids of deleted ones.
+        self.edits: Dict[int, str] = {}
+        self.deleted = set()
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        if self.config.request_latency:
+            await asyncio.sleep(self.config.request_latency)
+        if self.config.flood_wait_ratio and self._flood_random.random() < self.config.flood_wait_ratio:
+            seconds = self.config.flood_wait_seconds
+            self.flood_waits += 1
+            self.flood_wait_seconds += seconds
+            if isinstance(request, GetFileRequest):
+                raise FloodWaitError(request, capture=seconds)
+            flood_logger.info('Sleeping%s for %ds (%s) on %s flood wait', '', seconds, timedelta(seconds=seconds),
+                              request.__class__.__name__)
+            if self.config.sleep_flood_waits:
+                await asyncio.sleep(seconds)
+        return None
+
+    def _random(self, msg_id: int, salt: int = 0) -> random.Random:
+        return random.Random((self.config.seed * 1_000_003 + msg_id) * 31 + salt)
+
+    def _album_size(self, msg_id: int) -> int:
+        rnd = self._random(msg_id, 1)
+        if self.config.album_ratio and rnd.random() < self.config.album_ratio:
+            return rnd.randint(2, self.config.max_album_size)
+        return 1
+
+    def _album_start(self, msg_id: int) -> Optional[int]:
+        for start in range(msg_id, max(0, msg_id - self.config.max_album_size), -1):
+            size = self._album_size(start)
+            if size > 1:
+                return start if size > msg_id - start else None
+        return None
+
+    def message_date(self, msg_id: int) -> datetime:
+        start = self._album_start(msg_id) or msg_id
+        return self.base_date + timedelta(seconds=start * self.config.message_interval)
+
+    def build_message(self, msg_id: int) -> Optional[FakeMessage]:
+        if not 1 <= msg_id <= self.config.messages or msg_id in self.deleted:
+            return None
+        self._kinds.setdefault(msg_id, None)
+        config = self.config
+        rnd = self._random(msg_id)
+        album_start = self._album_start(msg_id)
+        sender_id = rnd.randint(1, config.senders)
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(0, 40))]
+        if words and rnd.random() < 0.2:
+            words[rnd.randrange(len(words))] = f"**{rnd.choice(WORDS)}**"
+        if words and rnd.random() < 0.1:
+            words.append(f"https://example.com/{msg_id}")
+        text = ' '.join(words) if not album_start or album_start == msg_id else ''
+
+        msg = FakeMessage(self, msg_id, self.message_date(msg_id), album_start and (config.seed << 32) + album_start,
+                          sender_id, text)
+        if album_start:
+            self._attach_media(msg, rnd, rnd.choice(('photo', 'video')))
+        elif rnd.random() < config.media_ratio:
+            self._attach_media(msg, rnd, rnd.choices(self._media_kinds, self._media_weights)[0])
+        if msg_id > 1 and rnd.random() < config.reply_ratio:
+            msg.reply_to = SimpleNamespace(reply_to_msg_id=rnd.randint(max(1, msg_id - 500), msg_id - 1))
+        if rnd.random() < config.forward_ratio:
+            if rnd.random() < 0.5:
+                msg.forward = SimpleNamespace(from_id=PeerChannel(self.chat.id), from_name=None)
+            else:
+                msg.forward = SimpleNamespace(from_id=None, from_name=f"Hidden User {rnd.randint(1, 100)}")
+        if msg_id in self.edits:
+            msg.set_text(self.edits[msg_id])
+            msg.edit_date = msg.date + timedelta(hours=1)
+        return msg
+
+    def _attach_media(self, msg: FakeMessage, rnd: random.Random, kind: str):
+        size = max(1, int(self.config.media_size * rnd.uniform(0.5, 1.5)))
+        msg.kind = self._kinds[msg.id] = kind
+        if kind == 'photo':
+            # The largest size of a photo comes progressive. A small photo has no other one besides the inline
+            # thumbnail, so its preview is the progressive size too.
+            full = PhotoSizeProgressive(type='y', w=1280, h=960, sizes=[max(1, size // 4), size])
+            sizes = self._thumbs(size) + [full]
+            if msg.id % 8 == 0:
+                full.w, full.h = 300, 200
+                sizes = [PhotoStrippedSize(type='i', bytes=b'\x01' * 40), full]
+            msg.photo = Photo(id=msg.id, access_hash=0, file_reference=b'', date=msg.date, sizes=sizes, dc_id=2)
+            msg.media = MessageMediaPhoto(photo=msg.photo)
+            return
+
+        attributes = {
+            'video': (DocumentAttributeVideo(duration=rnd.randint(1, 300), w=1280, h=720),
+                      DocumentAttributeFilename(f"video_{msg.id}.mp4")),
+            'document': (DocumentAttributeFilename(f"report_{msg.id}.pdf"),),
+            'audio': (DocumentAttributeAudio(duration=rnd.randint(60, 400), title=f"Track {msg.id}"),
+                      DocumentAttributeFilename(f"track_{msg.id}.mp3")),
+            'voice': (DocumentAttributeAudio(duration=rnd.randint(1, 120), voice=True),),
+            'sticker': (DocumentAttributeSticker(alt='🙂', stickerset=InputStickerSetEmpty()),),
+        }[kind]
+        mime_type = {'video': 'video/mp4', 'document': 'application/pdf', 'audio': 'audio/mpeg',
+                     'voice': 'audio/ogg', 'sticker': 'image/webp'}[kind]
+        thumbs = self._thumbs(size) if kind in ('video', 'document', 'sticker') else None
+        msg.document = Document(id=msg.id, access_hash=0, file_reference=b'', date=msg.date, mime_type=mime_type,
+                                size=size, dc_id=2, attributes=list(attributes), thumbs=thumbs)
+        msg.media = MessageMediaDocument(document=msg.document)
+        setattr(msg, kind, msg.document)
+
+    # The smaller sizes Telegram keeps of a photo, also the thumbnails of videos and documents.
+    @staticmethod
+    def _thumbs(size: int) -> list:
+        return [PhotoSize(type='s', w=90, h=68, size=min(size, 1_500)),
+                PhotoSize(type='m', w=320, h=240, size=min(size, 12_000)),
+                PhotoSize(type='x', w=800, h=600, size=min(size, 60_000))]
+
+    # Dates never decrease with the id, so the first message dated after ``date`` is found by bisection.
+    def _first_id_after(self, date: datetime) -> int:
+        low, high = 1, self.config.messages + 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.message_date(middle) > date:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _kind(self, msg_id: int) -> Optional[str]:
+        if msg_id not in self._kinds:
+            self.build_message(msg_id)
+        return self._kinds.get(msg_id)
+
+    @staticmethod
+    def _filter_kinds(search_filter) -> Optional[set]:
+        if search_filter is None:
+            return None
+        return FILTER_KINDS.get(search_filter if isinstance(search_filter, type) else type(search_filter), set())
+
+    # A search filter, sender or query makes this page through the matching messages only, as messages.search
+    # does.
+    async def iter_messages(self, entity, limit: Optional[int] = None, offset_date: Optional[datetime] = None,
+                            filter=None, from_user=None, search: Optional[str] = None, min_id: int = 0,
+                            max_id: int = 0, reverse: bool = False, **kwargs):
+        kinds = self._filter_kinds(filter)
+        sender_id = get_peer_id(from_user) if from_user is not None else None
+        searching = kinds is not None or sender_id is not None or bool(search)
+        search_filter = filter() if isinstance(filter, type) else filter or InputMessagesFilterEmpty()
+        # min_id and max_id are exclusive, as in Telegram; offset_date cuts off newer messages, or older ones
+        # when reading in reverse.
+        low, high = min_id + 1, min(max_id - 1 if max_id else self.config.messages, self.config.messages)
+        if offset_date and reverse:
+            low = max(low, self._first_id_after(offset_date))
+        elif offset_date:
+            high = min(high, self._first_id_after(offset_date - timedelta(microseconds=1)) - 1)
+        yielded = 0
+        for msg_id in (range(low, high + 1) if reverse else range(high, low - 1, -1)):
+            if limit is not None and yielded >= limit:
+                break
+            if kinds is not None and self._kind(msg_id) not in kinds:
+                continue
+            msg = self.build_message(msg_id)
+            if msg is None:
+                continue
+            if sender_id is not None and msg.sender_id != sender_id:
+                continue
+            if search and search.lower() not in msg.message.lower():
+                continue
+            if yielded % HISTORY_PAGE_SIZE == 0:
+                if not searching:
+                    request = GetHistoryRequest(peer=InputPeerEmpty(), offset_id=msg.id + 1, offset_date=None,
+                                                add_offset=0, limit=HISTORY_PAGE_SIZE, max_id=0, min_id=0, hash=0)
+                else:
+                    request = SearchRequest(peer=InputPeerEmpty(), q=search or '', filter=search_filter,
+                                            min_date=None, max_date=None, offset_id=msg.id + 1, add_offset=0,
+                                            limit=HISTORY_PAGE_SIZE, max_id=0, min_id=0, hash=0)
+                await self._call(None, request)
+            yield msg
+            yielded += 1
+
+    async def get_messages(self, entity, limit: Optional[int] = None, ids=None, **kwargs):
+        if ids is not None:
+            await self._call(None, GetMessagesRequest(channel=InputPeerEmpty(), id=[]))
+            if isinstance(ids, int):
+                return self.build_message(ids)
+            return [self.build_message(msg_id) for msg_id in ids]
+        result = TotalList([msg async for msg in self.iter_messages(entity, limit=limit, **kwargs)] if limit else [])
+        result.total = self.config.messages
+        if kwargs.get('from_user') is not None or kwargs.get('search'):
+            result.total = sum([1 async for _ in self.iter_messages(entity, **kwargs)])
+        elif kwargs.get('filter') is not None:
+            kinds = self._filter_kinds(kwargs['filter'])
+            result.total = sum(1 for msg_id in range(1, self.config.messages + 1) if self._kind(msg_id) in kinds)
+        return result
+
+    async def iter_dialogs(self, **kwargs):
+        await self._call(None, GetDialogsRequest(offset_date=None, offset_id=0, offset_peer=InputPeerEmpty(),
+                                                 limit=100, hash=0))
+        yield SimpleNamespace(id=get_peer_id(self.chat), entity=self.chat, name=self.chat.title,
+                              message=self.build_message(self.config.messages), pinned=False)
+
+    async def get_entity(self, peer):
+        await self._call(None, GetUsersRequest(id=[]))
+        if isinstance(peer, PeerUser):
+            return self.users.get(peer.user_id) or User(id=peer.user_id, first_name="Unknown")
+        return self.chat
+
+    async def iter_download(self, msg: FakeMessage, offset: int = 0, request_size: int = DOWNLOAD_CHUNK_SIZE,
+                            **kwargs):
+        size = msg.document.size if msg.document else _size_bytes(msg.photo.sizes[-1])
+        while offset < size:
+            await self._call(None, GetFileRequest(location=None, offset=offset, limit=request_size))
+            chunk = min(request_size, size - offset)
+            offset += chunk
+            self.bytes_served += chunk
+            yield b'\0' * chunk
+
+    async def download_media(self, msg: FakeMessage, file=None, progress_callback=None, thumb=None):
+        if msg.photo is None and msg.document is None:
+            return None
+        if thumb is not None:
+            thumb = _get_thumb(msg.photo.sizes if msg.photo else msg.document.thumbs or [], thumb)
+            if thumb is None:
+                return None
+            await self._call(None, GetFileRequest(location=None, offset=0, limit=DOWNLOAD_CHUNK_SIZE))
+            self.bytes_served += _size_bytes(thumb)
+            file.write(b'\0' * _size_bytes(thumb))
+            return file
+        written = 0
+        async for chunk in self.iter_download(msg):
+            file.write(chunk)
+            written += len(chunk)
+            if progress_callback:
+                progress_callback(written, msg.file.size)
+        return file
+
+    async def disconnect(self):
+        pass
+
@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+
+from core.cassette import ReplayClient
+from core.exporter import ChatExporter
+from core.settings import DelaySettings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run a recorded export from its API cassette, without network.")
+    parser.add_argument('cassette', type=Path, help="*.cassette.gz written by an export with recording enabled")
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="1 replays the recorded latencies, 0 answers instantly")
+    parser.add_argument('--keep-delays', action='store_true',
+                        help="keep the configured message, media and retry delays instead of zeroing them")
+    args = parser.parse_args()
+
+    client = ReplayClient(args.cassette, args.latency_scale)
+    if client.chat is None:
+        parser.error(f"{args.cassette} has no export header")
+    options = client.export_options
+
+    settings = DelaySettings()
+    settings.record_cassette = False
+    if not args.keep_delays:
+        settings.delay_between_messages = 0
+        settings.delay_between_media = 0
+        settings.retry_delay = 0
+
+    exporter = ChatExporter(client, settings)
+    started = time.perf_counter()
+    asyncio.run(exporter.export_chat(
+        client.chat, options['download_media'], options['max_file_size'],
+        datetime.fromisoformat(options['start_date']) if options['start_date'] else None,
+        datetime.fromisoformat(options['end_date']) if options['end_date'] else None,
+        options['output_formats'], options['archive_format'], options.get('media_types'),
+        options.get('media_only', False), client.from_user, options.get('search'),
+        options.get('media_preview', False), options.get('media_budget_mb'), options.get('media_quotas'),
+        options.get('media_priority'), options.get('media_later', False), options.get('minify_html', False),
+        options.get('html_precompress')))
+    print(f"\n📼 Replayed in {time.perf_counter() - started:.2f}s (latency scale {args.latency_scale})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import asyncio
+import gzip
+import json
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Optional
+
+from telethon.errors import FloodWaitError
+from telethon.extensions import markdown
+from telethon.helpers import TotalList
+from telethon.tl.types import InputMessageReplyTo
+from telethon.utils import get_peer_id
+
+from .utils import decode_tl, encode_tl
+
+DOWNLOAD_CHUNK_SIZE = 128 * 1024
+
+
+def _peer_key(peer):
+    try:
+        return get_peer_id(peer)
+    except (TypeError, ValueError):
+        return str(peer)
+
+
+# Filtered history requests get their filters appended to the key; unfiltered keys stay as they were.
+def _history_key(key: list, kwargs: dict) -> list:
+    search_filter = kwargs.get('filter')
+    if search_filter is not None:
+        key.append(getattr(search_filter, '__name__', type(search_filter).__name__))
+    if kwargs.get('from_user') is not None:
+        key.append(['from_user', _peer_key(kwargs['from_user'])])
+    if kwargs.get('search'):
+        key.append(['search', kwargs['search']])
+    return key
+
+
+def _ids_key(ids):
+    if isinstance(ids, InputMessageReplyTo):
+        return ['reply_to', ids.id]
+    if isinstance(ids, (list, tuple)):
+        return [getattr(i, 'id', i) for i in ids]
+    return getattr(ids, 'id', ids)
+
+
+def _iter_messages_key(entity, kwargs: dict) -> list:
+    return _history_key(['iter_messages', _peer_key(entity), str(kwargs.get('offset_date') or '') or None], kwargs)
+
+
+def _get_messages_key(entity, args: tuple, kwargs: dict) -> list:
+    ids = kwargs.get('ids')
+    selection = _ids_key(ids) if ids is not None else ['limit', kwargs.get('limit', args[0] if args else None)]
+    return _history_key(['get_messages', _peer_key(entity) if entity else None, selection], kwargs)
+
+
+# Records the API traffic of an export into a gzip-compressed JSON Lines cassette. The methods the
+# exporter and Telethon's Message use are wrapped on the client instance itself, so calls made from inside
+# Telethon (reply lookups, sender refetches, message downloads) are captured as well. Each entry keeps the
+# wall time the call took; media downloads keep their size and timing, not their content.
+class CassetteRecorder:
+    def __init__(self, client, path: Path):
+        self.client = client
+        self.path = path
+        self.entries = 0
+        self._file = None
+        self._originals = {}
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        for name in ('iter_messages', 'get_messages', 'get_entity', 'download_media', 'iter_download'):
+            self._originals[name] = self.client.__dict__.get(name)
+            setattr(self.client, name, getattr(self, f"_{name}")(getattr(self.client, name)))
+
+    def record_export(self, entity, from_user=None, **options):
+        self._write(['export'], time.perf_counter(), chat=encode_tl(entity), from_user=encode_tl(from_user),
+                    options=options)
+
+    def stop(self):
+        for name, original in self._originals.items():
+            if original is None:
+                delattr(self.client, name)
+            else:
+                setattr(self.client, name, original)
+        self._originals.clear()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _write(self, key: list, started: float, **fields):
+        fields.update(k=key, t=round(time.perf_counter() - started, 6))
+        self._file.write(json.dumps(fields, separators=(',', ':')))
+        self._file.write('\n')
+        self.entries += 1
+
+    def _write_error(self, key: list, started: float, error: Exception):
+        self._write(key, started, error=type(error).__name__, message=str(error),
+                    seconds=getattr(error, 'seconds', None))
+
+    @staticmethod
+    def _message_fields(msg) -> list:
+        entities = [entity for entity in (getattr(msg, '_sender', None), getattr(msg, '_chat', None)) if entity]
+        return [encode_tl(msg), [encode_tl(entity) for entity in entities]]
+
+    def _iter_messages(self, original):
+        def iter_messages(entity, *args, **kwargs):
+            key = _iter_messages_key(entity, kwargs)
+            iterator = original(entity, *args, **kwargs).__aiter__()
+
+            async def recorded():
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        msg = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        self._write(key, started, end=True)
+                        return
+                    except Exception as e:
+                        self._write_error(key, started, e)
+                        raise
+                    self._write(key, started, m=self._message_fields(msg) if msg else None)
+                    yield msg
+
+            return recorded()
+
+        return iter_messages
+
+    def _get_messages(self, original):
+        async def get_messages(entity, *args, **kwargs):
+            key = _get_messages_key(entity, args, kwargs)
+            started = time.perf_counter()
+            try:
+                result = await original(entity, *args, **kwargs)
+            except Exception as e:
+                self._write_error(key, started, e)
+                raise
+            if isinstance(result, list):
+                self._write(key, started, total=getattr(result, 'total', None),
+                            messages=[self._message_fields(msg) if msg else None for msg in result])
+            else:
+                self._write(key, started, message=self._message_fields(result) if result else None)
+            return result
+
+        return get_messages
+
+    def _get_entity(self, original):
+        async def get_entity(peer, *args, **kwargs):
+            key = ['get_entity', _peer_key(peer)]
+            started = time.perf_counter()
+            try:
+                result = await original(peer, *args, **kwargs)
+            except Exception as e:
+                self._write_error(key, started, e)
+                raise
+            self._write(key, started, e=encode_tl(result) if not isinstance(result, list) else None)
+            return result
+
+        return get_entity
+
+    def _download_media(self, original):
+        async def download_media(message, file=None, *args, **kwargs):
+            key = ['download_media', getattr(message, 'id', None)]
+            position = file.tell() if hasattr(file, 'tell') else 0
+            started = time.perf_counter()
+            try:
+                result = await original(message, file, *args, **kwargs)
+            except Exception as e:
+                self._write_error(key, started, e)
+                raise
+            size = file.tell() - position if hasattr(file, 'tell') else None
+            if size is None and isinstance(result, str) and Path(result).is_file():
+                size = Path(result).stat().st_size
+            self._write(key, started, size=size if result else None)
+            return result
+
+        return download_media
+
+    def _iter_download(self, original):
+        def iter_download(file, *args, **kwargs):
+            key = ['iter_download', getattr(file, 'id', None), kwargs.get('offset', 0)]
+            iterator = original(file, *args, **kwargs).__aiter__()
+
+            async def recorded():
+                started, size = time.perf_counter(), 0
+                while True:
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        self._write(key, started, size=size)
+                        return
+                    except Exception as e:
+                        self._write_error(key, started, e)
+                        raise
+                    size += len(chunk)
+                    yield chunk
+
+            return recorded()
+
+        return iter_download
+
+
+# Serves an export from a recorded cassette instead of Telegram. Calls are matched by their key and
+# answered in recording order; ``latency_scale`` replays the recorded wall times (1.0), scales them, or
+# answers instantly (0).
+class ReplayClient:
+    def __init__(self, path: Path, latency_scale: float = 1.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.parse_mode = markdown
+        self.flood_sleep_threshold = 60
+        self._self_id = None
+        self._mb_entity_cache = {}
+        self._entries = defaultdict(deque)
+        self._last = {}
+        self.chat = None
+        self.from_user = None
+        self.export_options = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['k'] == ['export']:
+                    self.chat, self.export_options = decode_tl(entry['chat']), entry['options']
+                    self.from_user = decode_tl(entry.get('from_user'))
+                else:
+                    self._entries[json.dumps(entry['k'])].append(entry)
+
+    def _take(self, key: list) -> dict:
+        queue_key = json.dumps(key)
+        queue = self._entries.get(queue_key)
+        if queue:
+            entry = queue.popleft()
+            self._last[queue_key] = entry
+            return entry
+        if queue_key in self._last:
+            return self._last[queue_key]
+        raise LookupError(f"Call not found in cassette {self.path.name}: {key}")
+
+    async def _replay(self, entry: dict):
+        if entry['t'] and self.latency_scale:
+            await asyncio.sleep(entry['t'] * self.latency_scale)
+        if entry.get('error'):
+            if entry['error'] == 'FloodWaitError':
+                raise FloodWaitError(None, capture=entry.get('seconds') or 0)
+            raise RuntimeError(f"{entry['error']}: {entry.get('message')}")
+
+    def _build_message(self, fields: Optional[list]):
+        if not fields:
+            return None
+        msg = decode_tl(fields[0])
+        entities = {get_peer_id(entity): entity for entity in map(decode_tl, fields[1])}
+        msg._finish_init(self, entities, None)
+        return msg
+
+    async def iter_messages(self, entity, *args, **kwargs):
+        key = _iter_messages_key(entity, kwargs)
+        while True:
+            entry = self._take(key)
+            await self._replay(entry)
+            if entry.get('end'):
+                return
+            yield self._build_message(entry['m'])
+
+    async def get_messages(self, entity, *args, **kwargs):
+        key = _get_messages_key(entity, args, kwargs)
+        entry = self._take(key)
+        await self._replay(entry)
+        if 'messages' in entry:
+            result = TotalList(self._build_message(fields) for fields in entry['messages'])
+            result.total = entry.get('total')
+            return result
+        return self._build_message(entry.get('message'))
+
+    async def get_entity(self, peer, *args, **kwargs):
+        entry = self._take(['get_entity', _peer_key(peer)])
+        await self._replay(entry)
+        return decode_tl(entry.get('e'))
+
+    async def get_input_entity(self, peer):
+        return peer
+
+    async def download_media(self, message, file=None, *args, progress_callback=None, **kwargs):
+        entry = self._take(['download_media', getattr(message, 'id', None)])
+        if entry.get('error') or not entry.get('size'):
+            await self._replay(entry)
+            return None
+        written = 0
+        async for chunk in self._replay_chunks(entry, DOWNLOAD_CHUNK_SIZE):
+            file.write(chunk)
+            written += len(chunk)
+            if progress_callback:
+                progress_callback(written, entry['size'])
+        return file
+
+    async def iter_download(self, file, *args, offset: int = 0, request_size: int = DOWNLOAD_CHUNK_SIZE, **kwargs):
+        entry = self._take(['iter_download', getattr(file, 'id', None), offset])
+        if entry.get('error'):
+            await self._replay(entry)
+        async for chunk in self._replay_chunks(entry, request_size):
+            yield chunk
+
+    # Media content is not recorded: the recorded number of bytes is served as zeros, with the recorded
+    # download time spread evenly over the chunks.
+    async def _replay_chunks(self, entry: dict, chunk_size: int):
+        size = entry.get('size') or 0
+        chunks = max(1, -(-size // chunk_size))
+        sent = 0
+        for _ in range(chunks):
+            if entry['t'] and self.latency_scale:
+                await asyncio.sleep(entry['t'] * self.latency_scale / chunks)
+            chunk = min(chunk_size, size - sent)
+            sent += chunk
+            yield b'\0' * chunk
+
+    async def disconnect(self):
+        pass
+
@@ -1,7 +1,8 @@
 from pathlib import Path
-from typing import Optional, List
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
+from typing import TYPE_CHECKING, Optional, List
+
+if TYPE_CHECKING:
+    from telethon import TelegramClient
 
 
 class ClientManager:
@@ -15,6 +16,8 @@ class ClientManager:
 
     async def create_new_session(self):
         print("\n➕ CREATE NEW SESSION (get credentials at https://my.telegram.org)")
+        from telethon import TelegramClient
+        from telethon.errors import SessionPasswordNeededError
         try:
             api_id = input("API ID: ").strip()
             api_hash = input("API Hash: ").strip()
@@ -48,7 +51,8 @@ class ClientManager:
         except Exception as e:
             print(f"❌ Authorization error: {e}")
 
-    async def get_client(self, session_name: str) -> Optional[TelegramClient]:
+    async def get_client(self, session_name: str) -> Optional['TelegramClient']:
+        from telethon import TelegramClient
         session_path = str(self.sessions_folder / session_name)
         self.client = TelegramClient(session_path, 12345, '0123456789abcdef0123456789abcdef')
         try:
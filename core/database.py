@@ -0,0 +1,349 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from peewee import (Model, SqliteDatabase, TextField, DateTimeField, IntegerField, BooleanField, fn, chunked)
+
+from . import utils
+from .message_record import MessageRecord
+
+# The models are bound to no open database: queries are built against this one, which is never opened, and run
+# through the database of the export they belong to.
+schema_db = SqliteDatabase(None)
+
+INSERT_CHUNK_SIZE = 200
+
+# Folder exports keep their database under this name, so they can later be synced with the chat.
+STORE_NAME = 'messages.db'
+
+# Every export loads a database of its own, so durability is traded for ingest speed while loading: WAL keeps
+# readers and the writer apart and fsyncs are skipped entirely. An export that fails is thrown away with its
+# database; one that is kept (see STORE_NAME) is only kept once complete, after finish_ingest() has turned
+# the fsyncs back on, and is opened with open_store() from then on.
+INGEST_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'off',
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+}
+
+
+class MessageModel(Model):
+    telegram_message_id = IntegerField(primary_key=True)
+    grouped_id = IntegerField(null=True)
+    date = DateTimeField()
+    sender_id = IntegerField(null=True)
+    sender = TextField(null=True)
+    # Plain text; its formatting is in text_entities (see utils.entities_to_json).
+    text = TextField(null=True)
+    text_entities = TextField(null=True)
+    reply_to_msg_id = IntegerField(null=True)
+    reply_to = TextField(null=True)
+    forward_from_id = IntegerField(null=True)
+    forwarded_from = TextField(null=True)
+    media_path = TextField(null=True)
+    media_type = TextField(null=True)
+    media_size = IntegerField(null=True)
+    media_mime = TextField(null=True)
+    media_file_name = TextField(null=True)
+    media_placeholder = TextField(null=True)
+    # The media file is a thumbnail of the original (see MediaHandler.preview), which stays on Telegram.
+    media_preview = BooleanField(null=True)
+    # Rank of the media in the download plan while it waits for the media pass (see core/media_pass.py).
+    media_pending = IntegerField(null=True)
+    action_type = TextField(null=True)
+    action_text = TextField(null=True)
+    edit_date = DateTimeField(null=True)
+
+    class Meta:
+        database = schema_db
+        indexes = (
+            (('date', 'telegram_message_id'), False),
+            (('grouped_id',), False),
+        )
+
+
+# What a kept store was exported from: the chat id and the options its pages were rendered with.
+class ExportInfoModel(Model):
+    key = TextField(primary_key=True)
+    value = TextField(null=True)
+
+    class Meta:
+        database = schema_db
+        table_name = 'export_info'
+
+
+# Queries run through the database they are given (``db.execute``), so several exports can each work on
+# their own database in one process; the models stay bound to none of them.
+def open_database(db_path: Path) -> SqliteDatabase:
+    db = SqliteDatabase(db_path, pragmas=INGEST_PRAGMAS)
+    db.connect()
+    with db.bind_ctx([MessageModel, ExportInfoModel]):
+        db.create_tables([MessageModel, ExportInfoModel])
+    return db
+
+
+# Stores kept by an older version get the columns added since.
+def open_store(db_path: Path) -> SqliteDatabase:
+    db = SqliteDatabase(db_path, pragmas={'journal_mode': 'wal', 'synchronous': 'normal'})
+    db.connect()
+    table = MessageModel._meta.table_name
+    columns = {column.name for column in db.get_columns(table)}
+    missing = [field for field in MessageModel._meta.sorted_fields if field.column_name not in columns]
+    if missing:
+        from playhouse.migrate import SqliteMigrator, migrate
+        migrator = SqliteMigrator(db)
+        migrate(*(migrator.add_column(table, field.column_name, field) for field in missing))
+    return db
+
+
+def set_export_info(db: SqliteDatabase, **values):
+    rows = [{'key': key, 'value': json.dumps(value)} for key, value in values.items()]
+    db.execute(ExportInfoModel.insert_many(rows).on_conflict_replace())
+
+
+def get_export_info(db: SqliteDatabase) -> dict:
+    query = ExportInfoModel.select(ExportInfoModel.key, ExportInfoModel.value)
+    return {key: json.loads(value) for key, value in db.execute(query)}
+
+
+def finish_ingest(db: SqliteDatabase):
+    db.pragma('synchronous', 'normal')
+    db.execute_sql('PRAGMA optimize')
+
+
+def insert_messages(db: SqliteDatabase, rows: List[dict]):
+    with db.atomic():
+        for chunk in chunked(rows, INSERT_CHUNK_SIZE):
+            db.execute(MessageModel.insert_many(chunk))
+
+
+# Runs every insert on a dedicated thread so SQLite never blocks the event loop. Batches go through
+# a bounded queue, so ``submit`` only waits when the writer falls behind.
+class DatabaseWriter:
+    def __init__(self, db: SqliteDatabase, max_pending_batches: int = 4):
+        self.db = db
+        self._queue = asyncio.Queue(maxsize=max_pending_batches)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._task = None
+        self._error: Optional[BaseException] = None
+        self.flush_latencies: List[float] = []
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, rows: List[dict]):
+        if self._error:
+            raise self._error
+        await self._queue.put(rows)
+
+    async def close(self):
+        await self._queue.put(None)
+        await self._task
+        # The writer thread holds its own connection; it has to be closed from that same thread.
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.db.close)
+        self._executor.shutdown()
+
+    # Raises what went wrong on the writer thread. close() only shuts down, so it never takes the place of
+    # the error an ingestion is already failing with.
+    def check(self):
+        if self._error:
+            raise self._error
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = await self._queue.get()
+            if rows is None:
+                break
+            if self._error:
+                continue
+            try:
+                await loop.run_in_executor(self._executor, self._flush, rows)
+            except Exception as e:
+                self._error = e
+
+    def _flush(self, rows: List[dict]):
+        started = time.perf_counter()
+        insert_messages(self.db, rows)
+        self.flush_latencies.append(time.perf_counter() - started)
+
+
+def parse_date(value) -> datetime:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def message_group_stats(db: SqliteDatabase) -> Tuple[int, Optional[datetime], Optional[datetime]]:
+    renderable = ((fn.NULLIF(MessageModel.text, '').is_null(False)) | (MessageModel.media_path.is_null(False)) |
+                  (MessageModel.action_text.is_null(False)) | (MessageModel.media_placeholder.is_null(False)))
+    group_key = fn.COALESCE(MessageModel.grouped_id, MessageModel.telegram_message_id)
+    query = (MessageModel
+             .select(fn.COUNT(group_key.distinct()), fn.MIN(MessageModel.date), fn.MAX(MessageModel.date))
+             .where(renderable))
+    count, first_date, last_date = db.execute(query).fetchone()
+    return count, parse_date(first_date), parse_date(last_date)
+
+
+def iter_message_groups(db: SqliteDatabase, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None) -> Iterator[MessageRecord]:
+    query = (MessageModel
+             .select(MessageModel.telegram_message_id, MessageModel.grouped_id, MessageModel.date,
+                     MessageModel.sender, MessageModel.text, MessageModel.text_entities, MessageModel.reply_to,
+                     MessageModel.forwarded_from, MessageModel.media_path, MessageModel.media_type,
+                     MessageModel.media_size, MessageModel.media_preview, MessageModel.media_placeholder,
+                     MessageModel.media_pending, MessageModel.action_text)
+             .order_by(MessageModel.date, MessageModel.telegram_message_id))
+    if since:
+        query = query.where(MessageModel.date >= since)
+    if until:
+        query = query.where(MessageModel.date < until)
+
+    # Plain tuples straight from the sqlite cursor: no model instances, no result cache, and none of
+    # peewee's DateTimeField conversion, which tries several strptime formats on our tz-aware values.
+    # Items of one album are adjacent in this order, so only the album being built is kept in memory.
+    cursor = db.execute(query)
+    current, current_key = None, None
+    for (msg_id, grouped_id, date, sender, text, entities, reply_to, forwarded_from, media_path, media_type,
+         media_size, media_preview, placeholder, pending, action_text) in cursor:
+        text = utils.markdown_text(text, entities)
+        key = grouped_id or msg_id
+        if key != current_key:
+            if current is not None:
+                yield current
+            current_key = key
+            reply = json.loads(reply_to) if reply_to else {}
+            forwarded = json.loads(forwarded_from) if forwarded_from else {}
+            current = MessageRecord(parse_date(date), sender, text, reply.get('from'), reply.get('text'),
+                                    forwarded.get('from'), media_placeholder=placeholder, action_text=action_text)
+
+        if text:
+            current.text = text
+        if media_path:
+            current.add_media(media_path, media_type, media_size, bool(media_preview))
+        if pending is not None:
+            current.media_pending = True
+
+    if current is not None:
+        yield current
+
+
+def iter_message_rows(db: SqliteDatabase) -> Iterator[dict]:
+    query = MessageModel.select().order_by(MessageModel.date, MessageModel.telegram_message_id)
+    cursor = db.execute(query)
+    columns = [column[0] for column in cursor.description]
+    for row in cursor:
+        record = dict(zip(columns, row))
+        record['date'] = parse_date(record['date'])
+        if record['edit_date']:
+            record['edit_date'] = parse_date(record['edit_date'])
+        yield record
+
+
+# Media downloaded after their messages were stored: (message id, path, media type, is a preview).
+def set_media_files(db: SqliteDatabase, files: List[Tuple[int, str, str, Optional[bool]]]):
+    with db.atomic():
+        for msg_id, path, media_type, preview in files:
+            db.execute(MessageModel
+                       .update(media_path=path, media_type=media_type, media_preview=preview, media_placeholder=None,
+                               media_pending=None)
+                       .where(MessageModel.telegram_message_id == msg_id))
+
+
+# Leaves the media of these messages to the media pass, which downloads them in the order given. Their
+# placeholder stays as it is; the page shows them as pending while media_pending is set.
+def mark_media_pending(db: SqliteDatabase, msg_ids: List[int]):
+    with db.atomic():
+        for rank, msg_id in enumerate(msg_ids):
+            db.execute(MessageModel.update(media_pending=rank).where(MessageModel.telegram_message_id == msg_id))
+
+
+def clear_media_pending(db: SqliteDatabase, msg_ids: List[int]):
+    with db.atomic():
+        for chunk in chunked(msg_ids, INSERT_CHUNK_SIZE):
+            db.execute(MessageModel.update(media_pending=None).where(MessageModel.telegram_message_id.in_(chunk)))
+
+
+# Queues the messages showing these files for the media pass again, after what is pending already.
+def requeue_media_paths(db: SqliteDatabase, paths: List[str]) -> int:
+    rank = (db.execute(MessageModel.select(fn.MAX(MessageModel.media_pending))).fetchone()[0] or 0) + 1
+    count = 0
+    with db.atomic():
+        for chunk in chunked(paths, INSERT_CHUNK_SIZE):
+            query = (MessageModel.select(MessageModel.telegram_message_id)
+                     .where(MessageModel.media_path.in_(chunk))
+                     .order_by(MessageModel.date))
+            for msg_id, in list(db.execute(query)):
+                db.execute(MessageModel.update(media_pending=rank + count)
+                           .where(MessageModel.telegram_message_id == msg_id))
+                count += 1
+    return count
+
+
+def iter_pending_media(db: SqliteDatabase) -> Iterator[Tuple[int, datetime, Optional[int]]]:
+    query = (MessageModel
+             .select(MessageModel.telegram_message_id, MessageModel.date, MessageModel.media_size)
+             .where(MessageModel.media_pending.is_null(False))
+             .order_by(MessageModel.media_pending))
+    for msg_id, date, size in db.execute(query):
+        yield msg_id, parse_date(date), size
+
+
+def iter_previews(db: SqliteDatabase) -> Iterator[dict]:
+    query = (MessageModel
+             .select(MessageModel.telegram_message_id, MessageModel.media_path, MessageModel.media_type,
+                     MessageModel.media_size, MessageModel.media_mime, MessageModel.media_file_name)
+             .where(MessageModel.media_preview == True)
+             .order_by(MessageModel.telegram_message_id))
+    for msg_id, path, media_type, size, mime, file_name in db.execute(query):
+        yield {'message_id': msg_id, 'thumbnail': path, 'type': media_type, 'size': size, 'mime_type': mime,
+               'file_name': file_name}
+
+
+def iter_message_versions(db: SqliteDatabase) -> Iterator[Tuple[int, datetime, Optional[datetime]]]:
+    query = (MessageModel
+             .select(MessageModel.telegram_message_id, MessageModel.date, MessageModel.edit_date)
+             .order_by(MessageModel.telegram_message_id))
+    for msg_id, date, edit_date in db.execute(query):
+        yield msg_id, parse_date(date), parse_date(edit_date) if edit_date else None
+
+
+# Edits as (message id, plain text, entities as JSON, edit date).
+def update_message_texts(db: SqliteDatabase, edits: List[Tuple[int, str, Optional[str], datetime]]):
+    with db.atomic():
+        for msg_id, text, entities, edit_date in edits:
+            db.execute(MessageModel.update(text=text, text_entities=entities, edit_date=edit_date)
+                       .where(MessageModel.telegram_message_id == msg_id))
+
+
+# Replies keep a preview of the message they answer. Previews of edited messages get the new text and those
+# of deleted messages are dropped, as a new export would show them; returns the dates of the replies changed.
+def refresh_reply_previews(db: SqliteDatabase, texts: Dict[int, str], deleted: List[int]) -> List[datetime]:
+    dates = []
+    with db.atomic():
+        for chunk in chunked(list(texts) + list(deleted), INSERT_CHUNK_SIZE):
+            query = (MessageModel
+                     .select(MessageModel.telegram_message_id, MessageModel.date, MessageModel.reply_to_msg_id,
+                             MessageModel.reply_to)
+                     .where(MessageModel.reply_to_msg_id.in_(chunk)))
+            for msg_id, date, reply_to_msg_id, reply_to in list(db.execute(query)):
+                if reply_to_msg_id in texts:
+                    if not reply_to:
+                        continue
+                    reply_to = json.dumps(dict(json.loads(reply_to), text=texts[reply_to_msg_id]))
+                else:
+                    reply_to = None
+                db.execute(MessageModel.update(reply_to=reply_to).where(MessageModel.telegram_message_id == msg_id))
+                dates.append(parse_date(date))
+    return dates
+
+
+def delete_messages(db: SqliteDatabase, msg_ids: List[int]):
+    with db.atomic():
+        for chunk in chunked(msg_ids, INSERT_CHUNK_SIZE):
+            db.execute(MessageModel.delete().where(MessageModel.telegram_message_id.in_(chunk)))
@@ -0,0 +1,132 @@
+import gzip
+import json
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telethon import TelegramClient
+
+from .utils import decode_tl, encode_tl
+
+CACHE_VERSION = 1
+
+
+class CachedDialog:
+    def __init__(self, dialog_id: int, entity, name: str, top_message_id: Optional[int], pinned: bool = False):
+        self.id = dialog_id
+        self.entity = entity
+        self.name = name
+        self.top_message_id = top_message_id
+        self.pinned = pinned
+        self.username = (getattr(entity, 'username', None) or '').lower()
+
+    @classmethod
+    def from_dialog(cls, dialog) -> 'CachedDialog':
+        return cls(dialog.id, dialog.entity, dialog.name, dialog.message.id if dialog.message else None,
+                   dialog.pinned)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'CachedDialog':
+        return cls(data['id'], decode_tl(data['entity']), data['name'], data.get('top'), data.get('pinned', False))
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'entity': encode_tl(self.entity), 'name': self.name, 'top': self.top_message_id,
+                'pinned': self.pinned}
+
+
+# The dialog list of one session, kept on disk next to its .session file. Telegram returns dialogs
+# newest first, so a refresh only reads until the first dialog whose top message is unchanged since the
+# last one: everything after it is known already. That is usually a single request instead of paging
+# through every dialog of the account. Lookups by id, username and name go through in-memory indexes.
+class DialogCache:
+    def __init__(self, client: TelegramClient, path: Path):
+        self.client = client
+        self.path = path
+        self.dialogs: List[CachedDialog] = []
+        self.loaded = False
+        self._by_id: Dict[int, CachedDialog] = {}
+        self._by_username: Dict[str, CachedDialog] = {}
+        self._words: List[tuple] = []
+        self._load()
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.dialogs = [CachedDialog.from_dict(entry) for entry in data['dialogs']]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if self.path.exists():
+                print(f"⚠️ Warning: Ignoring unreadable chat list cache '{self.path.name}': {e}")
+            self.dialogs = []
+        self._index()
+
+    def _save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'dialogs': [d.to_dict() for d in self.dialogs]}, f)
+        tmp_path.replace(self.path)
+
+    def _index(self):
+        self._by_id = {d.id: d for d in self.dialogs}
+        self._by_username = {d.username: d for d in self.dialogs if d.username}
+        self._words = sorted((word, position) for position, d in enumerate(self.dialogs)
+                             for word in d.name.lower().split())
+
+    async def refresh(self, full: bool = False) -> List[CachedDialog]:
+        fresh, seen = [], set()
+        complete = True
+        async for dialog in self.client.iter_dialogs():
+            entry = CachedDialog.from_dialog(dialog)
+            known = self._by_id.get(entry.id)
+            # Pinned dialogs are listed first whatever their age, so they never mark the end of the news.
+            if (not full and not entry.pinned and known
+                    and known.top_message_id == entry.top_message_id and not known.pinned):
+                complete = False
+                break
+            if entry.id not in seen:
+                seen.add(entry.id)
+                fresh.append(entry)
+
+        self.dialogs = fresh if complete else fresh + [d for d in self.dialogs if d.id not in seen]
+        self.loaded = True
+        self._index()
+        try:
+            self._save()
+        except OSError as e:
+            print(f"⚠️ Warning: Could not save chat list cache: {e}")
+        return self.dialogs
+
+    async def ensure_loaded(self) -> List[CachedDialog]:
+        if not self.loaded:
+            await self.refresh()
+        return self.dialogs
+
+    def get(self, peer_id: int) -> Optional[CachedDialog]:
+        return self._by_id.get(peer_id)
+
+    def get_by_username(self, username: str) -> Optional[CachedDialog]:
+        return self._by_username.get(username.lstrip('@').lower())
+
+    # Exact username first, then dialogs with a name word starting with the query, then any other name or
+    # username containing it; each group in dialog order.
+    def search(self, query: str) -> List[CachedDialog]:
+        query = query.strip().lower()
+        if not query:
+            return []
+        matches = {}
+        if exact := self.get_by_username(query):
+            matches[exact.id] = exact
+        prefixed = set()
+        index = bisect_left(self._words, (query,))
+        while index < len(self._words) and self._words[index][0].startswith(query):
+            prefixed.add(self._words[index][1])
+            index += 1
+        for position in sorted(prefixed):
+            matches.setdefault(self.dialogs[position].id, self.dialogs[position])
+        handle = query.lstrip('@')
+        for d in self.dialogs:
+            if d.id not in matches and (query in d.name.lower() or (handle and handle in d.username)):
+                matches[d.id] = d
+        return list(matches.values())
+
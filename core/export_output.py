@@ -0,0 +1,282 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Optional, TextIO
+
+ARCHIVE_FORMATS = ('zip', 'tar.zst')
+
+# Formats that are already compressed: they are stored as-is in zip archives instead of deflated again.
+COMPRESSED_EXTENSIONS = {
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'mp4', 'mov', 'webm', 'mkv', 'avi', 'm4v', 'mp3', 'ogg', 'oga',
+    'opus', 'm4a', 'aac', 'flac', 'zip', 'rar', '7z', 'gz', 'bz2', 'xz', 'zst', 'tgs', 'apk', 'docx', 'xlsx', 'pptx',
+    'parquet', 'br',
+}
+
+
+def is_compressed(name: str) -> bool:
+    return Path(name).suffix.lower().lstrip('.') in COMPRESSED_EXTENSIONS
+
+
+# The spool is handed over to on_commit once the member is complete, and closed by it.
+class _SpooledMember(io.BufferedIOBase):
+    def __init__(self, on_commit):
+        super().__init__()
+        self._file = tempfile.TemporaryFile()
+        self._on_commit = on_commit
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return self._file.write(data)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        if not self.closed:
+            self._file.seek(0)
+            self._on_commit(self._file)
+        super().close()
+
+    def abort(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+# Zip write handles cannot tell() their position, which Telethon's downloader relies on.
+class _ZipMember(io.BufferedIOBase):
+    def __init__(self, handle: BinaryIO, on_close):
+        super().__init__()
+        self._handle = handle
+        self._on_close = on_close
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        written = self._handle.write(data)
+        self._position += written
+        return written
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if self.closed:
+            return
+        self._handle.close()
+        super().close()
+        # Members spooled meanwhile can go into the archive now.
+        self._on_close()
+
+
+class ExportOutput:
+    def __init__(self, location: Path, work_folder: Path):
+        self.location = location
+        self.work_folder = work_folder
+        self.names = set()
+        self._open_names = {}
+
+    def open(self, name: str, compress: bool = True) -> BinaryIO:
+        return self._register(name, self._open(name, compress))
+
+    # For a member that can still fail, such as a download: it only becomes part of the export once closed,
+    # and abort() leaves nothing of it behind.
+    def open_staged(self, name: str, compress: bool = True) -> BinaryIO:
+        return self._register(name, self._open_staged(name, compress))
+
+    def open_text(self, name: str) -> TextIO:
+        return io.TextIOWrapper(self.open(name), encoding='utf-8')
+
+    def add_file(self, name: str, path: Path, compress: bool = True):
+        with open(path, 'rb') as src, self.open(name, compress) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(path)
+
+    # Takes a file of another export as it is; the source is left in place.
+    def copy_file(self, name: str, path: Path, compress: bool = True):
+        with open(path, 'rb') as src, self.open(name, compress) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    def abort(self, stream: BinaryIO):
+        name = self._open_names.pop(id(stream), None)
+        self.names.discard(name)
+        self._abort(stream, name)
+
+    def exists(self, name: str) -> bool:
+        return name in self.names
+
+    def unique_name(self, name: str) -> str:
+        path, counter = Path(name), 1
+        while self.exists(name):
+            name = str(path.with_name(f"{path.stem}_{counter}{path.suffix}").as_posix())
+            counter += 1
+        return name
+
+    def count(self, prefix: str) -> int:
+        return sum(1 for name in self.names if name.startswith(prefix))
+
+    def describe(self, name: str) -> str:
+        return f"{name} (in {self.location.absolute()})"
+
+    def close(self):
+        pass
+
+    def _register(self, name: str, stream: BinaryIO) -> BinaryIO:
+        self.names.add(name)
+        self._open_names[id(stream)] = name
+        return stream
+
+    def _open(self, name: str, compress: bool) -> BinaryIO:
+        raise NotImplementedError
+
+    def _open_staged(self, name: str, compress: bool) -> BinaryIO:
+        return self._open(name, compress)
+
+    def _abort(self, stream: BinaryIO, name: str):
+        raise NotImplementedError
+
+
+class FolderOutput(ExportOutput):
+    def __init__(self, folder: Path):
+        super().__init__(folder, folder)
+        folder.mkdir(parents=True, exist_ok=True)
+
+    def exists(self, name: str) -> bool:
+        return name in self.names or (self.location / name).exists()
+
+    def describe(self, name: str) -> str:
+        return str((self.location / name).absolute())
+
+    def add_file(self, name: str, path: Path, compress: bool = True):
+        target = self.location / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(path, target)
+        self.names.add(name)
+
+    # A hard link costs no space; across file systems the file is copied.
+    def copy_file(self, name: str, path: Path, compress: bool = True):
+        target = self.location / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copyfile(path, target)
+        self.names.add(name)
+
+    def _open(self, name: str, compress: bool) -> BinaryIO:
+        path = self.location / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return open(path, 'wb')
+
+    def _abort(self, stream: BinaryIO, name: str):
+        stream.close()
+        try:
+            os.remove(self.location / name)
+        except OSError:
+            pass
+
+
+class ZipOutput(ExportOutput):
+    def __init__(self, archive_path: Path):
+        super().__init__(archive_path, archive_path.parent)
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        self._zip = zipfile.ZipFile(archive_path, 'w', allowZip64=True)
+        self._active = None
+        self._pending = []
+
+    def close(self):
+        self._add_pending()
+        self._zip.close()
+
+    # Members are streamed straight into the archive. A zip file only accepts one open write handle,
+    # so a member opened while another one is still being written is spooled and added when closed.
+    def _open(self, name: str, compress: bool) -> BinaryIO:
+        if self._active is not None and not self._active.closed:
+            return _SpooledMember(lambda spool: self._add(name, compress, spool))
+        handle = self._zip.open(self._zip_info(name, compress), 'w', force_zip64=True)
+        self._active = _ZipMember(handle, self._add_pending)
+        return self._active
+
+    # Bytes streamed into the archive cannot be taken back, so a member that can fail is spooled and only
+    # added once complete.
+    def _open_staged(self, name: str, compress: bool) -> BinaryIO:
+        return _SpooledMember(lambda spool: self._add(name, compress, spool))
+
+    def _abort(self, stream: BinaryIO, name: str):
+        stream.abort()
+
+    # A spool completed while a member is still streamed waits for that member to be closed.
+    def _add(self, name: str, compress: bool, spool: BinaryIO):
+        if self._active is not None and not self._active.closed:
+            self._pending.append((name, compress, spool))
+            return
+        with spool, self._zip.open(self._zip_info(name, compress), 'w', force_zip64=True) as member:
+            while chunk := spool.read(1024 * 1024):
+                member.write(chunk)
+
+    def _add_pending(self):
+        while self._pending:
+            self._add(*self._pending.pop(0))
+
+    @staticmethod
+    def _zip_info(name: str, compress: bool) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        return info
+
+
+class TarZstOutput(ExportOutput):
+    def __init__(self, archive_path: Path, level: int = 3):
+        import zstandard
+
+        super().__init__(archive_path, archive_path.parent)
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        self._raw = open(archive_path, 'wb')
+        self._compressor = zstandard.ZstdCompressor(level=level, threads=-1).stream_writer(self._raw)
+        self._tar = tarfile.open(fileobj=self._compressor, mode='w|', format=tarfile.PAX_FORMAT)
+
+    def close(self):
+        self._tar.close()
+        self._compressor.close()
+        self._raw.close()
+
+    # A tar header carries the member size, so each member is spooled to a temporary file first and
+    # appended to the compressed stream once complete.
+    def _open(self, name: str, compress: bool) -> BinaryIO:
+        return _SpooledMember(lambda spool: self._add(name, spool))
+
+    def _abort(self, stream: BinaryIO, name: str):
+        stream.abort()
+
+    def _add(self, name: str, spool: BinaryIO):
+        info = tarfile.TarInfo(name)
+        info.size = spool.seek(0, io.SEEK_END)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        spool.seek(0)
+        with spool:
+            self._tar.addfile(info, spool)
+
+
+def open_output(base_path: Path, archive_format: Optional[str] = None) -> ExportOutput:
+    # Exports running side by side can start within the same second, so a taken name gets a counter.
+    extension = f".{archive_format}" if archive_format else ''
+    path, counter = base_path, 1
+    while path.with_name(path.name + extension).exists():
+        counter += 1
+        path = base_path.with_name(f"{base_path.name}_{counter}")
+    if archive_format == 'zip':
+        return ZipOutput(path.with_name(path.name + '.zip'))
+    if archive_format == 'tar.zst':
+        return TarZstOutput(path.with_name(path.name + '.tar.zst'))
+    return FolderOutput(path)
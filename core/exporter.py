@@ -1,69 +1,162 @@
 import asyncio
+import heapq
 import json
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, List, Optional
 
-from peewee import (Model, SqliteDatabase, TextField, DateTimeField, Proxy, IntegerField)
 from telethon import TelegramClient
 from telethon.tl.types import (User, Chat, Channel, Message, MessageActionChannelCreate,
                                MessageActionChatAddUser, MessageActionChatDeleteUser,
                                MessageActionChatJoinedByLink, MessageActionPinMessage)
-from tqdm.asyncio import tqdm as async_tqdm
+from telethon.utils import get_peer_id
 
 from . import utils
-from .html_generator import HtmlGenerator
-from .media_handler import MediaHandler
+from .database import (STORE_NAME, DatabaseWriter, open_database, finish_ingest, iter_message_groups,
+                       iter_message_rows, mark_media_pending, message_group_stats, set_export_info,
+                       set_media_files)
+from .export_output import FolderOutput, open_output
+from .html_generator import HTML_INDEX_NAME, HtmlGenerator
+from .json_generator import JsonGenerator
+from .media_manifest import MediaManifest, reusable_media
+from .media_scheduler import MediaScheduler, PlannedMedia
+from .message_record import page_records
+from .metrics import ExportMetrics
+from .precompress import open_page
+from .profiler import PROFILE_STACKS_NAME, PROFILE_SUMMARY_NAME, SamplingProfiler
 from .settings import DelaySettings
+from .sync import SYNC_BATCH_SIZE
 
-db_proxy = Proxy()
+if TYPE_CHECKING:
+    from .media_handler import MediaHandler
 
+OUTPUT_FORMATS = ('html', 'json', 'jsonl', 'parquet')
 
-class MessageModel(Model):
-    telegram_message_id = IntegerField(primary_key=True)
-    grouped_id = IntegerField(null=True)
-    date = DateTimeField()
-    sender = TextField(null=True)
-    text = TextField(null=True)
-    reply_to = TextField(null=True)
-    forwarded_from = TextField(null=True)
-    media_path = TextField(null=True)
-    media_type = TextField(null=True)
-    media_placeholder = TextField(null=True)
-    action_text = TextField(null=True)
+INGEST_BATCH_SIZE = 2000
 
-    class Meta:
-        database = db_proxy
+# Message ids per unit of work when the ingestion of one chat is shared between sessions.
+SHARD_SIZE = 5000
+
+ACTION_TYPES = {
+    MessageActionChannelCreate: 'create_channel',
+    MessageActionChatAddUser: 'invite_members',
+    MessageActionChatDeleteUser: 'remove_members',
+    MessageActionChatJoinedByLink: 'join_group_by_link',
+    MessageActionPinMessage: 'pin_message',
+}
+
+
+# Interleaves several newest-first histories of the same chat (one per search filter) into one, dropping
+# messages that more than one filter returned. Telethon's iterators restart when ``__aiter__`` is called
+# again, so each one is entered exactly once and advanced by hand.
+async def _merge_newest_first(histories: List[AsyncIterator]) -> AsyncIterator[Message]:
+    iterators = [history.__aiter__() for history in histories]
+
+    async def advance(index: int) -> Optional[Message]:
+        while True:
+            try:
+                msg = await iterators[index].__anext__()
+            except StopAsyncIteration:
+                return None
+            if msg:
+                return msg
+
+    heads = []
+    for index in range(len(iterators)):
+        if msg := await advance(index):
+            heads.append((-msg.id, index, msg))
+    heapq.heapify(heads)
+    last_id = None
+    while heads:
+        _, index, msg = heads[0]
+        if msg.id != last_id:
+            last_id = msg.id
+            yield msg
+        if following := await advance(index):
+            heapq.heapreplace(heads, (-following.id, index, following))
+        else:
+            heapq.heappop(heads)
 
 
 class ChatExporter:
-    def __init__(self, client: TelegramClient, delay_settings: DelaySettings):
+    def __init__(self, client: TelegramClient, delay_settings: DelaySettings, helpers: Optional[List[tuple]] = None):
         self.client = client
         self.delay_settings = delay_settings
+        # (client, entity) pairs of other sessions that are members of the same chat and share its ingestion.
+        self.helpers = helpers or []
+        self.output = None
         self.export_folder = None
-        self.media_folder = None
         self.db_path = None
         self.db = None
+        self.metrics = None
+        # Set when the media are planned (budget, quotas, priority): they are then downloaded after ingestion.
+        self.media_scheduler: Optional[MediaScheduler] = None
+        # Two-phase export: the plan is only recorded and the media pass downloads it into the export later.
+        self.media_later = False
+        self.media_manifest: Optional[MediaManifest] = None
+        # Intact media files of earlier exports of the chat, by Telegram media id (see core/media_manifest.py).
+        self.reusable_media = {}
 
     def _init_db(self):
-        self.db_path = self.export_folder / f"temp_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-        self.db = SqliteDatabase(self.db_path)
-        db_proxy.initialize(self.db)
-        self.db.connect()
-        self.db.create_tables([MessageModel])
+        self.db_path = self.output.work_folder / f"temp_data_{self.output.location.name}.db"
+        self.db = open_database(self.db_path)
 
     async def export_chat(self, entity, download_media: bool, max_file_size: Optional[float] = None,
-                          start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+                          start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                          output_formats: Iterable[str] = ('html',), archive_format: Optional[str] = None,
+                          media_types: Optional[Iterable[str]] = None, media_only: bool = False,
+                          from_user=None, search: Optional[str] = None, media_preview: bool = False,
+                          media_budget_mb: Optional[float] = None, media_quotas: Optional[Dict[str, float]] = None,
+                          media_priority: Optional[List[str]] = None, media_later: bool = False,
+                          minify_html: bool = False, html_precompress: Optional[Iterable[str]] = None):
+        media_types = sorted(media_types) if media_types else None
+        html_precompress = list(html_precompress or [])
+        search = search or None
         chat_name = self._get_entity_name(entity)
         safe_name = utils.sanitize_filename(chat_name)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.export_folder = Path(f"exports/{safe_name}_{timestamp}")
-        self.export_folder.mkdir(parents=True, exist_ok=True)
-
+        self.output = open_output(Path(f"exports/{safe_name}_{timestamp}"), archive_format)
+        self.export_folder = self.output.location if isinstance(self.output, FolderOutput) else None
+        self.metrics = ExportMetrics(chat_name)
+        self.metrics.instrument(self.client)
+        if self.helpers and not isinstance(entity, Channel):
+            # Only channels and supergroups number their messages the same way for every account.
+            print("⚠️ Warning: Only channels and supergroups can be split across sessions; using one session.")
+            self.helpers = []
+        if self.helpers and self.delay_settings.record_cassette:
+            print("⚠️ Warning: A cassette records a single session; the other sessions are not used.")
+            self.helpers = []
+        for helper_client, _ in self.helpers:
+            self.metrics.instrument(helper_client)
+        self.media_later = media_later and download_media
+        if self.media_later and not self.export_folder:
+            print("⚠️ Warning: Only folder exports can get their media in a later pass; downloading it now.")
+            self.media_later = False
         if download_media:
-            self.media_folder = self.export_folder / "media"
-            self.media_folder.mkdir(exist_ok=True)
+            self.media_manifest = MediaManifest(get_peer_id(entity))
+            self.reusable_media = reusable_media(self.output.location.parent, f"{safe_name}_",
+                                                 self.media_manifest.chat_id, exclude=self.output.location)
+        if download_media and (self.media_later or media_budget_mb is not None or media_quotas or media_priority):
+            self.media_scheduler = MediaScheduler(media_budget_mb, media_quotas, media_priority)
+        recorder = None
+        if self.delay_settings.record_cassette:
+            from .cassette import CassetteRecorder
+            recorder = CassetteRecorder(self.client,
+                                        self.output.work_folder / f"{self.output.location.name}.cassette.gz")
+            recorder.start()
+            recorder.record_export(entity, from_user, download_media=download_media, max_file_size=max_file_size,
+                                   start_date=start_date.isoformat() if start_date else None,
+                                   end_date=end_date.isoformat() if end_date else None,
+                                   output_formats=list(output_formats), archive_format=archive_format,
+                                   media_types=media_types, media_only=media_only, search=search,
+                                   media_preview=media_preview, media_budget_mb=media_budget_mb,
+                                   media_quotas=media_quotas, media_priority=media_priority, media_later=media_later,
+                                   minify_html=minify_html, html_precompress=html_precompress)
+        profiler = None
+        if self.delay_settings.profile:
+            profiler = SamplingProfiler(f"export of {chat_name}", ChatExporter.export_chat)
+            profiler.start()
 
         try:
             self._init_db()
@@ -75,12 +168,34 @@ class ChatExporter:
             print("📥 EXPORT STARTED")
             print(f"{'=' * 60}")
             print(f" 💬 Chat:          {chat_name}")
-            print(f" 📁 Folder:        {self.export_folder.absolute()}")
+            print(f" 📁 Output:        {self.output.location.absolute()}")
             print(f" 🗓️ Date range:    {from_str} -> {to_str}")
-            print(f" 🖼️ Media:         {'Yes' if download_media else 'No'}")
-            if download_media:
+            if from_user:
+                print(f" 👤 From:          {self._get_entity_name(from_user)}")
+            if search:
+                print(f" 🔎 Search:        \"{search}\"")
+            print(f" 🖼️ Media:         {('Previews' if media_preview else 'Yes') if download_media else 'No'}")
+            if download_media and not media_preview:
                 max_size_str = f"{max_file_size} MB" if max_file_size else "No limit"
                 print(f" 📦 Max file size: {max_size_str}")
+            if download_media:
+                print(f" 🎞️ Media types:   {', '.join(media_types) if media_types else 'All'}")
+            if self.reusable_media:
+                print(f" ♻️ Reusable:      {len(self.reusable_media)} file(s) of earlier exports of this chat")
+            if self.media_scheduler:
+                print(f" 📋 Media budget:  {f'{media_budget_mb} MB' if media_budget_mb is not None else 'No limit'}")
+                if media_quotas:
+                    print(f" 📋 Quotas:        {', '.join(f'{kind} {mb} MB' for kind, mb in media_quotas.items())}")
+                print(f" 📋 Priority:      {', '.join(media_priority) if media_priority else 'Message order'}")
+            if self.media_later:
+                print(" ⏳ Media pass:    Later, the text is exported first")
+            if media_only:
+                print(f" 📎 Messages:      Only those with {', '.join(media_types) if media_types else 'media'}")
+            print(f" 🧾 Formats:       {', '.join(output_formats)}")
+            if self.helpers:
+                print(f" 🧵 Sessions:      {1 + len(self.helpers)}")
+            if recorder:
+                print(f" 📼 Recording:     {recorder.path.absolute()}")
             print(f"\n ⚙️ Delays:")
             print(f"    - Messages:    {self.delay_settings.delay_between_messages}s")
             print(f"    - Media:       {self.delay_settings.delay_between_media}s")
@@ -88,66 +203,239 @@ class ChatExporter:
             print(f"{'=' * 60}")
 
             total_messages = await self._data_ingestion_pass(entity, download_media, max_file_size, start_date,
-                                                             end_date)
-            self._html_generation_pass(chat_name, total_messages, start_date, end_date)
-
-            print(
-                f"\n{'=' * 60}\n✨ EXPORT COMPLETED!\n📄 File: {(self.export_folder / 'messages.html').absolute()}\n📊 Messages: {total_messages}")
-            if download_media and self.media_folder:
-                media_count = sum(1 for f in (self.export_folder / "media").rglob('*') if f.is_file())
+                                                             end_date, media_types, media_only, from_user, search,
+                                                             media_preview)
+            self.metrics.messages = total_messages
+            filters = []
+            if from_user:
+                filters.append(f"from {self._get_entity_name(from_user)}")
+            if search:
+                filters.append(f'matching "{search}"')
+            if media_only:
+                filters.append(f"with {', '.join(media_types) if media_types else 'media'} only")
+            filters = ', '.join(filters) or None
+            set_export_info(self.db, chat_id=get_peer_id(entity), chat_name=chat_name, filters=filters,
+                            start_date=start_date.isoformat() if start_date else None,
+                            end_date=end_date.isoformat() if end_date else None,
+                            media_preview=download_media and media_preview, minify_html=minify_html)
+            if 'html' in output_formats:
+                with self.metrics.phase('render_html'):
+                    self._html_generation_pass(chat_name, total_messages, start_date, end_date, filters,
+                                               minify_html, html_precompress)
+            if 'json' in output_formats or 'jsonl' in output_formats:
+                with self.metrics.phase('render_json'):
+                    self._json_generation_pass(entity, chat_name, output_formats)
+            if 'parquet' in output_formats:
+                with self.metrics.phase('render_parquet'):
+                    self._parquet_generation_pass()
+            if download_media and media_preview and not self.media_later:
+                self._preview_manifest_pass(entity, chat_name)
+            self.metrics.status = 'completed'
+
+            print(f"\n{'=' * 60}\n✨ EXPORT COMPLETED!")
+            if 'html' in output_formats:
+                print(f"📄 File: {self.output.describe('messages.html')}")
+                for fmt in html_precompress:
+                    print(f"🗜️ Pre-compressed: {self.output.describe(f'messages.html.{fmt}')}")
+            if 'json' in output_formats:
+                print(f"🧾 JSON: {self.output.describe('result.json')}")
+            if 'jsonl' in output_formats:
+                print(f"🧾 JSON Lines: {self.output.describe('messages.jsonl')}")
+            if 'parquet' in output_formats:
+                print(f"📊 Parquet dataset: {self.output.describe('parquet')}")
+            print(f"📊 Messages: {total_messages}")
+            if download_media:
+                media_count = self.output.count('media/')
                 print(f"🖼️ Media files: {media_count}")
+                if self.metrics.media_reused:
+                    print(f"♻️ Reused instead of downloaded: {self.metrics.media_reused}")
+            if self.media_later:
+                print(f"⏳ Media pending: {len(self.media_scheduler.planned)} file(s). Download them with "
+                      f"\"Download the pending media of an export\" in the main menu.")
+            print(f"⏱️ Metrics: {self.output.describe('metrics.json')}")
             print("=" * 60)
         except Exception as e:
+            self.metrics.status = 'failed'
             print(f"❌ Error: {e}")
             import traceback
             traceback.print_exc()
             print("💡 Check if the ID/username is correct or if you have access to the chat.")
         finally:
+            if recorder:
+                recorder.stop()
+            if profiler:
+                profiler.stop()
+                try:
+                    profiler.write(self.output)
+                    print(f"🔥 Profile: {self.output.describe(PROFILE_STACKS_NAME)}")
+                    print(f"   Hot functions: {self.output.describe(PROFILE_SUMMARY_NAME)}")
+                except Exception as e:
+                    print(f"⚠️ Warning: Could not write the profile: {e}")
+            self.metrics.release()
+            try:
+                self.metrics.write(self.output, self.delay_settings.prometheus_metrics)
+            except Exception as e:
+                print(f"⚠️ Warning: Could not write metrics report: {e}")
+            # Also for a failed export, so the files it got can be checked and reused.
+            if self.media_manifest and self.media_manifest.entries:
+                try:
+                    self.media_manifest.write(self.output)
+                except Exception as e:
+                    print(f"⚠️ Warning: Could not write the media manifest: {e}")
+            self.output.close()
             if self.db and not self.db.is_closed():
                 self.db.close()
             if self.db_path and self.db_path.exists():
-                try:
-                    os.remove(self.db_path)
-                except OSError as e:
-                    print(f"\n⚠️ Warning: Could not delete temporary database '{self.db_path}'.")
-                    print(f"   Reason: {e}. You can safely delete this file manually.")
+                # A folder export keeps its database, so edits and deletions can be synced into it later.
+                # A two-phase export needs it for its media pass.
+                if (self.metrics.status == 'completed' and self.export_folder
+                        and (self.delay_settings.keep_message_store or self.media_later)):
+                    try:
+                        self.db_path.replace(self.export_folder / STORE_NAME)
+                    except OSError as e:
+                        print(f"\n⚠️ Warning: Could not keep the message store for syncing: {e}")
+                if self.db_path.exists():
+                    try:
+                        for suffix in ('-wal', '-shm'):
+                            sidecar = self.db_path.with_name(self.db_path.name + suffix)
+                            if sidecar.exists(): os.remove(sidecar)
+                        os.remove(self.db_path)
+                    except OSError as e:
+                        print(f"\n⚠️ Warning: Could not delete temporary database '{self.db_path}'.")
+                        print(f"   Reason: {e}. You can safely delete this file manually.")
 
     async def _data_ingestion_pass(self, entity, download_media: bool, max_file_size: Optional[float],
-                                   start_date: Optional[datetime], end_date: Optional[datetime]) -> int:
+                                   start_date: Optional[datetime], end_date: Optional[datetime],
+                                   media_types: Optional[Iterable[str]] = None, media_only: bool = False,
+                                   from_user=None, search: Optional[str] = None, media_preview: bool = False) -> int:
         print("\n⏳ Loading messages and media into database...")
-        media_handler = MediaHandler(self.media_folder, self.delay_settings,
-                                     max_file_size) if download_media else None
+        from tqdm.asyncio import tqdm as async_tqdm
+        # The media pipeline is only loaded for exports that use it.
+        if download_media or media_only:
+            from .media_handler import MediaHandler, media_filters
+            from .parallel_download import ParallelDownloader
+        # Telegram filters the history itself, so only the matching messages are ever fetched.
+        filters = media_filters(media_types) if media_only else []
+        query = {}
+        if from_user:
+            query['from_user'] = from_user
+        if search:
+            query['search'] = search
+
+        def new_media_handler(client: TelegramClient) -> Optional['MediaHandler']:
+            if not download_media:
+                return None
+            # Parts fetched over extra connections bypass the client methods a cassette records; previews
+            # are too small to split.
+            parallel_downloader = None
+            if not self.delay_settings.record_cassette and not media_preview:
+                parallel_downloader = ParallelDownloader(client, self.delay_settings.parallel_connections,
+                                                         self.delay_settings.download_part_size_kb, self.metrics)
+            return MediaHandler(self.output, self.delay_settings, max_file_size, self.metrics, parallel_downloader,
+                                media_types=media_types, preview=media_preview, manifest=self.media_manifest,
+                                reusable=self.reusable_media)
 
         start_date_aware = start_date.replace(tzinfo=timezone.utc) if start_date else None
         end_date_aware = end_date.replace(tzinfo=timezone.utc) if end_date else None
 
-        total_messages_in_range = None
-        if start_date or end_date:
-            print("⏳ Counting messages in the selected date range...")
-            count = 0
-            async for msg in self.client.iter_messages(entity, offset_date=end_date_aware):
-                if start_date_aware and msg.date < start_date_aware:
-                    break
-                count += 1
-            total_messages_in_range = count
-            print(f"Found {total_messages_in_range} messages to export.")
-
         pbar_args = {"unit": " msg", "colour": 'cyan'}
-        if total_messages_in_range is not None:
-            pbar_args['total'] = total_messages_in_range
-            pbar_args['desc'] = "Exporting (date range)"
-        else:
-            total = await self.client.get_messages(entity, limit=0)
-            pbar_args['total'] = total.total
-            pbar_args['desc'] = "Exporting"
+        with self.metrics.phase('count'):
+            if start_date or end_date:
+                pbar_args['desc'] = "Exporting (date range)"
+                # With several sessions each one reads its own part of the range, so it is not walked once
+                # more just to count it.
+                if not self.helpers:
+                    print("⏳ Counting messages in the selected date range...")
+                    count = 0
+                    async for msg in self._iter_history(entity, end_date_aware, filters, query):
+                        if start_date_aware and msg.date < start_date_aware:
+                            break
+                        count += 1
+                    pbar_args['total'] = count
+                    print(f"Found {count} messages to export.")
+            elif filters or query:
+                totals = [await self.client.get_messages(entity, limit=0, filter=f, **query) for f in filters or [None]]
+                pbar_args['total'] = sum(total.total or 0 for total in totals)
+                pbar_args['desc'] = "Exporting (filtered)"
+            else:
+                total = await self.client.get_messages(entity, limit=0)
+                pbar_args['total'] = total.total
+                pbar_args['desc'] = "Exporting"
 
         pbar = async_tqdm(**pbar_args)
 
+        writer = DatabaseWriter(self.db)
+        writer.start()
+
+        # With several sessions every one of them gets its own media handler.
+        media_handler = None if self.helpers else new_media_handler(self.client)
+        with self.metrics.phase('ingestion'):
+            try:
+                if self.helpers:
+                    message_count = await self._ingest_shards(entity, start_date_aware, end_date_aware, filters, query,
+                                                              new_media_handler, writer, pbar)
+                else:
+                    message_count = await self._ingest(self._iter_history(entity, end_date_aware, filters, query),
+                                                       media_handler, writer, pbar, start_date_aware)
+            finally:
+                try:
+                    await writer.close()
+                    self.metrics.db_flush_latencies.extend(writer.flush_latencies)
+                finally:
+                    if media_handler:
+                        await media_handler.close()
+            writer.check()
+        finish_ingest(self.db)
+
+        if pbar.total and pbar.n < pbar.total:
+            pbar.update(pbar.total - pbar.n)
+        pbar.close()
+
+        print(f"\n✅ All {message_count} messages saved to database.")
+        if self.media_later:
+            planned = self._plan_media()
+            mark_media_pending(self.db, [item.msg_id for item in planned])
+        elif self.media_scheduler:
+            with self.metrics.phase('media'):
+                await self._download_planned(entity, new_media_handler(self.client))
+        return message_count
+
+    def _plan_media(self) -> List[PlannedMedia]:
+        scheduler = self.media_scheduler
+        planned = scheduler.plan()
+        print()
+        for line in scheduler.summary():
+            print(line)
+        self.metrics.media_skipped += len(scheduler.offered) - len(planned)
+        return planned
+
+    # Downloads the planned media in priority order once every message is stored. The messages are fetched
+    # again by id, a hundred per request, which also gives them fresh file references.
+    async def _download_planned(self, entity, media_handler: 'MediaHandler'):
+        from tqdm.asyncio import tqdm as async_tqdm
+        scheduler = self.media_scheduler
+        planned = self._plan_media()
+        pbar = async_tqdm(total=scheduler.planned_bytes, unit='B', unit_scale=True, colour='green', desc="Media")
+        try:
+            for start in range(0, len(planned), SYNC_BATCH_SIZE):
+                batch = planned[start:start + SYNC_BATCH_SIZE]
+                messages = await self.client.get_messages(entity, ids=[item.msg_id for item in batch])
+                files = []
+                for item, msg in zip(batch, messages):
+                    result = await media_handler.download(msg, pbar) if msg is not None else None
+                    if result:
+                        files.append((msg.id, *result, media_handler.preview or None))
+                    pbar.update(item.size)
+                set_media_files(self.db, files)
+        finally:
+            pbar.close()
+            await media_handler.close()
+
+    async def _ingest(self, history: AsyncIterator[Message], media_handler: Optional['MediaHandler'],
+                      writer: DatabaseWriter, pbar, start_date_aware: Optional[datetime]) -> int:
         message_count = 0
         batch = []
-        BATCH_SIZE = 200
-
-        async for msg in self.client.iter_messages(entity, offset_date=end_date_aware):
+        async for msg in history:
             if not msg: continue
 
             if start_date_aware and msg.date < start_date_aware:
@@ -158,99 +446,160 @@ class ChatExporter:
                 'telegram_message_id': msg.id,
                 'grouped_id': msg.grouped_id,
                 'date': msg.date,
+                'sender_id': data_dict.get('sender_id'),
                 'sender': data_dict.get('from'),
                 'text': data_dict.get('text'),
-                'reply_to': json.dumps(data_dict.get('reply_to')),
-                'forwarded_from': json.dumps(data_dict.get('forwarded')),
+                'text_entities': data_dict.get('text_entities'),
+                'reply_to_msg_id': data_dict.get('reply_to_msg_id'),
+                'reply_to': json.dumps(data_dict['reply_to']) if data_dict.get('reply_to') else None,
+                'forward_from_id': data_dict.get('forward_from_id'),
+                'forwarded_from': json.dumps(data_dict['forwarded']) if data_dict.get('forwarded') else None,
                 'media_path': data_dict.get('media_path'),
                 'media_type': data_dict.get('media_type'),
+                'media_size': data_dict.get('media_size'),
+                'media_mime': data_dict.get('media_mime'),
+                'media_file_name': data_dict.get('media_file_name'),
                 'media_placeholder': data_dict.get('media_placeholder'),
-                'action_text': data_dict.get('action_text')
+                'media_preview': data_dict.get('media_preview'),
+                'action_type': data_dict.get('action_type'),
+                'action_text': data_dict.get('action_text'),
+                'edit_date': msg.edit_date
             })
 
-            if len(batch) >= BATCH_SIZE:
-                MessageModel.insert_many(batch).execute()
-                batch.clear()
+            if len(batch) >= INGEST_BATCH_SIZE:
+                await writer.submit(batch)
+                batch = []
 
             message_count += 1
             pbar.update(1)
             await asyncio.sleep(self.delay_settings.delay_between_messages)
 
         if batch:
-            MessageModel.insert_many(batch).execute()
-            batch.clear()
-
-        if pbar.total and pbar.n < pbar.total:
-            pbar.update(pbar.total - pbar.n)
-        pbar.close()
-
-        print(f"\n✅ All {message_count} messages saved to database.")
+            await writer.submit(batch)
         return message_count
 
+    # Splits the chat into ranges of message ids that the sessions take from a shared queue, each through
+    # its own connection and media downloader, until none is left. A session stuck in a FloodWait simply
+    # stops taking ranges while the others carry on. The date range is turned into id bounds up front.
+    async def _ingest_shards(self, entity, start_date_aware: Optional[datetime], end_date_aware: Optional[datetime],
+                             filters: List[type], query: dict, new_media_handler, writer: DatabaseWriter, pbar) -> int:
+        newest = await self.client.get_messages(entity, limit=1, offset_date=end_date_aware)
+        if not newest:
+            return 0
+        high, low = newest[0].id, 1
+        if start_date_aware:
+            # Reading forward from a date skips the messages sent at that very second, hence the margin; the
+            # exact bound is still checked message by message.
+            oldest = await self.client.get_messages(entity, limit=1, reverse=True,
+                                                    offset_date=start_date_aware - timedelta(seconds=1))
+            if not oldest or oldest[0].id > high:
+                return 0
+            low = oldest[0].id
+
+        shards = asyncio.Queue()
+        for shard_high in range(high, low - 1, -SHARD_SIZE):
+            shards.put_nowait((max(low, shard_high - SHARD_SIZE + 1), shard_high))
+
+        async def work(client: TelegramClient, chat) -> int:
+            media_handler = new_media_handler(client)
+            count = 0
+            try:
+                while not shards.empty():
+                    shard_low, shard_high = shards.get_nowait()
+                    bounds = dict(query, min_id=shard_low - 1, max_id=shard_high + 1)
+                    count += await self._ingest(self._iter_history(chat, None, filters, bounds, client),
+                                                media_handler, writer, pbar, start_date_aware)
+            finally:
+                if media_handler:
+                    await media_handler.close()
+            return count
+
+        workers = [asyncio.create_task(work(client, chat)) for client, chat in [(self.client, entity)] + self.helpers]
+        try:
+            return sum(await asyncio.gather(*workers))
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+
+    def _iter_history(self, entity, offset_date: Optional[datetime], filters: List[type], query: dict,
+                      client: Optional[TelegramClient] = None) -> AsyncIterator[Message]:
+        client = client or self.client
+        if not filters:
+            return client.iter_messages(entity, offset_date=offset_date, **query)
+        if len(filters) == 1:
+            return client.iter_messages(entity, offset_date=offset_date, filter=filters[0], **query)
+        return _merge_newest_first([client.iter_messages(entity, offset_date=offset_date, filter=f, **query)
+                                    for f in filters])
+
     def _html_generation_pass(self, chat_name: str, total_messages: int, start_date: Optional[datetime],
-                              end_date: Optional[datetime]):
+                              end_date: Optional[datetime], filters: Optional[str] = None, minify: bool = False,
+                              precompress: Iterable[str] = ()):
         print(f"\n📄 Generating HTML from database...")
 
-        messages_map = {}
-        query = MessageModel.select().order_by(MessageModel.date.asc())
-
-        for msg_record in query:
-            key = msg_record.grouped_id if msg_record.grouped_id else msg_record.telegram_message_id
-
-            if key not in messages_map:
-                msg_date = msg_record.date
-                if isinstance(msg_date, str):
-                    msg_date = datetime.fromisoformat(msg_date)
-
-                messages_map[key] = {
-                    'date': msg_date,
-                    'from': msg_record.sender,
-                    'text': msg_record.text,
-                    'reply_to': json.loads(msg_record.reply_to) if msg_record.reply_to else None,
-                    'forwarded': json.loads(msg_record.forwarded_from) if msg_record.forwarded_from else None,
-                    'media_files': [],
-                    'media_placeholder': msg_record.media_placeholder,
-                    'action_text': msg_record.action_text
-                }
-
-            if msg_record.text:
-                messages_map[key]['text'] = msg_record.text
-
-            if msg_record.media_path:
-                messages_map[key]['media_files'].append({
-                    'path': msg_record.media_path,
-                    'type': msg_record.media_type
-                })
+        message_count, first_date, last_date = message_group_stats(self.db)
+        generator = HtmlGenerator(chat_name, page_records(iter_message_groups(self.db)), start_date, end_date,
+                                  message_count, first_date, last_date, filters, minify)
+        with open_page(self.output, "messages.html", precompress) as html_file:
+            generator.write(html_file)
+        with self.output.open_text(HTML_INDEX_NAME) as index_file:
+            json.dump(generator.index(), index_file)
+
+    def _json_generation_pass(self, entity, chat_name: str, output_formats: Iterable[str]):
+        print(f"\n🧾 Writing JSON from database...")
+        generator = JsonGenerator(entity, chat_name, iter_message_rows(self.db))
+        json_file = self.output.open_text("result.json") if 'json' in output_formats else None
+        jsonl_file = self.output.open_text("messages.jsonl") if 'jsonl' in output_formats else None
+        try:
+            generator.write(json_file, jsonl_file)
+        finally:
+            if json_file: json_file.close()
+            if jsonl_file: jsonl_file.close()
+        print(f"✅ {generator.messages_written} messages written.")
 
-        processed_messages = list(messages_map.values())
+    def _parquet_generation_pass(self):
+        print(f"\n📊 Writing Parquet dataset from database...")
+        from .parquet_generator import ParquetGenerator
 
-        processed_messages = [
-            msg for msg in processed_messages
-            if msg.get('text') or msg.get('media_files') or msg.get('action_text') or msg.get('media_placeholder')
-        ]
+        generator = ParquetGenerator(self.output, iter_message_rows(self.db))
+        generator.write()
+        print(f"✅ {generator.rows_written} rows written to {generator.files_written} partition(s).")
 
-        generator = HtmlGenerator(chat_name, processed_messages, start_date, end_date)
-        html_content = generator.generate()
-        html_file = self.export_folder / "messages.html"
-        html_file.write_text(html_content, encoding='utf-8')
+    def _preview_manifest_pass(self, entity, chat_name: str):
+        from .media_handler import PREVIEW_MANIFEST_NAME, write_preview_manifest
+        count = write_preview_manifest(self.output, self.db, get_peer_id(entity), chat_name)
+        print(f"\n🔖 {count} preview(s), the full files stay on Telegram: "
+              f"{self.output.describe(PREVIEW_MANIFEST_NAME)}")
 
-    async def _process_message_for_db(self, msg: Message, media_handler: Optional[MediaHandler], pbar) -> dict:
-        data = {'from': await self._get_sender_name(msg), 'text': utils.format_text(msg.text or ''), }
+    async def _process_message_for_db(self, msg: Message, media_handler: Optional['MediaHandler'], pbar) -> dict:
+        data = {'from': await self._get_sender_name(msg), 'sender_id': msg.sender_id, 'text': msg.message or '',
+                'text_entities': utils.entities_to_json(msg.entities)}
 
         if msg.action:
+            data['action_type'] = ACTION_TYPES.get(type(msg.action), 'unknown')
             data['action_text'] = await self._format_message_action(msg)
 
         if msg.media:
-            if media_handler:
+            if media_file := getattr(msg, 'file', None):
+                data['media_size'] = media_file.size
+                data['media_mime'] = media_file.mime_type
+                data['media_file_name'] = media_file.name
+            if media_handler and self.media_scheduler:
+                media_handler.offer(msg, self.media_scheduler)
+                data['media_placeholder'] = self._get_media_placeholder(msg)
+            elif media_handler:
                 result = await media_handler.download(msg, pbar)
                 if result:
                     data['media_path'], data['media_type'] = result
+                    data['media_preview'] = media_handler.preview or None
                 else:
                     data['media_placeholder'] = self._get_media_placeholder(msg)
             else:
                 data['media_placeholder'] = self._get_media_placeholder(msg)
 
         if msg.reply_to and getattr(msg.reply_to, 'reply_to_msg_id', None):
+            data['reply_to_msg_id'] = msg.reply_to.reply_to_msg_id
             try:
                 reply_msg = await msg.get_reply_message()
                 if reply_msg:
@@ -261,10 +610,13 @@ class ChatExporter:
         if msg.forward:
             fwd_from = 'Unknown'
             try:
+                if msg.forward.from_id:
+                    data['forward_from_id'] = get_peer_id(msg.forward.from_id)
                 if msg.forward.from_name:
                     fwd_from = msg.forward.from_name
                 elif msg.forward.from_id:
-                    fwd_entity = await self.client.get_entity(msg.forward.from_id)
+                    # Through the session that fetched the message, which may be another one than self.client.
+                    fwd_entity = await msg.client.get_entity(msg.forward.from_id)
                     fwd_from = self._get_entity_name(fwd_entity)
             except:
                 pass
@@ -1,101 +1,239 @@
+import io
+import json
+import os
 from datetime import datetime
-from typing import Optional
+from pathlib import Path
+from typing import Iterable, List, Optional, TextIO, Tuple
 from . import utils
+from .message_record import MessageRecord
+
+MESSAGES_MARKER = '\x00messages\x00'
+
+PREVIEW_LABELS = {'photo': '🖼️ Photo', 'video': '🎬 Video', 'audio': '🎵 Audio', 'document': '📄 Document'}
+
+# Added to the placeholder of media left for the media pass of a two-phase export, until it is downloaded.
+PENDING_NOTE = ' (download pending)'
+
+INDEX_VERSION = 1
+HTML_INDEX_NAME = 'messages.index.json'
+
+
+# Bytes a text stream opened with the default newline handling writes for ``text``.
+def encoded_length(text: str) -> int:
+    length = len(text) if text.isascii() else len(text.encode('utf-8'))
+    return length + text.count('\n') * (len(os.linesep) - 1)
+
+
+def encode_page_text(text: str) -> bytes:
+    return text.replace('\n', os.linesep).encode('utf-8')
+
+
+def date_separator(date_key: str, minify: bool = False) -> str:
+    separator = f'<div class="date-separator">{date_key}</div>'
+    return separator if minify else separator + '\n'
+
+
+# The page template without its indentation and blank lines. Line breaks stay, so the script keeps working
+# the way it was written.
+def minify_markup(text: str) -> str:
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def day_key(date: datetime) -> str:
+    return date.strftime("%d %B %Y")
+
+
+# The index written with messages.html describes the page byte for byte; a page changed since then is
+# not trusted.
+def load_page_index(folder_path: Path) -> Optional[dict]:
+    try:
+        with open(folder_path / HTML_INDEX_NAME, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        size = (folder_path / "messages.html").stat().st_size
+        if index.get('version') != INDEX_VERSION:
+            return None
+        if size != index['head_bytes'] + index['body_bytes'] + index['tail_bytes']:
+            return None
+        return index
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def parse_index_date(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+# Replaces the index of a page already in place. The new one is on disk before it takes the old one's place,
+# so the page is never left with half an index.
+def write_page_index(folder_path: Path, index: dict):
+    tmp_path = folder_path / (HTML_INDEX_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(folder_path / HTML_INDEX_NAME)
 
 
 class HtmlGenerator:
-    def __init__(self, chat_name: str, messages: list, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    def __init__(self, chat_name: str, messages: Iterable, start_date: Optional[datetime] = None,
+                 end_date: Optional[datetime] = None, total_messages: Optional[int] = None,
+                 first_date: Optional[datetime] = None, last_date: Optional[datetime] = None,
+                 filters: Optional[str] = None, minify: bool = False):
         self.chat_name = chat_name
         self.messages = messages
         self.start_date = start_date
         self.end_date = end_date
+        if total_messages is None:
+            total_messages = len(messages)
+            if messages:
+                first_date, last_date = messages[0].date, messages[-1].date
+        self.total_messages = total_messages
+        self.first_date = first_date
+        self.last_date = last_date
+        self.filters = filters
+        self.minify = minify
+        # Filled by write(): the size of the page's head, messages and tail, and where every day starts
+        # within the messages, so an append can add to the page without rendering it again.
+        self.head_bytes = self.body_bytes = self.tail_bytes = 0
+        self.days: List[Tuple[str, int]] = []
 
     def generate(self) -> str:
-        grouped_messages = {}
+        buffer = io.StringIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+    def template_parts(self) -> Tuple[str, str]:
+        template = self._get_html_template(MESSAGES_MARKER)
+        if self.minify:
+            template = minify_markup(template)
+        head, tail = template.split(MESSAGES_MARKER)
+        return head, tail
+
+    def write(self, out: TextIO):
+        head, tail = self.template_parts()
+        out.write(head)
+        self.write_messages(out)
+        out.write(tail)
+        self.head_bytes, self.tail_bytes = encoded_length(head), encoded_length(tail)
+
+    def write_messages(self, out: TextIO) -> int:
+        written = 0
+        self.days = []
+        current_date = None
         for msg in self.messages:
             if not msg: continue
-            date_key = msg['date'].strftime("%d %B %Y")
-            if date_key not in grouped_messages:
-                grouped_messages[date_key] = []
-            grouped_messages[date_key].append(msg)
-
-        messages_html = ""
-        for date, msgs in grouped_messages.items():
-            messages_html += f'<div class="date-separator">{date}</div>\n'
-            for msg in msgs:
-                messages_html += self._generate_message_html(msg)
-
-        return self._get_html_template(messages_html)
-
-    def _generate_message_html(self, msg: dict) -> str:
-        if msg.get('action_text'):
-            return f'<div class="system-message">{utils.escape_html(msg["action_text"])}</div>'
-
-        time_str = msg['date'].strftime("%H:%M")
-        html = f'<div class="message">\n'
-        html += f'    <div class="message-header">\n'
-        html += f'        <span class="sender">{utils.escape_html(msg["from"])}</span>\n'
-        html += f'        <span class="time">{time_str}</span>\n'
-        html += f'    </div>\n'
-
-        if msg.get('forwarded'):
-            html += f'    <div class="forwarded">Forwarded from: {utils.escape_html(msg["forwarded"]["from"])}</div>\n'
-        if msg.get('reply_to'):
-            html += f'    <div class="reply">\n'
-            html += f'        <div class="reply-from">{utils.escape_html(msg["reply_to"]["from"])}</div>\n'
-            html += f'        <div class="reply-text">{utils.format_text(msg["reply_to"]["text"][:200])}</div>\n'
-            html += f'    </div>\n'
-
-        if msg.get('media_files'):
-            count = len(msg["media_files"])
+            date_key = day_key(msg.date)
+            if date_key != current_date:
+                current_date = date_key
+                self.days.append((date_key, written))
+                separator = date_separator(date_key, self.minify)
+                out.write(separator)
+                written += encoded_length(separator)
+            message_html = self._generate_message_html(msg)
+            out.write(message_html)
+            written += encoded_length(message_html)
+        self.body_bytes = written
+        return written
+
+    def index(self) -> dict:
+        return {
+            'version': INDEX_VERSION,
+            'chat_name': self.chat_name,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'filters': self.filters,
+            'total_messages': self.total_messages,
+            'first_date': self.first_date.isoformat() if self.first_date else None,
+            'last_date': self.last_date.isoformat() if self.last_date else None,
+            'head_bytes': self.head_bytes,
+            'body_bytes': self.body_bytes,
+            'tail_bytes': self.tail_bytes,
+            'days': self.days,
+            'minified': self.minify,
+        }
+
+    def _generate_message_html(self, msg: MessageRecord) -> str:
+        if msg.action_text:
+            return f'<div class="system-message">{utils.escape_html(msg.action_text)}</div>'
+
+        time_str = msg.date.strftime("%H:%M")
+        html = ['<div class="message">\n']
+        html.append(f'    <div class="message-header">\n')
+        html.append(f'        <span class="sender">{utils.escape_html(msg.sender)}</span>\n')
+        html.append(f'        <span class="time">{time_str}</span>\n')
+        html.append(f'    </div>\n')
+
+        if msg.forwarded_from:
+            html.append(f'    <div class="forwarded">Forwarded from: {utils.escape_html(msg.forwarded_from)}</div>\n')
+        if msg.reply_text is not None:
+            html.append(f'    <div class="reply">\n')
+            html.append(f'        <div class="reply-from">{utils.escape_html(msg.reply_sender)}</div>\n')
+            html.append(f'        <div class="reply-text">{utils.format_text(msg.reply_text[:200])}</div>\n')
+            html.append(f'    </div>\n')
+
+        if msg.media_files:
+            count = len(msg.media_files)
             container_class = "media-group"
             if count > 1:
                 container_class += f" layout-cols-{(2 if count % 2 == 0 else 3)}"
 
-            html += f'    <div class="{container_class}">\n'
-            for media in msg['media_files']:
-                media_path, media_type = media["path"], media["type"]
-
-                html += f'    <div class="media">\n'
+            html.append(f'    <div class="{container_class}">\n')
+            for media in msg.media_files:
+                media_path, media_type = media.path, media.type
+
+                if media.preview:
+                    label = PREVIEW_LABELS.get(media_type, PREVIEW_LABELS['document'])
+                    if media.size:
+                        label += f' · {utils.format_size(media.size)}'
+                    html.append(f'    <div class="media media-preview" data-type="{media_type}" data-size="{media.size or ""}">\n')
+                    html.append(f'        <img class="media-item" src="{media_path}" alt="Preview">\n')
+                    html.append(f'        <div class="preview-info">{label}</div>\n')
+                    html.append(f'    </div>\n')
+                    continue
+
+                html.append(f'    <div class="media">\n')
                 if media_type == 'photo':
-                    html += f'        <img class="media-item" src="{media_path}" alt="Photo">\n'
+                    html.append(f'        <img class="media-item" src="{media_path}" alt="Photo">\n')
                 elif media_type == 'video':
-                    html += f'        <div class="video-wrapper">'
-                    html += f'           <video class="media-item" playsinline preload="metadata" src="{media_path}"></video>'
-                    html += f'           <div class="play-button"></div>'
-                    html += f'        </div>'
+                    html.append(f'        <div class="video-wrapper">')
+                    html.append(f'           <video class="media-item" playsinline preload="metadata" src="{media_path}"></video>')
+                    html.append(f'           <div class="play-button"></div>')
+                    html.append(f'        </div>')
                 elif media_type == 'audio':
-                    html += f'        <audio controls src="{media_path}"></audio>\n'
+                    html.append(f'        <audio controls src="{media_path}"></audio>\n')
                 else:
                     filename = media_path.split('/')[-1]
-                    html += f'    <div class="document-standalone">\n'
-                    html += f'        <div class="document-icon">📄</div>\n'
-                    html += f'        <a href="{media_path}" class="document-name" download>{utils.escape_html(filename)}</a>\n'
-                    html += f'    </div>\n'
-                html += f'    </div>\n'
-            html += '    </div>\n'
-
-        if msg.get('text'):
-            text_class = "text-with-media" if msg.get('media_files') else ""
-            html += f'    <div class="text {text_class}">{msg["text"]}</div>\n'
-
-        if msg.get('media_placeholder'):
-            html += f'    <div class="media-placeholder">{utils.escape_html(msg["media_placeholder"])}</div>\n'
-
-        html += '</div>\n'
-        return html
+                    html.append(f'    <div class="document-standalone">\n')
+                    html.append(f'        <div class="document-icon">📄</div>\n')
+                    html.append(f'        <a href="{media_path}" class="document-name" download>{utils.escape_html(filename)}</a>\n')
+                    html.append(f'    </div>\n')
+                html.append(f'    </div>\n')
+            html.append('    </div>\n')
+
+        if msg.text:
+            text_class = "text-with-media" if msg.media_files else ""
+            html.append(f'    <div class="text {text_class}">{msg.text}</div>\n')
+
+        if msg.media_placeholder:
+            placeholder = msg.media_placeholder + PENDING_NOTE if msg.media_pending else msg.media_placeholder
+            html.append(f'    <div class="media-placeholder">{utils.escape_html(placeholder)}</div>\n')
+
+        html.append('</div>\n')
+        # Every part starts with its indentation and ends with its tag, so stripping it never touches the text
+        # it holds, which is shown with its whitespace.
+        return ''.join(part.strip() for part in html) if self.minify else ''.join(html)
 
     def _get_html_template(self, messages_html: str) -> str:
         date_range_html = ""
         if self.start_date or self.end_date:
-            if self.messages:
-                actual_start_date = self.messages[0]['date']
-                actual_end_date = self.messages[-1]['date']
-                from_str = actual_start_date.strftime('%d.%m.%Y %H:%M')
-                to_str = actual_end_date.strftime('%d.%m.%Y %H:%M')
+            if self.total_messages:
+                from_str = self.first_date.strftime('%d.%m.%Y %H:%M')
+                to_str = self.last_date.strftime('%d.%m.%Y %H:%M')
                 date_range_html = f'<div class="info" style="font-size: 13px; color: #aab5c3; margin-top: 5px;">Export Range: {from_str} — {to_str} (UTC)</div>'
             else:
                 date_range_html = f'<div class="info" style="font-size: 13px; color: #aab5c3; margin-top: 5px;">No messages found in the selected range</div>'
+        if self.filters:
+            date_range_html += f'<div class="info" style="font-size: 13px; color: #aab5c3; margin-top: 5px;">Messages {utils.escape_html(self.filters)}</div>'
 
         return f'''<!DOCTYPE html>
     <html lang="en">
@@ -174,6 +312,8 @@ class HtmlGenerator:
             .play-button {{ position: absolute; top: 50%; left: 50%; transform: translate(-50%, -50%); width: 60px; height: 60px; background-color: rgba(0, 0, 0, 0.5); border-radius: 50%; display: flex; align-items: center; justify-content: center; pointer-events: none; }}
             .play-button::after {{ content: ''; border-style: solid; border-width: 10px 0 10px 20px; border-color: transparent transparent transparent white; margin-left: 5px; }}
             .media audio {{ width: 100%; margin-top: 8px; }}
+            .media-preview {{ position: relative; }}
+            .preview-info {{ position: absolute; left: 6px; bottom: 6px; background: rgba(0, 0, 0, 0.6); color: #ffffff; font-size: 12px; padding: 2px 8px; border-radius: 10px; pointer-events: none; }}
             .document-standalone {{ background: #0e1621; padding: 12px; border-radius: 8px; display: flex; align-items: center; gap: 10px; font-size: 1em; }}
             .media-placeholder {{ background: #0e1621; padding: 10px; border-radius: 8px; margin-top: 10px; border-left: 2px solid #8b95a5; color: #8b95a5; font-style: italic; }}
             .date-separator, .system-message {{ text-align: center; color: #8b95a5; font-size: 13px; padding: 8px 15px; border-radius: 20px; margin: 20px auto; display: table; }}
@@ -197,7 +337,7 @@ class HtmlGenerator:
         <div class="container">
             <div class="header">
                 <h1>{utils.escape_html(self.chat_name)}</h1>
-                <div class="info">Exported: {datetime.now().strftime("%d.%m.%Y %H:%M")} | Messages: {len(self.messages)}</div>
+                <div class="info">Exported: {datetime.now().strftime("%d.%m.%Y %H:%M")} | Messages: {self.total_messages}</div>
                 {date_range_html}
                 <div class="scale-slider-container">
                     <span style="font-size: 12px;">-</span>
@@ -0,0 +1,175 @@
+import json
+from typing import Iterable, List, Optional, TextIO
+
+from telethon.helpers import add_surrogate, del_surrogate
+from telethon.tl.types import User, Chat, Channel
+
+FILE_NOT_INCLUDED = "(File not included. Change data exporting settings to download.)"
+
+MEDIA_TYPES = {
+    'video': 'video_file',
+    'audio': 'audio_file',
+}
+
+PLACEHOLDER_MEDIA_TYPES = {
+    '[VIDEO MESSAGE]': 'video_message',
+    '[VIDEO]': 'video_file',
+    '[VOICE MESSAGE]': 'voice_message',
+    '[AUDIO FILE]': 'audio_file',
+    '[STICKER]': 'sticker',
+    '[GIF]': 'animation',
+}
+
+# Telegram Desktop's names for the message entities, and the fields some of them carry.
+ENTITY_TYPES = {
+    'MessageEntityMention': 'mention',
+    'MessageEntityHashtag': 'hashtag',
+    'MessageEntityBotCommand': 'bot_command',
+    'MessageEntityUrl': 'link',
+    'MessageEntityEmail': 'email',
+    'MessageEntityBold': 'bold',
+    'MessageEntityItalic': 'italic',
+    'MessageEntityCode': 'code',
+    'MessageEntityPre': 'pre',
+    'MessageEntityTextUrl': 'text_link',
+    'MessageEntityMentionName': 'mention_name',
+    'MessageEntityPhone': 'phone',
+    'MessageEntityCashtag': 'cashtag',
+    'MessageEntityUnderline': 'underline',
+    'MessageEntityStrike': 'strikethrough',
+    'MessageEntityBlockquote': 'blockquote',
+    'MessageEntityBankCard': 'bank_card',
+    'MessageEntitySpoiler': 'spoiler',
+    'MessageEntityCustomEmoji': 'custom_emoji',
+}
+ENTITY_FIELDS = {'language': 'language', 'url': 'href', 'user_id': 'user_id', 'document_id': 'document_id'}
+
+
+# The text cut into the parts Telegram Desktop lists: every entity, and the plain text between them. Offsets
+# count UTF-16 code units. An entity nested in another one is left to the outer one.
+def text_entities(text: str, entities: Optional[str]) -> List[dict]:
+    if not text:
+        return []
+    surrogated = add_surrogate(text)
+    parts, position = [], 0
+    for entity in sorted(json.loads(entities) if entities else [], key=lambda e: e['offset']):
+        start, end = entity['offset'], entity['offset'] + entity['length']
+        if start < position:
+            continue
+        if start > position:
+            parts.append({'type': 'plain', 'text': del_surrogate(surrogated[position:start])})
+        part = {'type': ENTITY_TYPES.get(entity['_'], 'unknown'), 'text': del_surrogate(surrogated[start:end])}
+        for field, name in ENTITY_FIELDS.items():
+            if field in entity:
+                part[name] = entity[field]
+        parts.append(part)
+        position = end
+    if position < len(surrogated):
+        parts.append({'type': 'plain', 'text': del_surrogate(surrogated[position:])})
+    return parts
+
+
+class JsonGenerator:
+    def __init__(self, entity, chat_name: str, rows: Iterable[dict]):
+        self.entity = entity
+        self.chat_name = chat_name
+        self.rows = rows
+        self.messages_written = 0
+
+    # Both documents are produced in one pass over the store and every message is encoded and written
+    # on its own, so neither the rows nor the resulting document are ever held in memory.
+    def write(self, json_file: Optional[TextIO] = None, jsonl_file: Optional[TextIO] = None):
+        if json_file:
+            header = json.dumps({'name': self.chat_name, 'type': self._get_chat_type(),
+                                 'id': getattr(self.entity, 'id', None)}, ensure_ascii=False, indent=1)
+            json_file.write(header[:-2] + ',\n "messages": [')
+
+        for row in self.rows:
+            message = self._build_message(row)
+            if json_file:
+                json_file.write(',\n  ' if self.messages_written else '\n  ')
+                json_file.write(json.dumps(message, ensure_ascii=False))
+            if jsonl_file:
+                jsonl_file.write(json.dumps(message, ensure_ascii=False))
+                jsonl_file.write('\n')
+            self.messages_written += 1
+
+        if json_file:
+            json_file.write('\n ]\n}\n')
+
+    def _build_message(self, row: dict) -> dict:
+        date = row['date']
+        message = {'id': row['telegram_message_id'], 'type': 'service' if row['action_text'] else 'message',
+                   'date': date.replace(tzinfo=None).isoformat(timespec='seconds'),
+                   'date_unixtime': str(int(date.timestamp()))}
+
+        if row.get('edit_date'):
+            message['edited'] = row['edit_date'].replace(tzinfo=None).isoformat(timespec='seconds')
+            message['edited_unixtime'] = str(int(row['edit_date'].timestamp()))
+
+        if row['action_text']:
+            message['actor'] = row['sender']
+            message['actor_id'] = self._format_peer_id(row['sender_id'])
+            message['action'] = row['action_type']
+        else:
+            message['from'] = row['sender']
+            message['from_id'] = self._format_peer_id(row['sender_id'])
+
+        if row['grouped_id']:
+            message['grouped_id'] = row['grouped_id']
+        if row['reply_to_msg_id']:
+            message['reply_to_message_id'] = row['reply_to_msg_id']
+        if row['forwarded_from']:
+            message['forwarded_from'] = json.loads(row['forwarded_from'])['from']
+            if row['forward_from_id']:
+                message['forwarded_from_id'] = self._format_peer_id(row['forward_from_id'])
+
+        # A preview keeps only the thumbnail, as Telegram Desktop exports a file it did not download.
+        media_type, preview = row['media_type'], row.get('media_preview')
+        if media_type == 'photo':
+            message['photo'] = FILE_NOT_INCLUDED if preview else row['media_path']
+        elif media_type:
+            message['file'] = FILE_NOT_INCLUDED if preview else row['media_path']
+            if row['media_file_name']: message['file_name'] = row['media_file_name']
+            if media_type in MEDIA_TYPES: message['media_type'] = MEDIA_TYPES[media_type]
+        elif row['media_placeholder']:
+            if row['media_placeholder'] == '[PHOTO]':
+                message['photo'] = FILE_NOT_INCLUDED
+            else:
+                message['file'] = FILE_NOT_INCLUDED
+                if row['media_placeholder'] in PLACEHOLDER_MEDIA_TYPES:
+                    message['media_type'] = PLACEHOLDER_MEDIA_TYPES[row['media_placeholder']]
+        if preview:
+            message['thumbnail'] = row['media_path']
+        if row['media_mime']:
+            message['mime_type'] = row['media_mime']
+        if row['media_size']:
+            message['file_size'] = row['media_size']
+
+        if row['action_text']:
+            message['text'] = row['action_text']
+            message['text_entities'] = [{'type': 'plain', 'text': row['action_text']}]
+        else:
+            message['text'] = row['text'] or ''
+            message['text_entities'] = text_entities(message['text'], row.get('text_entities'))
+        return message
+
+    def _get_chat_type(self) -> str:
+        if isinstance(self.entity, User):
+            return 'bot_chat' if self.entity.bot else 'personal_chat'
+        if isinstance(self.entity, Chat):
+            return 'private_group'
+        if isinstance(self.entity, Channel):
+            visibility = 'public' if self.entity.username else 'private'
+            return f"{visibility}_{'channel' if self.entity.broadcast else 'supergroup'}"
+        return 'unknown'
+
+    @staticmethod
+    def _format_peer_id(peer_id: Optional[int]) -> Optional[str]:
+        if peer_id is None:
+            return None
+        if peer_id > 0:
+            return f"user{peer_id}"
+        if str(peer_id).startswith('-100'):
+            return f"channel{-peer_id - 1_000_000_000_000}"
+        return f"chat{-peer_id}"
@@ -1,57 +1,360 @@
 import asyncio
+import json
 from pathlib import Path
-from typing import Optional, Tuple
-from telethon.tl.types import Message, MessageMediaWebPage, PhotoSize
+from typing import Dict, Iterable, List, Optional, Tuple
+from telethon.tl.types import (Document, InputMessagesFilterDocument, InputMessagesFilterGif,
+                               InputMessagesFilterMusic, InputMessagesFilterPhotos, InputMessagesFilterPhotoVideo,
+                               InputMessagesFilterRoundVideo, InputMessagesFilterRoundVoice,
+                               InputMessagesFilterVideo, InputMessagesFilterVoice, Message, MessageMediaWebPage,
+                               PhotoCachedSize, PhotoSize, PhotoSizeProgressive, PhotoStrippedSize)
 from telethon.errors import FloodWaitError, TimeoutError as TelegramTimeoutError
 from . import utils
+from .export_output import ExportOutput, FolderOutput, is_compressed
+from .media_manifest import HashingWriter, ManifestEntry, MediaManifest, check_entry, media_key
+from .media_scheduler import MediaScheduler
+from .metrics import ExportMetrics
+from .parallel_download import ParallelDownloader
+from .partial_download import PARTIAL_FOLDER_NAME, RESUMABLE_MIN_SIZE, RESUME_ALIGNMENT, PartialDownload
 from .settings import DelaySettings
 
 
+RESUME_REQUEST_SIZE = 512 * 1024
+
+# Previews take the largest thumbnail Telegram keeps whose longest side fits this, its 'm' size.
+PREVIEW_MAX_SIDE = 320
+PREVIEW_FOLDER = 'media/preview'
+# Lists every preview with what is needed to fetch its full file later: the chat and the message id.
+PREVIEW_MANIFEST_NAME = 'media_previews.json'
+
+# Keys of the resumable downloads in progress in this process. Exports running side by side can meet the
+# same document, and only one of them may use its .part file.
+_active_downloads = set()
+
+# Media types that can be selected for download, with the search filter Telegram uses to return only the
+# messages carrying them.
+MEDIA_TYPES = {
+    'photo': InputMessagesFilterPhotos,
+    'video': InputMessagesFilterVideo,
+    'gif': InputMessagesFilterGif,
+    'round': InputMessagesFilterRoundVideo,
+    'voice': InputMessagesFilterVoice,
+    'audio': InputMessagesFilterMusic,
+    'document': InputMessagesFilterDocument,
+}
+
+# Telegram also has filters for some unions of types, which save a separate pass over the history.
+COMBINED_MEDIA_FILTERS = {
+    frozenset(('photo', 'video')): InputMessagesFilterPhotoVideo,
+    frozenset(('voice', 'round')): InputMessagesFilterRoundVoice,
+}
+
+
+def write_preview_manifest(output: ExportOutput, db, chat_id: int, chat_name: str) -> int:
+    from .database import iter_previews
+    media = list(iter_previews(db))
+    with output.open_text(PREVIEW_MANIFEST_NAME) as f:
+        json.dump({'chat_id': chat_id, 'chat_name': chat_name, 'media': media}, f, ensure_ascii=False, indent=1)
+    return len(media)
+
+
+# One of MEDIA_TYPES. Stickers are documents to Telegram's search filters, so they are selected, planned and
+# budgeted as documents too.
+def media_kind(msg: Message) -> Optional[str]:
+    if getattr(msg, 'photo', None): return 'photo'
+    if getattr(msg, 'video_note', None): return 'round'
+    if getattr(msg, 'gif', None): return 'gif'
+    if getattr(msg, 'video', None): return 'video'
+    if getattr(msg, 'voice', None): return 'voice'
+    if getattr(msg, 'audio', None): return 'audio'
+    return 'document' if getattr(msg, 'document', None) else None
+
+
+def photo_size_bytes(size) -> int:
+    if isinstance(size, PhotoSize):
+        return size.size or 0
+    if isinstance(size, PhotoSizeProgressive):
+        return max(size.sizes or [0])
+    if isinstance(size, (PhotoCachedSize, PhotoStrippedSize)):
+        return len(size.bytes)
+    return 0
+
+
+# Size of the file a full download fetches, from the metadata Telegram sends along with the message.
+def media_file_size(msg: Message) -> int:
+    document, photo = getattr(msg, 'document', None), getattr(msg, 'photo', None)
+    if document and getattr(document, 'size', None):
+        return document.size
+    if photo and getattr(photo, 'sizes', None):
+        return max(photo_size_bytes(s) for s in photo.sizes)
+    return 0
+
+
+def document_media_type(mime: str) -> str:
+    mt = mime.lower()
+    if mt.startswith('image'): return 'photo'
+    if mt.startswith('video'): return 'video'
+    if mt.startswith('audio'): return 'audio'
+    return 'document'
+
+
+# The thumbnail a preview shows: a photo's own smaller sizes, or the thumbnail Telegram keeps for a video,
+# sticker or document. Only the tiny inline thumbnail is left when there is no sized one.
+def preview_thumb(msg: Message):
+    photo, document = getattr(msg, 'photo', None), getattr(msg, 'document', None)
+    sizes = (photo.sizes if photo else getattr(document, 'thumbs', None)) or []
+    sized = [s for s in sizes if isinstance(s, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive))]
+    if not sized:
+        return next((s for s in sizes if isinstance(s, PhotoStrippedSize)), None)
+    fitting = [s for s in sized if max(s.w, s.h) <= PREVIEW_MAX_SIDE]
+    return max(fitting, key=lambda s: s.w) if fitting else min(sized, key=lambda s: s.w)
+
+
+def media_filters(media_types: Optional[Iterable[str]]) -> List[type]:
+    remaining = set(media_types or MEDIA_TYPES)
+    filters = []
+    for types, media_filter in COMBINED_MEDIA_FILTERS.items():
+        if types <= remaining:
+            filters.append(media_filter)
+            remaining -= types
+    filters.extend(MEDIA_TYPES[media_type] for media_type in MEDIA_TYPES if media_type in remaining)
+    return filters
+
+
 class MediaHandler:
-    def __init__(self, media_folder: Path, delay_settings: DelaySettings, max_file_size_mb: Optional[float] = None):
-        self.media_folder = media_folder
+    def __init__(self, output: ExportOutput, delay_settings: DelaySettings, max_file_size_mb: Optional[float] = None,
+                 metrics: Optional[ExportMetrics] = None, parallel_downloader: Optional[ParallelDownloader] = None,
+                 partial_folder: Optional[Path] = None, media_types: Optional[Iterable[str]] = None,
+                 preview: bool = False, manifest: Optional[MediaManifest] = None,
+                 reusable: Optional[Dict[str, Tuple[Path, ManifestEntry]]] = None):
+        self.output = output
         self.delay_settings = delay_settings
+        self.metrics = metrics or ExportMetrics()
+        self.parallel_downloader = parallel_downloader
+        self.partial_folder = partial_folder or output.location.parent / PARTIAL_FOLDER_NAME
         self.max_file_size_bytes = max_file_size_mb * 1024 * 1024 if max_file_size_mb is not None else None
+        self.media_types = set(media_types) if media_types else None
+        self.preview = preview
+        # Every file downloaded goes into the manifest; a file it or ``reusable`` already has intact is
+        # taken from there instead.
+        self.manifest = manifest
+        self.reusable = reusable or {}
+
+    async def close(self):
+        if self.parallel_downloader:
+            await self.parallel_downloader.close()
+
+    # Returns the size and hash of the file written.
+    async def _download_to_output(self, msg: Message, name: str, callback) -> Optional[Tuple[int, str]]:
+        compress = not is_compressed(name)
+        document = getattr(msg, 'document', None)
+        key, size = None, None
+        if isinstance(document, Document) and document.size:
+            key, size = f"document_{document.id}", document.size
+
+        # Archive members never look finished before the archive is closed, so small files are streamed
+        # straight into them; everything else is staged in a .part file and only moved into the export
+        # once complete.
+        if isinstance(self.output, FolderOutput) or (size or 0) >= RESUMABLE_MIN_SIZE:
+            if key in _active_downloads:
+                key = None
+            if key:
+                _active_downloads.add(key)
+            try:
+                return await self._download_staged(msg, name, compress, key, size, callback)
+            finally:
+                _active_downloads.discard(key)
+
+        stream = self.output.open_staged(name, compress=compress)
+        hashing = HashingWriter(stream)
+        try:
+            downloaded = await self._download_with(msg, hashing, callback)
+        except BaseException:
+            self.output.abort(stream)
+            raise
+        if not downloaded:
+            self.output.abort(stream)
+            return None
+        written = stream.tell()
+        stream.close()
+        return written, hashing.finish(written)
+
+    async def _download_staged(self, msg: Message, name: str, compress: bool, key: Optional[str],
+                               size: Optional[int], callback) -> Optional[Tuple[int, str]]:
+        partial = PartialDownload(self.partial_folder, key, size)
+        f = partial.open()
+        hashing = HashingWriter(f, partial.path)
+        committed = partial.offset
+
+        def commit(offset: int):
+            nonlocal committed
+            committed = offset
+            partial.save(offset)
+
+        def progress(current: int, total: int):
+            callback(current, total)
+            commit(current)
+
+        try:
+            downloaded = await self._download_with(msg, hashing, callback, partial.offset, commit, progress)
+        except BaseException:
+            partial.interrupt(committed)
+            raise
+        if not downloaded:
+            partial.discard()
+            return None
+
+        written = f.tell()
+        if size and written != size:
+            partial.discard()
+            raise ValueError(f"downloaded {written} of {size} bytes")
+        digest = hashing.finish(written)
+        self.output.add_file(name, partial.finish(), compress)
+        return written, digest
+
+    async def _download_with(self, msg: Message, f, callback, offset: int = 0, commit=None, progress=None):
+        if self.parallel_downloader and self.parallel_downloader.should_use(msg):
+            try:
+                return await self.parallel_downloader.download(msg.document, f, callback, offset, commit)
+            except (FloodWaitError, TelegramTimeoutError, TimeoutError):
+                raise
+            except Exception:
+                # Anything the extra connections cannot handle (CDN files, expired file references,
+                # connection setup) goes through Telethon's own downloader, from the last complete part.
+                if not f.seekable():
+                    raise
+                offset -= offset % RESUME_ALIGNMENT
+                f.seek(offset)
+                f.truncate(offset)
+
+        if offset:
+            done = offset
+            async for chunk in msg.client.iter_download(msg, offset=offset, file_size=msg.document.size,
+                                                        request_size=RESUME_REQUEST_SIZE):
+                f.write(chunk)
+                done += len(chunk)
+                (progress or callback)(done, msg.document.size)
+            return done
+        return await msg.download_media(file=f, progress_callback=progress or callback)
+
+    # Stores the thumbnail in place of the file; the full file stays on Telegram, and the message keeps the
+    # size, type and name of it. Thumbnails are a few kilobytes, so they are written in one go.
+    async def _download_preview(self, msg: Message) -> Optional[Tuple[str, str]]:
+        thumb = preview_thumb(msg)
+        if thumb is None:
+            self.metrics.media_skipped += 1
+            return None
+        if getattr(msg, 'photo', None):
+            media_type = 'photo'
+        else:
+            media_type = document_media_type(getattr(msg.document, 'mime_type', '') or '')
+        name = self.output.unique_name(f"{PREVIEW_FOLDER}/{media_type}_{msg.id}.jpg")
+        stream = self.output.open_staged(name, compress=False)
+        hashing = HashingWriter(stream)
+        try:
+            # By its type: Telethon only takes some size objects as they are, and a progressive size is not one.
+            downloaded = await msg.download_media(file=hashing, thumb=thumb.type)
+        except BaseException:
+            self.output.abort(stream)
+            raise
+        if not downloaded:
+            self.output.abort(stream)
+            self.metrics.media_skipped += 1
+            return None
+        size = stream.tell()
+        self.metrics.record_download(size)
+        stream.close()
+        self._record(media_key(msg, thumb), name, media_type, size, hashing.finish(size))
+        await asyncio.sleep(self.delay_settings.delay_between_media)
+        return name, media_type
+
+    def _record(self, key: Optional[str], name: str, media_type: str, size: int, digest: str):
+        if self.manifest is not None and key:
+            self.manifest.add(key, ManifestEntry(name, media_type, size, digest))
+
+    # The file of a media this export has downloaded already, or an intact copy of it from an earlier export,
+    # which is linked or copied in. Files of earlier exports are hashed again first, off the event loop.
+    async def _reuse(self, key: str) -> Optional[Tuple[str, str]]:
+        if self.manifest is not None and key in self.manifest.entries and key not in self.reusable:
+            entry = self.manifest.entries[key]
+            self.metrics.media_reused += 1
+            return entry.path, entry.type
+        if key not in self.reusable:
+            return None
+        folder, entry = self.reusable.pop(key)
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, check_entry, folder, entry):
+            return None
+        name = entry.path
+        if folder != self.output.location:
+            name = self.output.unique_name(entry.path)
+            if isinstance(self.output, FolderOutput):
+                await loop.run_in_executor(None, self.output.copy_file, name, folder / entry.path)
+            else:
+                # Archive members are written from the event loop only.
+                self.output.copy_file(name, folder / entry.path, not is_compressed(name))
+        self._record(key, name, entry.type, entry.size, entry.hash)
+        self.metrics.media_reused += 1
+        return name, entry.type
+
+    # Bytes download() would fetch for the message, or None when it would skip it. Polls, geo points, dice and
+    # link previews without a photo or document have no file to fetch and are never planned.
+    def planned_size(self, msg: Message) -> Optional[int]:
+        if media_key(msg) is None:
+            return None
+        if self.media_types is not None and media_kind(msg) not in self.media_types:
+            return None
+        if self.preview:
+            thumb = preview_thumb(msg)
+            return photo_size_bytes(thumb) if thumb is not None else None
+        size = media_file_size(msg)
+        if self.max_file_size_bytes is not None and size > self.max_file_size_bytes:
+            return None
+        return size
+
+    # Hands the message to the scheduler instead of downloading it; False when download() would skip it.
+    def offer(self, msg: Message, scheduler: MediaScheduler) -> bool:
+        size = self.planned_size(msg)
+        if size is None:
+            self.metrics.media_skipped += 1
+            return False
+        scheduler.offer(msg.id, media_kind(msg) or 'document', size, msg.date)
+        return True
 
     async def download(self, msg: Message, pbar=None) -> Optional[Tuple[str, str]]:
         POSTFIX_WIDTH = 35
 
         def set_postfix(text=""):
-            if pbar:
+            if pbar is not None:
                 pbar.set_postfix_str(f" {text}".ljust(POSTFIX_WIDTH))
 
         try:
-            if self.max_file_size_bytes is not None:
-                file_size = 0
-                if getattr(msg, 'document', None) and getattr(msg.document, 'size', None):
-                    file_size = msg.document.size
-                elif getattr(msg, 'photo', None) and getattr(msg.photo, 'sizes', None):
-                    photo_sizes = [s.size for s in msg.photo.sizes if isinstance(s, PhotoSize) and s.size is not None]
-                    if photo_sizes:
-                        file_size = max(photo_sizes)
-
-                if file_size > self.max_file_size_bytes:
+            if self.media_types is not None and media_kind(msg) not in self.media_types:
+                self.metrics.media_skipped += 1
+                return None
+
+            if self.max_file_size_bytes is not None and not self.preview:
+                if media_file_size(msg) > self.max_file_size_bytes:
                     set_postfix(f"file > {self.max_file_size_bytes / (1024*1024):.2f}MB, skipping...")
+                    self.metrics.media_skipped += 1
                     await asyncio.sleep(0.5)
                     return None
 
+            key = media_key(msg, preview_thumb(msg) if self.preview else None)
+            if key and (reused := await self._reuse(key)):
+                return reused
+
             for attempt in range(self.delay_settings.max_retries):
                 try:
+                    if self.preview:
+                        return await self._download_preview(msg)
+
                     media_type, ext, suggested_name = "document", "bin", None
 
                     if getattr(msg, 'photo', None):
                         media_type, ext = "photo", "jpg"
                     elif getattr(msg, 'document', None):
-                        mime = getattr(msg.document, 'mime_type', '') or ''
-                        mt = mime.lower()
-                        if mt.startswith('image'):
-                            media_type = 'photo'
-                        elif mt.startswith('video'):
-                            media_type = 'video'
-                        elif mt.startswith('audio'):
-                            media_type = 'audio'
-                        else:
-                            media_type = 'document'
+                        mt = (getattr(msg.document, 'mime_type', '') or '').lower()
+                        media_type = document_media_type(mt)
                         try:
                             ext = mt.split('/')[-1] or ext
                         except:
@@ -75,22 +378,13 @@ class MediaHandler:
                     else:
                         media_type = 'document'
 
-                    target_folder = self.media_folder / media_type
-                    target_folder.mkdir(parents=True, exist_ok=True)
-
                     if suggested_name:
                         filename = suggested_name
                         if not Path(filename).suffix: filename = f"{filename}.{ext}"
                     else:
                         filename = f"{media_type}_{msg.id}.{ext}"
 
-                    filepath = target_folder / filename
-                    counter = 1
-                    while filepath.exists():
-                        name, suffix = Path(filename).stem, Path(filename).suffix
-                        filepath = target_folder / f"{name}_{counter}{suffix}"
-                        counter += 1
-
+                    name = self.output.unique_name(f"media/{media_type}/{filename}")
                     last_percent = -1
 
                     def callback(current, total):
@@ -101,12 +395,14 @@ class MediaHandler:
                                 last_percent = percent
                                 set_postfix(f"Downloading media ({percent}%)")
 
-                    saved_path = await msg.download_media(file=str(filepath), progress_callback=callback)
+                    downloaded = await self._download_to_output(msg, name, callback)
+                    if downloaded is None:
+                        return None
+                    size, digest = downloaded
+                    self.metrics.record_download(size)
                     await asyncio.sleep(self.delay_settings.delay_between_media)
 
-                    if not saved_path: return None
-                    saved_path = Path(saved_path)
-                    saved_ext = saved_path.suffix.lower().lstrip('.')
+                    saved_ext = Path(name).suffix.lower().lstrip('.')
                     if saved_ext in ('jpg', 'jpeg', 'png', 'webp', 'gif'):
                         media_type = 'photo'
                     elif saved_ext in ('mp4', 'mov', 'webm', 'mkv', 'avi'):
@@ -114,19 +410,25 @@ class MediaHandler:
                     elif saved_ext in ('mp3', 'wav', 'ogg', 'm4a', 'flac'):
                         media_type = 'audio'
 
-                    return f"media/{media_type}/{saved_path.name}", media_type
+                    self._record(key, name, media_type, size, digest)
+                    return name, media_type
 
                 except (FloodWaitError, TelegramTimeoutError, TimeoutError) as e:
                     if attempt < self.delay_settings.max_retries - 1:
                         wait_time = self.delay_settings.retry_delay * (attempt + 1)
-                        if isinstance(e, FloodWaitError): wait_time = max(wait_time, e.seconds)
+                        if isinstance(e, FloodWaitError):
+                            wait_time = max(wait_time, e.seconds)
+                            self.metrics.record_flood_wait(wait_time)
+                        self.metrics.media_retries += 1
                         set_postfix(f"error, retry in {wait_time}s...")
                         await asyncio.sleep(wait_time)
                     else:
+                        self.metrics.media_failures += 1
                         set_postfix("failed, skipping...")
                         await asyncio.sleep(0.5)
                         return None
                 except Exception:
+                    self.metrics.media_failures += 1
                     set_postfix("failed, skipping...")
                     await asyncio.sleep(0.5)
                     return None
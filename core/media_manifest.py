@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, NamedTuple, Optional, Tuple
+
+from .export_output import ExportOutput
+
+# Written next to messages.html: every media file of the export under the Telegram id of its media, with
+# the size and hash it was downloaded with, so a file can be checked without fetching it again.
+MANIFEST_NAME = 'media_manifest.json'
+
+# BLAKE2b is in hashlib and hashes faster than the disk reads, so verifying is bound by I/O, not the hash.
+HASH_ALGORITHM = 'blake2b-128'
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def new_hash():
+    return hashlib.blake2b(digest_size=16)
+
+
+class ManifestEntry(NamedTuple):
+    path: str
+    type: str
+    size: int
+    hash: str
+
+
+# The Telegram id of the file a download fetches: its photo or document, or one thumbnail of it.
+def media_key(msg, thumb=None) -> Optional[str]:
+    photo, document = getattr(msg, 'photo', None), getattr(msg, 'document', None)
+    media = photo or document
+    if media is None or not getattr(media, 'id', None):
+        return None
+    key = f"{'photo' if photo else 'document'}_{media.id}"
+    return f"{key}_thumb_{thumb.type}" if thumb is not None else key
+
+
+def hash_file(path: Path, hasher=None, offset: int = 0) -> Tuple[int, str]:
+    hasher = hasher or new_hash()
+    size = offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while chunk := f.read(READ_CHUNK_SIZE):
+            hasher.update(chunk)
+            size += len(chunk)
+    return size, hasher.hexdigest()
+
+
+# What is wrong with the file of an entry, or None when it is intact.
+def check_entry(folder: Path, entry: ManifestEntry) -> Optional[str]:
+    path = folder / entry.path
+    try:
+        if path.stat().st_size != entry.size:
+            return 'size'
+        return None if hash_file(path)[1] == entry.hash else 'hash'
+    except OSError:
+        return 'missing'
+
+
+# Hashes a download while it is written. Writes that do not continue the hashed part, such as the parts of
+# a parallel download landing out of order or the rest of a resumed .part file, are left to finish(), which
+# reads what was not hashed back from the file.
+class HashingWriter:
+    def __init__(self, stream: BinaryIO, path: Optional[Path] = None):
+        self.stream = stream
+        self.path = path
+        self.hasher = new_hash()
+        self.hashed = 0
+        self.position = stream.tell()
+        if self.position and path is not None:
+            # A resumed .part file: what an earlier run wrote is hashed before the rest comes in.
+            self.hashed = hash_file(path, self.hasher)[0]
+
+    def write(self, data) -> int:
+        if self.position == self.hashed:
+            self.hasher.update(data)
+            self.hashed += len(data)
+        self.position += len(data)
+        return self.stream.write(data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self.position = self.stream.seek(offset, whence)
+        return self.position
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        size = self.stream.truncate(size)
+        if size < self.hashed:
+            self.hasher, self.hashed = new_hash(), 0
+        return size
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def finish(self, size: int) -> str:
+        if self.hashed < size and self.path is not None:
+            self.stream.flush()
+            return hash_file(self.path, self.hasher, self.hashed)[1]
+        return self.hasher.hexdigest()
+
+
+class MediaManifest:
+    def __init__(self, chat_id: Optional[int] = None, entries: Optional[Dict[str, ManifestEntry]] = None):
+        self.chat_id = chat_id
+        self.entries: Dict[str, ManifestEntry] = entries or {}
+
+    def add(self, key: str, entry: ManifestEntry):
+        self.entries[key] = entry
+
+    def by_hash(self) -> Dict[Tuple[int, str], ManifestEntry]:
+        return {(entry.size, entry.hash): entry for entry in self.entries.values()}
+
+    @classmethod
+    def load(cls, folder: Path) -> Optional['MediaManifest']:
+        try:
+            with open(folder / MANIFEST_NAME, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('algorithm') != HASH_ALGORITHM:
+            return None
+        return cls(data.get('chat_id'), {key: ManifestEntry(**entry) for key, entry in data['media'].items()})
+
+    def write(self, output: ExportOutput):
+        with output.open_text(MANIFEST_NAME) as f:
+            json.dump({'chat_id': self.chat_id, 'algorithm': HASH_ALGORITHM,
+                       'media': {key: entry._asdict() for key, entry in self.entries.items()}}, f,
+                      ensure_ascii=False, indent=1)
+
+    # Checks every file against its entry, several at a time: hashlib lets go of the GIL while it hashes, so
+    # the threads read and hash in parallel. Returns the entries that are not intact with what is wrong.
+    def verify(self, folder: Path, workers: Optional[int] = None,
+               progress: Optional[Callable[[ManifestEntry], None]] = None) -> Dict[str, str]:
+        problems = {}
+        with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+            checked = pool.map(lambda entry: check_entry(folder, entry), self.entries.values())
+            for (key, entry), problem in zip(self.entries.items(), checked):
+                if problem:
+                    problems[key] = problem
+                if progress:
+                    progress(entry)
+        return problems
+
+
+# Media of the earlier folder exports of a chat that a new export can take instead of downloading them
+# again, the newest export winning. Only folders named after the chat are read.
+def reusable_media(exports_dir: Path, prefix: str, chat_id: int,
+                   exclude: Optional[Path] = None) -> Dict[str, Tuple[Path, ManifestEntry]]:
+    found = {}
+    if not exports_dir.is_dir():
+        return found
+    for folder in sorted(exports_dir.iterdir()):
+        if folder == exclude or not folder.name.startswith(prefix) or not (folder / MANIFEST_NAME).is_file():
+            continue
+        manifest = MediaManifest.load(folder)
+        if manifest and manifest.chat_id == chat_id:
+            found.update((key, (folder, entry)) for key, entry in manifest.entries.items())
+    return found
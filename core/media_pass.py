@@ -0,0 +1,107 @@
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional
+
+from tqdm.asyncio import tqdm as async_tqdm
+
+from . import utils
+from .database import clear_media_pending, iter_pending_media, requeue_media_paths, set_media_files
+from .export_output import FolderOutput
+from .html_generator import day_key
+from .media_manifest import MediaManifest, media_key
+from .metrics import ExportMetrics
+from .sync import SYNC_BATCH_SIZE, ExportSync
+
+
+# Second phase of a two-phase export: downloads the media its first phase left pending into the export
+# folder, in the order they were planned. The messages are fetched back by id a hundred at a time, and each
+# batch goes into the message store as soon as it is downloaded, so the pass can be stopped at any point (or
+# at a set time) and the next run goes on with what is left. Only the days of messages.html that got media
+# are rendered again, as a sync does.
+class MediaPass(ExportSync):
+    def open(self) -> bool:
+        if not self.store_path.is_file():
+            print(f"❌ '{self.folder.name}' has no pending media: it was not exported with its media left for later.")
+            return False
+        return super().open()
+
+    # Files a verify found missing or damaged are downloaded again by the next run: each is deleted along with
+    # its manifest entry, and the messages showing it are queued.
+    def requeue(self, manifest: MediaManifest, keys: Iterable[str]) -> int:
+        paths = []
+        for key in keys:
+            entry = manifest.entries.pop(key)
+            paths.append(entry.path)
+            try:
+                (self.folder / entry.path).unlink()
+            except OSError:
+                pass
+        manifest.write(FolderOutput(self.folder))
+        return requeue_media_paths(self.db, paths)
+
+    async def run(self, entity, stop_at: Optional[datetime] = None) -> dict:
+        from .media_handler import PREVIEW_MANIFEST_NAME, MediaHandler, write_preview_manifest
+        from .parallel_download import ParallelDownloader
+        pending = list(iter_pending_media(self.db))
+        if not pending:
+            print("✅ No media is pending in this export.")
+            return {'downloaded': 0, 'failed': 0, 'left': 0}
+
+        preview = bool(self.info.get('media_preview'))
+        metrics = ExportMetrics(self.info.get('chat_name', ''))
+        parallel_downloader = None
+        if not preview:
+            parallel_downloader = ParallelDownloader(self.client, self.delay_settings.parallel_connections,
+                                                     self.delay_settings.download_part_size_kb, metrics)
+        output = FolderOutput(self.folder)
+        # Files an interrupted run downloaded after its last batch was stored are taken as they are if intact.
+        manifest = MediaManifest.load(self.folder) or MediaManifest(self.chat_id)
+        reusable = {key: (self.folder, entry) for key, entry in manifest.entries.items()}
+        media_handler = MediaHandler(output, self.delay_settings, metrics=metrics,
+                                     parallel_downloader=parallel_downloader, preview=preview, manifest=manifest,
+                                     reusable=reusable)
+        print(f"\n📥 {len(pending)} pending {'preview(s)' if preview else 'file(s)'}, "
+              f"{utils.format_size(sum(size or 0 for _, _, size in pending))} in all"
+              f"{f', stopping at {stop_at:%H:%M}' if stop_at else ''}.")
+
+        changed_days: Dict[str, date] = {}
+        downloaded, failed, gone = 0, 0, 0
+        pbar = async_tqdm(total=len(pending), unit=" file", colour='green', desc="Media")
+        try:
+            for start in range(0, len(pending), SYNC_BATCH_SIZE):
+                if stop_at and datetime.now() >= stop_at:
+                    print(f"\n⏸️ Stopped at {stop_at:%H:%M}; run the media pass again to go on.")
+                    break
+                batch = pending[start:start + SYNC_BATCH_SIZE]
+                messages = await self.client.get_messages(entity, ids=[msg_id for msg_id, _, _ in batch])
+                files, missing = [], []
+                for (msg_id, msg_date, _), msg in zip(batch, messages):
+                    # Deleted from the chat since, or its media removed or left without a file to fetch (a link
+                    # preview that lost its photo, say): the placeholder stays.
+                    if msg is None or not msg.media or media_key(msg) is None:
+                        missing.append(msg_id)
+                        changed_days[day_key(msg_date)] = msg_date.date()
+                    elif result := await media_handler.download(msg, pbar):
+                        files.append((msg_id, *result, preview or None))
+                        changed_days[day_key(msg_date)] = msg_date.date()
+                    else:
+                        failed += 1
+                    pbar.update(1)
+                set_media_files(self.db, files)
+                clear_media_pending(self.db, missing)
+                downloaded += len(files)
+                gone += len(missing)
+        finally:
+            pbar.close()
+            await media_handler.close()
+            manifest.write(output)
+            # Also when the pass is interrupted, so the pages show everything downloaded so far.
+            if changed_days:
+                self._render(entity, changed_days)
+            if preview:
+                write_preview_manifest(output, self.db, self.chat_id, self.info.get('chat_name', ''))
+                print(f"🔖 Previews listed in {PREVIEW_MANIFEST_NAME}")
+
+        left = len(pending) - downloaded - gone
+        print(f"✅ Downloaded: {downloaded}   ❌ Failed: {failed}   🗑️ Gone or without a file: {gone}   "
+              f"⏳ Left: {left}")
+        return {'downloaded': downloaded, 'failed': failed, 'left': left}
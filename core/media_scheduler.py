@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from . import utils
+
+# Orders the downloads can be planned in. They combine, the first one deciding and the next ones breaking
+# ties; what is left over keeps the message order.
+PRIORITIES = ('small', 'newest', 'oldest', 'type')
+
+# Rank of each media kind for the 'type' priority: what is cheap and most looked at first, documents last.
+TYPE_ORDER = ('photo', 'round', 'voice', 'gif', 'video', 'audio', 'document')
+
+
+class PlannedMedia(NamedTuple):
+    msg_id: int
+    kind: str
+    size: int
+    date: datetime
+
+
+# Decides which media of an export are downloaded before any of them is. Every message with media is
+# offered with the size Telegram reports for its file; the plan then walks them in priority order and takes
+# every file that still fits the total budget and the quota of its type. A file too large for what is left
+# is passed over rather than ending the plan, so smaller ones behind it still get in.
+class MediaScheduler:
+    def __init__(self, budget_mb: Optional[float] = None, quotas_mb: Optional[Dict[str, float]] = None,
+                 priority: Optional[Iterable[str]] = None):
+        self.budget = int(budget_mb * 1024 * 1024) if budget_mb is not None else None
+        self.quotas = {kind: int(mb * 1024 * 1024) for kind, mb in (quotas_mb or {}).items()}
+        self.priority = list(priority or [])
+        self.offered: List[PlannedMedia] = []
+        self.planned: List[PlannedMedia] = []
+
+    def offer(self, msg_id: int, kind: str, size: int, date: datetime):
+        self.offered.append(PlannedMedia(msg_id, kind, size, date))
+
+    def plan(self) -> List[PlannedMedia]:
+        candidates = list(self.offered)
+        for key in reversed(self.priority):
+            if key == 'small':
+                candidates.sort(key=lambda item: item.size)
+            elif key == 'newest':
+                candidates.sort(key=lambda item: item.date, reverse=True)
+            elif key == 'oldest':
+                candidates.sort(key=lambda item: item.date)
+            elif key == 'type':
+                candidates.sort(key=lambda item: TYPE_ORDER.index(item.kind) if item.kind in TYPE_ORDER
+                                else len(TYPE_ORDER))
+
+        remaining = self.budget
+        quotas = dict(self.quotas)
+        self.planned = []
+        for item in candidates:
+            if remaining is not None and item.size > remaining:
+                continue
+            if item.kind in quotas:
+                if item.size > quotas[item.kind]:
+                    continue
+                quotas[item.kind] -= item.size
+            if remaining is not None:
+                remaining -= item.size
+            self.planned.append(item)
+        return self.planned
+
+    @property
+    def planned_bytes(self) -> int:
+        return sum(item.size for item in self.planned)
+
+    def summary(self) -> List[str]:
+        offered_bytes = sum(item.size for item in self.offered)
+        lines = [f"📋 Media plan: {len(self.planned)} of {len(self.offered)} file(s), "
+                 f"{utils.format_size(self.planned_bytes)} of {utils.format_size(offered_bytes)}"]
+        # Per kind: files and bytes offered, then files and bytes planned.
+        kinds: Dict[str, List[int]] = {}
+        for item in self.offered:
+            stats = kinds.setdefault(item.kind, [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += item.size
+        for item in self.planned:
+            stats = kinds[item.kind]
+            stats[2] += 1
+            stats[3] += item.size
+        for kind, (count, size, planned, planned_size) in kinds.items():
+            quota = f" (quota {utils.format_size(self.quotas[kind])})" if kind in self.quotas else ""
+            lines.append(f"   - {kind}: {planned} of {count}, {utils.format_size(planned_size)} of "
+                         f"{utils.format_size(size)}{quota}")
+        return lines
+
+
+def parse_quotas(text: str, media_types: Iterable[str]) -> Dict[str, float]:
+    quotas = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        kind, _, value = part.partition('=')
+        kind = kind.strip().lower()
+        if kind not in media_types:
+            raise ValueError(f"unknown media type '{kind}'")
+        quotas[kind] = float(value)
+    return quotas
@@ -1,17 +1,41 @@
+import io
+import json
+import os
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
+from operator import attrgetter
 from pathlib import Path
-from typing import Optional
-from bs4 import BeautifulSoup
-from .html_generator import HtmlGenerator
+from typing import Dict, List, Optional, Tuple
+from .database import (STORE_NAME, get_export_info, insert_messages, iter_message_rows, open_store,
+                       set_export_info)
+from .export_output import FolderOutput
+from .html_generator import (HTML_INDEX_NAME, HtmlGenerator, date_separator, encode_page_text, encoded_length,
+                             load_page_index, parse_index_date, write_page_index)
+from .media_manifest import ManifestEntry, MediaManifest
+from .message_record import MediaFile, MessageRecord
+from .precompress import open_page_file, page_formats, recompress_page, replace_page_file
+from .profiler import PROFILE_STACKS_NAME, PROFILE_SUMMARY_NAME, SamplingProfiler
+
+COPY_CHUNK_SIZE = 1024 * 1024
+COPY_BATCH_SIZE = 2000
+
+
+def _file_size(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return None
 
 
 class Merger:
-    def __init__(self, path1: str, path2: str):
+    def __init__(self, path1: str, path2: str, profile: bool = False):
         self.path1 = Path(path1)
         self.path2 = Path(path2)
         self.html1_path = self.path1 / "messages.html"
         self.html2_path = self.path2 / "messages.html"
+        self.profile = profile
+        # The folder the result is written to, where the profile goes too.
+        self.output_path: Optional[Path] = None
 
     def _validate_paths(self) -> bool:
         if not self.path1.is_dir() or not self.html1_path.is_file():
@@ -23,6 +47,30 @@ class Merger:
         return True
 
     def merge(self):
+        self._profiled(self._merge, Merger.merge, "merge")
+
+    def append(self):
+        self._profiled(self._append, Merger.append, "append")
+
+    def _profiled(self, run, root, action: str):
+        if not self.profile:
+            return run()
+        profiler = SamplingProfiler(f"{action} of {self.path2.name} into {self.path1.name}", root)
+        profiler.start()
+        try:
+            run()
+        finally:
+            profiler.stop()
+            if self.output_path:
+                try:
+                    output = FolderOutput(self.output_path)
+                    profiler.write(output)
+                    print(f"🔥 Profile: {output.describe(PROFILE_STACKS_NAME)}")
+                    print(f"   Hot functions: {output.describe(PROFILE_SUMMARY_NAME)}")
+                except Exception as e:
+                    print(f"⚠️ Warning: Could not write the profile: {e}")
+
+    def _merge(self):
         if not self._validate_paths():
             return
 
@@ -37,8 +85,10 @@ class Merger:
 
             combined_messages = messages1
             combined_messages.update(messages2)
+            del messages2
 
-            all_messages = sorted(list(combined_messages.values()), key=lambda x: x['date'])
+            all_messages = sorted(combined_messages.values(), key=attrgetter('date'))
+            del combined_messages
 
             if not all_messages:
                 print("❌ No messages found to merge.")
@@ -46,13 +96,199 @@ class Merger:
 
             self._generate_merged_export(all_messages)
 
+        except ImportError:
+            # Left to the caller, which tells what to install.
+            raise
         except Exception as e:
             print(f"❌ An error occurred during merge: {e}")
             import traceback
             traceback.print_exc()
 
+    # Adds the second export to the end of the first one, in place. With the day index both pages were
+    # written with, the new days are spliced in exactly as they were rendered and only the header is built
+    # again, so an append costs as much as the new messages, whatever the size of the chat. Exports without
+    # an index, or that overlap, go through the full merge instead.
+    def _append(self):
+        if not self._validate_paths():
+            return
+        self.output_path = self.path1
+        old_index, new_index = load_page_index(self.path1), load_page_index(self.path2)
+        old_last = parse_index_date(old_index and old_index['last_date'])
+        new_first = parse_index_date(new_index and new_index['first_date'])
+        if not old_index or not new_index or (old_last and new_first and new_first <= old_last):
+            print("\n⚠️ The exports cannot be appended page by page, merging them in full instead.")
+            return self._merge()
+
+        print("\n⏳ Appending new messages...")
+        try:
+            print("   - Copying media files...")
+            renamed_media = self._copy_new_media()
+            renamed = {f'"{old}"'.encode('utf-8'): f'"{new}"'.encode('utf-8') for old, new in renamed_media.items()}
+
+            with open(self.html2_path, 'rb') as f:
+                f.seek(new_index['head_bytes'])
+                new_body = f.read(new_index['body_bytes'])
+            bounds = [offset for _, offset in new_index['days'][1:]] + [len(new_body)]
+            days = [tuple(day) for day in old_index['days']]
+            position = old_index['body_bytes']
+            chunks = []
+            for (date_key, start), end in zip(new_index['days'], bounds):
+                chunk = new_body[start:end]
+                if days and days[-1][0] == date_key:
+                    # The first new day goes on with the last day of the page, under its separator.
+                    chunk = chunk[encoded_length(date_separator(date_key, new_index.get('minified', False))):]
+                else:
+                    days.append((date_key, position))
+                for old_name, new_name in renamed.items():
+                    chunk = chunk.replace(old_name, new_name)
+                chunks.append(chunk)
+                position += len(chunk)
+
+            total = old_index['total_messages'] + new_index['total_messages']
+            generator = HtmlGenerator(old_index['chat_name'], [], parse_index_date(old_index['start_date']),
+                                      parse_index_date(new_index['end_date']), total,
+                                      parse_index_date(old_index['first_date'] or new_index['first_date']),
+                                      parse_index_date(new_index['last_date'] or old_index['last_date']),
+                                      old_index['filters'], old_index.get('minified', False))
+            head, tail = (encode_page_text(part) for part in generator.template_parts())
+            print("   - Updating HTML file...")
+            self._splice_html(old_index, head, chunks, tail)
+
+            index = dict(old_index, end_date=new_index['end_date'], total_messages=total,
+                         first_date=generator.first_date and generator.first_date.isoformat(),
+                         last_date=generator.last_date and generator.last_date.isoformat(),
+                         head_bytes=len(head), body_bytes=position, tail_bytes=len(tail), days=days)
+            write_page_index(self.path1, index)
+            self._append_store(renamed_media)
+        except Exception as e:
+            print(f"❌ An error occurred during append: {e}")
+            import traceback
+            traceback.print_exc()
+            return
+
+        print(f"\n{'=' * 60}")
+        print("✨ APPEND COMPLETED!")
+        print(f"📄 File: {self.html1_path.absolute()}")
+        print(f"📊 Messages: {total} (+{new_index['total_messages']})")
+        print(f"{'=' * 60}")
+
+    # The messages already on the page stay where they are when the header keeps its length, which is the
+    # usual case; otherwise they are copied once behind the new header, still without being parsed.
+    def _splice_html(self, old_index: dict, head: bytes, chunks: list, tail: bytes):
+        body_end = old_index['head_bytes'] + old_index['body_bytes']
+        formats = page_formats(self.html1_path)
+        if len(head) == old_index['head_bytes']:
+            # The page is changed where it lies, so its index goes first: an append interrupted half-way leaves a
+            # page without an index, which the next append merges in full rather than splicing at offsets that
+            # no longer hold. The new days and the tail are on disk before the header that counts them.
+            (self.path1 / HTML_INDEX_NAME).unlink(missing_ok=True)
+            with open(self.html1_path, 'r+b') as f:
+                f.seek(body_end)
+                f.truncate()
+                f.writelines(chunks)
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+                f.seek(0)
+                f.write(head)
+                f.flush()
+                os.fsync(f.fileno())
+            # The pre-compressed copies cannot be changed in place; they are compressed again.
+            recompress_page(self.html1_path, formats)
+            return
+
+        tmp_path = self.html1_path.with_name(self.html1_path.name + '.tmp')
+        with open(self.html1_path, 'rb') as src, open_page_file(tmp_path, formats) as dst:
+            dst.write(head)
+            src.seek(old_index['head_bytes'])
+            remaining = old_index['body_bytes']
+            while remaining:
+                block = src.read(min(remaining, COPY_CHUNK_SIZE))
+                dst.write(block)
+                remaining -= len(block)
+            dst.writelines(chunks)
+            dst.write(tail)
+        replace_page_file(tmp_path, self.html1_path, formats)
+
+    # The first export's message store takes in the new messages as well, or a later sync would render its
+    # days without them. A store that cannot be brought up to date is removed instead.
+    def _append_store(self, renamed_media: Dict[str, str]):
+        store_path, new_store_path = self.path1 / STORE_NAME, self.path2 / STORE_NAME
+        if not store_path.exists():
+            return
+        if not new_store_path.exists():
+            store_path.unlink()
+            print(f"   - ⚠️ The new export has no {STORE_NAME}; the old one was removed, so this export can no "
+                  f"longer be synced.")
+            return
+        print("   - Updating message store...")
+        db, new_db = open_store(store_path), open_store(new_store_path)
+        try:
+            rows = []
+            for row in iter_message_rows(new_db):
+                row['media_path'] = renamed_media.get(row['media_path'], row['media_path'])
+                rows.append(row)
+                if len(rows) >= COPY_BATCH_SIZE:
+                    insert_messages(db, rows)
+                    rows = []
+            insert_messages(db, rows)
+            set_export_info(db, end_date=get_export_info(new_db).get('end_date'))
+        finally:
+            db.close()
+            new_db.close()
+
+    # Copies the media of the second export next to the first one's. A name that is taken already gets a
+    # counter; the returned mapping renames the new messages' references to match. With media manifests, a
+    # file the first export has already (the same Telegram media, or the same size and hash) is not copied
+    # and the new messages point at the one that is there.
+    def _copy_new_media(self) -> Dict[str, str]:
+        renamed = {}
+        src_media_path = self.path2 / "media"
+        if not src_media_path.is_dir():
+            return renamed
+        manifest1, manifest2 = MediaManifest.load(self.path1), MediaManifest.load(self.path2)
+        new_entries = {entry.path: (key, entry) for key, entry in manifest2.entries.items()} if manifest2 else {}
+        if manifest2 and not manifest1:
+            manifest1 = MediaManifest(manifest2.chat_id)
+        by_hash = manifest1.by_hash() if manifest1 else {}
+        deduplicated = 0
+        for file in sorted(src_media_path.rglob('*')):
+            if not file.is_file(): continue
+            name = file.relative_to(self.path2).as_posix()
+            key, entry = new_entries.get(name, (None, None))
+            if entry:
+                existing = manifest1.entries.get(key)
+                if not existing or (existing.size, existing.hash) != (entry.size, entry.hash):
+                    existing = by_hash.get((entry.size, entry.hash))
+                if existing and _file_size(self.path1 / existing.path) == existing.size:
+                    if existing.path != name:
+                        renamed[name] = existing.path
+                    deduplicated += 1
+                    continue
+            dest_file, counter = self.path1 / name, 1
+            while dest_file.exists():
+                dest_file = dest_file.with_name(f"{file.stem}_{counter}{file.suffix}")
+                counter += 1
+            dest_file.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(file, dest_file)
+            new_name = dest_file.relative_to(self.path1).as_posix()
+            if new_name != name:
+                renamed[name] = new_name
+            if entry:
+                manifest1.add(key, entry._replace(path=new_name))
+                by_hash[(entry.size, entry.hash)] = manifest1.entries[key]
+        if manifest1:
+            manifest1.write(FolderOutput(self.path1))
+        if deduplicated:
+            print(f"   - ♻️ {deduplicated} media file(s) already in the first export were not copied again")
+        return renamed
+
+    # Messages are keyed by date, sender and text to drop the ones both exports contain. The key is a tuple
+    # of the record's own values, so it costs no copy of the text.
     @staticmethod
-    def _parse_html_file(html_path: Path) -> dict:
+    def _parse_html_file(html_path: Path) -> Dict[Tuple[datetime, str, str], MessageRecord]:
+        # Only pages without an index are parsed, so only they need bs4 and lxml.
+        from bs4 import BeautifulSoup
         messages = {}
         with open(html_path, 'r', encoding='utf-8') as f:
             soup = BeautifulSoup(f, 'lxml')
@@ -70,12 +306,11 @@ class Merger:
             elif 'message' in classes and current_date_str:
                 msg_data = Merger._extract_message_data(element, current_date_str)
                 if msg_data:
-                    unique_key = f"{msg_data['date'].isoformat()}-{msg_data['from']}-{msg_data['text']}"
-                    messages[unique_key] = msg_data
+                    messages[(msg_data.date, msg_data.sender, msg_data.text)] = msg_data
         return messages
 
     @staticmethod
-    def _extract_message_data(tag, date_str: str) -> dict or None:
+    def _extract_message_data(tag, date_str: str) -> Optional[MessageRecord]:
         time_tag = tag.find('span', class_='time')
         if not time_tag: return None
         time_str = time_tag.get_text(strip=True)
@@ -95,37 +330,44 @@ class Merger:
             video = media_div.select_one('video.media-item')
             audio = media_div.select_one('audio')
             doc = media_div.select_one('a.document-name')
-            if img and img.get('src'): media_files.append({'path': img['src'], 'type': 'photo'})
-            if video and video.get('src'): media_files.append({'path': video['src'], 'type': 'video'})
-            if audio and audio.get('src'): media_files.append({'path': audio['src'], 'type': 'audio'})
-            if doc and doc.get('href'): media_files.append({'path': doc['href'], 'type': 'document'})
-
-        return {
-            'date': dt_obj,
-            'from': sender,
-            'text': text_html,
-            'media_files': media_files
-        }
-
-    def _generate_merged_export(self, messages: list):
+            if 'media-preview' in media_div.get('class', []):
+                size = media_div.get('data-size')
+                if img and img.get('src'):
+                    media_files.append(MediaFile(img['src'], media_div.get('data-type') or 'photo',
+                                                 int(size) if size else None, True))
+                continue
+            if img and img.get('src'): media_files.append(MediaFile(img['src'], 'photo'))
+            if video and video.get('src'): media_files.append(MediaFile(video['src'], 'video'))
+            if audio and audio.get('src'): media_files.append(MediaFile(audio['src'], 'audio'))
+            if doc and doc.get('href'): media_files.append(MediaFile(doc['href'], 'document'))
+
+        return MessageRecord(dt_obj, sender, text_html, media_files=tuple(media_files))
+
+    def _generate_merged_export(self, messages: List[MessageRecord]):
         original_chat_name = self.path1.name.rsplit('_', 1)[0]
 
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         new_folder_name = f"{original_chat_name}_merged_{timestamp}"
         new_export_path = Path(f"exports/{new_folder_name}")
         new_export_path.mkdir(parents=True, exist_ok=True)
+        self.output_path = new_export_path
 
         print("   - Copying media files...")
         self._copy_media_files(new_export_path)
 
         print("   - Generating new HTML file...")
-        first_msg_date = messages[0]['date']
-        last_msg_date = messages[-1]['date']
+        first_msg_date = messages[0].date
+        last_msg_date = messages[-1].date
 
-        generator = HtmlGenerator(original_chat_name, messages, first_msg_date, last_msg_date)
-        html_content = generator.generate()
+        # Written the way the first export was: minified, and with the same pre-compressed copies.
+        old_index = load_page_index(self.path1)
+        generator = HtmlGenerator(original_chat_name, messages, first_msg_date, last_msg_date,
+                                  minify=bool(old_index and old_index.get('minified')))
         html_file = new_export_path / "messages.html"
-        html_file.write_text(html_content, encoding='utf-8')
+        with io.TextIOWrapper(open_page_file(html_file, page_formats(self.html1_path)), encoding='utf-8') as f:
+            generator.write(f)
+        with open(new_export_path / HTML_INDEX_NAME, 'w', encoding='utf-8') as f:
+            json.dump(generator.index(), f)
 
         print(f"\n{'=' * 60}")
         print("✨ MERGE COMPLETED!")
@@ -133,13 +375,21 @@ class Merger:
         print(f"📊 Messages: {len(messages)}")
         print(f"{'=' * 60}")
 
+    # Files both exports have under the same name with the same content, as the manifests tell, are copied
+    # once; the merged export gets a manifest of everything copied.
     def _copy_media_files(self, new_export_path: Path):
         new_media_path = new_export_path / "media"
         new_media_path.mkdir(exist_ok=True)
+        merged: Optional[MediaManifest] = None
+        copied: Dict[str, ManifestEntry] = {}
 
         for src_path in [self.path1, self.path2]:
             src_media_path = src_path / "media"
             if not src_media_path.is_dir(): continue
+            manifest = MediaManifest.load(src_path)
+            entries = {entry.path: (key, entry) for key, entry in manifest.entries.items()} if manifest else {}
+            if manifest and not merged:
+                merged = MediaManifest(manifest.chat_id)
 
             for media_type_dir in src_media_path.iterdir():
                 if not media_type_dir.is_dir(): continue
@@ -148,13 +398,32 @@ class Merger:
                 new_target_dir.mkdir(exist_ok=True)
 
                 for file in media_type_dir.iterdir():
+                    name = file.relative_to(src_path).as_posix()
+                    key, entry = entries.get(name, (None, None))
                     dest_file = new_target_dir / file.name
                     if dest_file.exists():
+                        if entry and copied.get(name) == entry:
+                            continue
                         counter = 1
                         while dest_file.exists():
                             dest_file = new_target_dir / f"{file.stem}_{counter}{file.suffix}"
                             counter += 1
                     shutil.copy(file, dest_file)
+                    if entry:
+                        new_name = dest_file.relative_to(new_export_path).as_posix()
+                        copied[new_name] = entry._replace(path=new_name)
+                        merged.add(key, copied[new_name])
+        if merged:
+            merged.write(FolderOutput(new_export_path))
+
+    # With an index the last message date is exact to the second, so the new export can start right after
+    # it and append without overlapping; otherwise it starts at the minute of the last message on the page.
+    @classmethod
+    def get_append_start_date(cls, folder_path: Path) -> Optional[datetime]:
+        index = load_page_index(folder_path)
+        if index and index['last_date']:
+            return datetime.fromisoformat(index['last_date']).replace(tzinfo=None) + timedelta(seconds=1)
+        return cls.get_last_message_date(folder_path)
 
     @classmethod
     def get_last_message_date(cls, folder_path: Path) -> Optional[datetime]:
@@ -167,7 +436,8 @@ class Merger:
             if not messages_dict:
                 return None
 
-            all_messages = sorted(list(messages_dict.values()), key=lambda x: x['date'])
-            return all_messages[-1]['date']
+            return max(msg.date for msg in messages_dict.values())
+        except ImportError:
+            raise
         except Exception:
             return None
\ No newline at end of file
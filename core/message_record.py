@@ -0,0 +1,57 @@
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from . import utils
+
+
+class MediaFile(NamedTuple):
+    path: str
+    type: str
+    # Size of the original file, and whether ``path`` is only a thumbnail of it.
+    size: Optional[int] = None
+    preview: bool = False
+
+
+def intern_name(name: Optional[str]) -> Optional[str]:
+    return sys.intern(name) if name else name
+
+
+# One message of the page, an album being a single record. Rendering and merging carry one of these per
+# message, so it is slotted instead of a dict of dicts: no per-message dict for the record, its reply
+# preview, its forward or its media. Sender names repeat across the whole chat and are interned, so every
+# message of a sender points at the same string.
+class MessageRecord:
+    __slots__ = ('date', 'sender', 'text', 'reply_sender', 'reply_text', 'forwarded_from', 'media_files',
+                 'media_placeholder', 'media_pending', 'action_text')
+
+    def __init__(self, date: datetime, sender: Optional[str], text: Optional[str] = None,
+                 reply_sender: Optional[str] = None, reply_text: Optional[str] = None,
+                 forwarded_from: Optional[str] = None, media_files: Tuple[MediaFile, ...] = (),
+                 media_placeholder: Optional[str] = None, action_text: Optional[str] = None,
+                 media_pending: bool = False):
+        self.date = date
+        self.sender = intern_name(sender)
+        self.text = text
+        self.reply_sender = intern_name(reply_sender)
+        self.reply_text = reply_text
+        self.forwarded_from = intern_name(forwarded_from)
+        self.media_files = media_files
+        self.media_placeholder = media_placeholder
+        # The media is left for the media pass of a two-phase export.
+        self.media_pending = media_pending
+        self.action_text = action_text
+
+    def add_media(self, path: str, media_type: str, size: Optional[int] = None, preview: bool = False):
+        self.media_files += (MediaFile(path, media_type, size, preview),)
+
+    def renderable(self) -> bool:
+        return bool(self.text or self.media_files or self.action_text or self.media_placeholder)
+
+
+# Records as messages.html shows them: empty ones dropped and the text formatted in place.
+def page_records(records: Iterable[MessageRecord]) -> Iterator[MessageRecord]:
+    for record in records:
+        if record.renderable():
+            record.text = utils.format_text(record.text or '')
+            yield record
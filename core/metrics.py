@@ -0,0 +1,202 @@
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from .export_output import ExportOutput
+
+TELETHON_CALL_LOGGER = 'telethon.client.users'
+
+# The metrics of the export running in the current task. Exports running side by side share the Telethon
+# logger, and this is how each handler tells its own records from the others'.
+_current_metrics = ContextVar('current_metrics', default=None)
+_saved_log_state = None
+
+
+# Telethon sleeps through short FloodWaits by itself and only reports them through this log record,
+# so the record is the one place where those waits can be counted.
+class _FloodWaitLogHandler(logging.Handler):
+    def __init__(self, metrics: 'ExportMetrics'):
+        super().__init__(logging.INFO)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord):
+        if _current_metrics.get() not in (None, self.metrics):
+            return
+        if str(record.msg).startswith('Sleeping') and isinstance(record.args, tuple) and len(record.args) > 1:
+            self.metrics.record_flood_wait(record.args[1])
+
+
+def get_peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', None) or memory.rss
+    except ImportError:
+        return None
+
+
+class ExportMetrics:
+    def __init__(self, chat_name: str = ''):
+        self.chat_name = chat_name
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.status = 'running'
+        self.messages = 0
+        self.phases = {}
+        self.rpc_counts = Counter()
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+        self.media_files = 0
+        self.media_bytes = 0
+        self.media_retries = 0
+        self.media_failures = 0
+        self.media_skipped = 0
+        # Files taken from an earlier export, or from earlier in this one, instead of being downloaded.
+        self.media_reused = 0
+        self.db_flush_latencies = []
+        self._clients = []
+        self._log_handler = None
+        self._context_token = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def record_flood_wait(self, seconds: float):
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+
+    def record_download(self, size: int):
+        self.media_files += 1
+        self.media_bytes += size
+
+    # May be called for several clients (sessions working on the same export); ``release`` undoes all.
+    def instrument(self, client):
+        global _saved_log_state
+        call = getattr(client, '_call', None)
+        if call is not None:
+            self._clients.append((client, client.__dict__.get('_call')))
+
+            async def counted_call(sender, request, *args, **kwargs):
+                for r in (request if isinstance(request, (list, tuple)) else (request,)):
+                    self.rpc_counts[type(r).__name__] += 1
+                return await call(sender, request, *args, **kwargs)
+
+            client._call = counted_call
+
+        if self._log_handler is None:
+            self._context_token = _current_metrics.set(self)
+            logger = logging.getLogger(TELETHON_CALL_LOGGER)
+            if not any(isinstance(handler, _FloodWaitLogHandler) for handler in logger.handlers):
+                _saved_log_state = (logger.level, logger.propagate)
+            self._log_handler = _FloodWaitLogHandler(self)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(self._log_handler)
+
+    def release(self):
+        for client, previous_call in reversed(self._clients):
+            if previous_call is None:
+                del client._call
+            else:
+                client._call = previous_call
+        self._clients.clear()
+        if self._log_handler is not None:
+            logger = logging.getLogger(TELETHON_CALL_LOGGER)
+            logger.removeHandler(self._log_handler)
+            # The logger is put back once the last export using it is done.
+            if not any(isinstance(handler, _FloodWaitLogHandler) for handler in logger.handlers):
+                logger.setLevel(_saved_log_state[0])
+                logger.propagate = _saved_log_state[1]
+            self._log_handler = None
+            try:
+                _current_metrics.reset(self._context_token)
+            except ValueError:
+                _current_metrics.set(None)
+
+    def to_dict(self) -> dict:
+        flushes = self.db_flush_latencies
+        return {
+            'chat': self.chat_name,
+            'status': self.status,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'duration_seconds': round(time.perf_counter() - self._started, 3),
+            'messages': self.messages,
+            'phases_seconds': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'rpc_requests': dict(self.rpc_counts.most_common()),
+            'rpc_requests_total': sum(self.rpc_counts.values()),
+            'flood_waits': self.flood_waits,
+            'flood_wait_seconds': round(self.flood_wait_seconds, 3),
+            'media': {
+                'files': self.media_files,
+                'bytes': self.media_bytes,
+                'retries': self.media_retries,
+                'failures': self.media_failures,
+                'skipped': self.media_skipped,
+                'reused': self.media_reused,
+            },
+            'db_flushes': {
+                'count': len(flushes),
+                'total_seconds': round(sum(flushes), 4),
+                'max_seconds': round(max(flushes), 4) if flushes else 0.0,
+                'mean_seconds': round(sum(flushes) / len(flushes), 4) if flushes else 0.0,
+            },
+            'peak_rss_bytes': get_peak_rss_bytes(),
+        }
+
+    def to_prometheus(self) -> str:
+        data = self.to_dict()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP telegram_export_{name} {help_text}")
+            lines.append(f"# TYPE telegram_export_{name} {kind}")
+            for labels, value in samples:
+                label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"telegram_export_{name}{{{label_str}}} {value}" if label_str
+                             else f"telegram_export_{name} {value}")
+
+        metric('messages', 'gauge', "Messages exported by the last run.", [({}, data['messages'])])
+        metric('duration_seconds', 'gauge', "Wall time of the whole run.", [({}, data['duration_seconds'])])
+        metric('phase_seconds', 'gauge', "Wall time of each export phase.",
+               [({'phase': name}, seconds) for name, seconds in data['phases_seconds'].items()])
+        metric('rpc_requests', 'gauge', "Telegram API requests sent, by request type.",
+               [({'method': name}, count) for name, count in data['rpc_requests'].items()])
+        metric('flood_waits', 'gauge', "FloodWait errors encountered.", [({}, data['flood_waits'])])
+        metric('flood_wait_seconds', 'gauge', "Seconds slept because of FloodWait errors.",
+               [({}, data['flood_wait_seconds'])])
+        metric('media_files', 'gauge', "Media files downloaded.", [({}, data['media']['files'])])
+        metric('media_bytes', 'gauge', "Media bytes downloaded.", [({}, data['media']['bytes'])])
+        metric('media_retries', 'gauge', "Media download retries.", [({}, data['media']['retries'])])
+        metric('media_reused', 'gauge', "Media files reused instead of downloaded.", [({}, data['media']['reused'])])
+        metric('db_flush_seconds', 'gauge', "Total time spent writing batches to the export database.",
+               [({}, data['db_flushes']['total_seconds'])])
+        metric('db_flush_max_seconds', 'gauge', "Slowest single database batch write.",
+               [({}, data['db_flushes']['max_seconds'])])
+        if data['peak_rss_bytes'] is not None:
+            metric('peak_rss_bytes', 'gauge', "Peak resident set size of the process.", [({}, data['peak_rss_bytes'])])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output: ExportOutput, prometheus: bool = False):
+        with output.open_text("metrics.json") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        if prometheus:
+            with output.open_text("metrics.prom") as f:
+                f.write(self.to_prometheus())
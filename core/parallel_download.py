@@ -0,0 +1,166 @@
+import asyncio
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest
+from telethon.tl.types import Document
+from telethon.tl.types.upload import File as UploadedFile
+from telethon.utils import get_input_location
+
+from .metrics import ExportMetrics
+
+# Files below this size finish quickly over the client's own connection; opening extra ones would only add latency.
+PARALLEL_MIN_SIZE = 10 * 1024 * 1024
+
+# upload.getFile accepts 4 KB .. 1 MB parts whose size divides 1 MB, so only powers of two are valid.
+PART_SIZES_KB = (64, 128, 256, 512, 1024)
+
+
+class ParallelDownloadError(Exception):
+    pass
+
+
+def valid_part_size_kb(part_size_kb: int) -> int:
+    return max((size for size in PART_SIZES_KB if size <= part_size_kb), default=PART_SIZES_KB[0])
+
+
+# Fetches the parts of one large document concurrently, each worker over its own connection to the DC
+# that stores the file. Connections are opened on first use for a DC and kept until ``close``. Seekable
+# streams are preallocated and every part is written at its offset as soon as it arrives; streams that
+# can only be appended to (archive members) get the parts in order, with at most one part per
+# connection waiting in memory.
+class ParallelDownloader:
+    def __init__(self, client, connections: int = 4, part_size_kb: int = 512,
+                 metrics: Optional[ExportMetrics] = None):
+        self.client = client
+        self.connections = max(1, connections)
+        self.part_size = valid_part_size_kb(part_size_kb) * 1024
+        self.metrics = metrics or ExportMetrics()
+        self._senders: Dict[int, List[MTProtoSender]] = {}
+        self._failed_dcs = set()
+        self._lock = asyncio.Lock()
+
+    def should_use(self, msg) -> bool:
+        document = getattr(msg, 'document', None)
+        return (self.connections > 1 and isinstance(document, Document)
+                and (document.size or 0) >= PARALLEL_MIN_SIZE)
+
+    # ``offset`` resumes a download whose first bytes are already in the stream, which is positioned
+    # right after them; it must be a multiple of the part size. ``committed_callback`` receives the
+    # length of the prefix that is completely written, which is what a resumable download can record.
+    async def download(self, document: Document, stream: BinaryIO,
+                       progress_callback: Optional[Callable[[int, int], None]] = None, offset: int = 0,
+                       committed_callback: Optional[Callable[[int], None]] = None) -> int:
+        dc_id, location = get_input_location(document)
+        size = document.size
+        senders = await self._get_senders(dc_id)
+        part_count = -(-size // self.part_size)
+        first_part = offset // self.part_size
+        parts = iter(range(first_part, part_count))
+        seekable = stream.seekable()
+        start = stream.tell() - offset if seekable else 0
+        pending: Dict[int, bytes] = {}
+        completed = set()
+        next_part = first_part
+        downloaded = offset
+        in_order = asyncio.Condition()
+
+        if seekable:
+            stream.truncate(start + size)
+
+        async def fetch(sender: MTProtoSender, index: int) -> bytes:
+            request = GetFileRequest(location, offset=index * self.part_size, limit=self.part_size)
+            while True:
+                self.metrics.rpc_counts['GetFileRequest'] += 1
+                try:
+                    result = await sender.send(request)
+                except FloodWaitError as e:
+                    self.metrics.record_flood_wait(e.seconds)
+                    await asyncio.sleep(e.seconds)
+                    continue
+                if not isinstance(result, UploadedFile):
+                    raise ParallelDownloadError(f"unsupported response {type(result).__name__} (CDN file?)")
+                return result.bytes
+
+        async def worker(sender: MTProtoSender):
+            nonlocal next_part, downloaded
+            for index in parts:
+                data = await fetch(sender, index)
+                if seekable:
+                    stream.seek(start + index * self.part_size)
+                    stream.write(data)
+                    completed.add(index)
+                    while next_part in completed:
+                        completed.discard(next_part)
+                        next_part += 1
+                else:
+                    async with in_order:
+                        # Never run further ahead of the writer than one part per connection.
+                        await in_order.wait_for(lambda: index - next_part < len(senders))
+                        pending[index] = data
+                        while next_part in pending:
+                            stream.write(pending.pop(next_part))
+                            next_part += 1
+                        in_order.notify_all()
+                downloaded += len(data)
+                if progress_callback:
+                    progress_callback(min(downloaded, size), size)
+                if committed_callback:
+                    committed_callback(min(next_part * self.part_size, size))
+
+        tasks = [asyncio.create_task(worker(sender)) for sender in senders]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        if downloaded != size:
+            raise ParallelDownloadError(f"expected {size} bytes, received {downloaded}")
+        if seekable:
+            stream.seek(start + size)
+        return size
+
+    async def close(self):
+        senders = [sender for dc_senders in self._senders.values() for sender in dc_senders]
+        self._senders.clear()
+        await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+
+    async def _get_senders(self, dc_id: int) -> List[MTProtoSender]:
+        async with self._lock:
+            if dc_id in self._failed_dcs:
+                raise ParallelDownloadError(f"no extra connections available to DC {dc_id}")
+            if dc_id not in self._senders:
+                senders = []
+                try:
+                    auth_key = self.client.session.auth_key if dc_id == self.client.session.dc_id else None
+                    for _ in range(self.connections):
+                        sender = await self._create_sender(dc_id, auth_key)
+                        auth_key = sender.auth_key
+                        senders.append(sender)
+                except Exception as e:
+                    await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+                    self._failed_dcs.add(dc_id)
+                    raise ParallelDownloadError(f"could not connect to DC {dc_id}: {e}") from e
+                self._senders[dc_id] = senders
+            return self._senders[dc_id]
+
+    # Same handshake Telethon uses for its borrowed senders, except that every connection here is a
+    # separate one; the authorization is exported once per DC and its key shared by all of them.
+    async def _create_sender(self, dc_id: int, auth_key) -> MTProtoSender:
+        client = self.client
+        dc = await client._get_dc(dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(dc.ip_address, dc.port, dc.id, loggers=client._log,
+                                                proxy=client._proxy, local_addr=client._local_addr))
+        if not auth_key:
+            auth = await client(ExportAuthorizationRequest(dc_id))
+            client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+        return sender
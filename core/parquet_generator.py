@@ -0,0 +1,99 @@
+import json
+from typing import Iterable
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .export_output import ExportOutput
+
+SCHEMA = pa.schema([
+    ('message_id', pa.int64()),
+    ('grouped_id', pa.int64()),
+    ('date', pa.timestamp('us', tz='UTC')),
+    ('sender_id', pa.int64()),
+    ('sender_name', pa.string()),
+    # Plain text, so lengths and searches count what was written. Its formatting is in text_entities: the
+    # message entities as JSON, with offsets in UTF-16 code units as Telegram counts them.
+    ('text', pa.string()),
+    ('text_entities', pa.string()),
+    ('reply_to_msg_id', pa.int64()),
+    ('forward_from_id', pa.int64()),
+    ('forward_from_name', pa.string()),
+    ('media_type', pa.string()),
+    ('media_path', pa.string()),
+    ('media_size', pa.int64()),
+    ('media_mime', pa.string()),
+    ('media_file_name', pa.string()),
+    ('media_placeholder', pa.string()),
+    ('media_preview', pa.bool_()),
+    ('action_type', pa.string()),
+    ('action_text', pa.string()),
+    ('edit_date', pa.timestamp('us', tz='UTC')),
+])
+
+
+class ParquetGenerator:
+    def __init__(self, output: ExportOutput, rows: Iterable[dict], row_group_size: int = 50_000):
+        self.output = output
+        self.rows = rows
+        self.row_group_size = row_group_size
+        self.files_written = 0
+        self.rows_written = 0
+
+    # Rows arrive in date order, so the hive-style year=/month= partitions are filled one after
+    # another: only one ParquetWriter is open and only one row group is buffered at any time.
+    def write(self):
+        writer, stream, partition = None, None, None
+        columns = {name: [] for name in SCHEMA.names}
+        try:
+            for row in self.rows:
+                row_partition = (row['date'].year, row['date'].month)
+                if row_partition != partition:
+                    if writer:
+                        self._flush(writer, columns)
+                        writer.close()
+                        stream.close()
+                    partition = row_partition
+                    name = f"parquet/year={partition[0]}/month={partition[1]:02d}/part-00000.parquet"
+                    stream = self.output.open(name, compress=False)
+                    writer = pq.ParquetWriter(stream, SCHEMA, compression='zstd')
+                    self.files_written += 1
+
+                columns['message_id'].append(row['telegram_message_id'])
+                columns['grouped_id'].append(row['grouped_id'])
+                columns['date'].append(row['date'])
+                columns['sender_id'].append(row['sender_id'])
+                columns['sender_name'].append(row['sender'])
+                columns['text'].append(row['text'])
+                columns['text_entities'].append(row.get('text_entities'))
+                columns['reply_to_msg_id'].append(row['reply_to_msg_id'])
+                columns['forward_from_id'].append(row['forward_from_id'])
+                columns['forward_from_name'].append(
+                    json.loads(row['forwarded_from'])['from'] if row['forwarded_from'] else None)
+                columns['media_type'].append(row['media_type'])
+                columns['media_path'].append(row['media_path'])
+                columns['media_size'].append(row['media_size'])
+                columns['media_mime'].append(row['media_mime'])
+                columns['media_file_name'].append(row['media_file_name'])
+                columns['media_placeholder'].append(row['media_placeholder'])
+                columns['media_preview'].append(bool(row.get('media_preview')))
+                columns['action_type'].append(row['action_type'])
+                columns['action_text'].append(row['action_text'])
+                columns['edit_date'].append(row.get('edit_date'))
+
+                if len(columns['message_id']) >= self.row_group_size:
+                    self._flush(writer, columns)
+            if writer:
+                self._flush(writer, columns)
+        finally:
+            if writer:
+                writer.close()
+                stream.close()
+
+    def _flush(self, writer: pq.ParquetWriter, columns: dict):
+        if not columns['message_id']:
+            return
+        writer.write_table(pa.Table.from_pydict(columns, schema=SCHEMA))
+        self.rows_written += len(columns['message_id'])
+        for values in columns.values():
+            values.clear()
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+# Kept next to the exports and shared by all of them, so a download interrupted in one run is
+# continued by the next one.
+PARTIAL_FOLDER_NAME = ".partial"
+
+# Smaller files are cheaper to download again than to keep track of.
+RESUMABLE_MIN_SIZE = 1024 * 1024
+
+# Resume offsets are rounded down to this, which is a multiple of every valid upload.getFile part size.
+RESUME_ALIGNMENT = 1024 * 1024
+
+# How much newly written data is allowed to go unrecorded; written bytes beyond the record are refetched.
+SAVE_EVERY = 4 * 1024 * 1024
+
+
+# A download staged in ``<key>.part`` next to a ``<key>.json`` record of the bytes known to be on disk.
+# Only what has been flushed is ever recorded, so a crash can lose progress but never claims data the
+# file does not hold. Downloads without a key (or too small to bother) are staged in a throwaway file.
+class PartialDownload:
+    def __init__(self, folder: Path, key: Optional[str], size: Optional[int]):
+        folder.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self.offset = 0
+        self.resumable = bool(key and size and size >= RESUMABLE_MIN_SIZE)
+        self._file: Optional[BinaryIO] = None
+        self._saved = 0
+        if self.resumable:
+            self.path = folder / f"{key}.part"
+            self.record_path = folder / f"{key}.json"
+            self._load()
+        else:
+            fd, name = tempfile.mkstemp(suffix='.part', dir=folder)
+            os.close(fd)
+            self.path = Path(name)
+            self.record_path = None
+
+    def _load(self):
+        try:
+            record = json.loads(self.record_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return
+        if record.get('size') == self.size and self.path.is_file():
+            offset = min(record.get('offset', 0), self.path.stat().st_size)
+            self.offset = offset - offset % RESUME_ALIGNMENT
+
+    def open(self) -> BinaryIO:
+        self._file = open(self.path, 'r+b' if self.offset else 'wb')
+        self._file.truncate(self.offset)
+        self._file.seek(self.offset)
+        self._saved = self.offset
+        return self._file
+
+    def save(self, offset: int, force: bool = False):
+        if not self.resumable or self._file is None or (not force and offset - self._saved < SAVE_EVERY):
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        tmp_path = self.record_path.with_suffix('.json.tmp')
+        tmp_path.write_text(json.dumps({'size': self.size, 'offset': offset}), encoding='utf-8')
+        os.replace(tmp_path, self.record_path)
+        self._saved = offset
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def interrupt(self, offset: Optional[int] = None):
+        if self.resumable and self._file is not None and offset:
+            self.save(offset, force=True)
+        self.close()
+        if not self.resumable:
+            self.discard()
+
+    def discard(self):
+        self.close()
+        for path in (self.path, self.record_path):
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def finish(self) -> Path:
+        self.close()
+        if self.record_path is not None:
+            try:
+                os.remove(self.record_path)
+            except OSError:
+                pass
+        return self.path
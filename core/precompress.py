@@ -0,0 +1,123 @@
+import gzip
+import importlib.util
+import io
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, TextIO
+
+from .export_output import ExportOutput
+
+# Pre-compressed copies messages.html can get, by suffix. A web server sends them as they are for
+# Accept-Encoding gzip or br (nginx gzip_static / brotli_static) instead of compressing the page on every
+# request.
+PRECOMPRESS_FORMATS = ('gz', 'br')
+
+GZIP_LEVEL = 9
+# Quality 11 is several times slower for a few percent less; 9 keeps up with the rendering.
+BROTLI_QUALITY = 9
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def precompress_available(fmt: str) -> bool:
+    return fmt != 'br' or importlib.util.find_spec('brotli') is not None
+
+
+class _GzipSibling:
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        # No timestamp, so the same page always compresses to the same bytes.
+        self.compressor = gzip.GzipFile(fileobj=stream, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+
+    def write(self, data):
+        self.compressor.write(data)
+
+    def close(self):
+        self.compressor.close()
+        self.stream.close()
+
+
+class _BrotliSibling:
+    def __init__(self, stream: BinaryIO):
+        import brotli
+        self.stream = stream
+        self.compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+
+    def write(self, data):
+        compressed = self.compressor.process(bytes(data))
+        if compressed:
+            self.stream.write(compressed)
+
+    def close(self):
+        self.stream.write(self.compressor.finish())
+        self.stream.close()
+
+
+SIBLINGS = {'gz': _GzipSibling, 'br': _BrotliSibling}
+
+
+# Writes a page and its pre-compressed copies from the same writes: every block goes through the
+# compressors as it is rendered, so the page is never read back once written.
+class PrecompressingWriter(io.BufferedIOBase):
+    def __init__(self, stream: BinaryIO, siblings: Dict[str, BinaryIO]):
+        super().__init__()
+        self.stream = stream
+        self.siblings = [SIBLINGS[fmt](sibling) for fmt, sibling in siblings.items()]
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        for sibling in self.siblings:
+            sibling.write(data)
+        return self.stream.write(data)
+
+    def close(self):
+        if not self.closed:
+            for sibling in self.siblings:
+                sibling.close()
+            self.stream.close()
+        super().close()
+
+
+def open_page(output: ExportOutput, name: str, formats: Iterable[str]) -> TextIO:
+    siblings = {fmt: output.open(f"{name}.{fmt}", compress=False) for fmt in formats}
+    return io.TextIOWrapper(PrecompressingWriter(output.open(name), siblings), encoding='utf-8')
+
+
+# Same for a page written straight into a folder; the copies are named after the file written.
+def open_page_file(path: Path, formats: Iterable[str]) -> PrecompressingWriter:
+    return PrecompressingWriter(open(path, 'wb'), {fmt: open(f"{path}.{fmt}", 'wb') for fmt in formats})
+
+
+def replace_page_file(tmp_path: Path, path: Path, formats: Iterable[str]):
+    for fmt in formats:
+        Path(f"{tmp_path}.{fmt}").replace(f"{path}.{fmt}")
+    tmp_path.replace(path)
+
+
+def page_formats(path: Path) -> List[str]:
+    return [fmt for fmt in PRECOMPRESS_FORMATS if Path(f"{path}.{fmt}").is_file()]
+
+
+class _NullStream:
+    def write(self, data) -> int:
+        return len(data)
+
+    def close(self):
+        pass
+
+
+# For a page changed in place, which has to be read back to compress it again.
+def recompress_page(path: Path, formats: Iterable[str]):
+    formats = list(formats)
+    if not formats:
+        return
+    tmp_path = path.with_name(path.name + '.tmp')
+    siblings = {fmt: open(f"{tmp_path}.{fmt}", 'wb') for fmt in formats}
+    # Only the copies are written; the page itself is already in place.
+    with open(path, 'rb') as src, PrecompressingWriter(_NullStream(), siblings) as dst:
+        shutil.copyfileobj(src, dst, READ_CHUNK_SIZE)
+    for fmt in formats:
+        Path(f"{tmp_path}.{fmt}").replace(f"{path}.{fmt}")
+
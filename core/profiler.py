@@ -0,0 +1,243 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .export_output import ExportOutput
+
+# Folded stacks, one "frame;frame;frame weight" line each, weights in microseconds of wall time. Ready for
+# flamegraph.pl, speedscope or inferno.
+PROFILE_STACKS_NAME = 'profile.collapsed'
+PROFILE_SUMMARY_NAME = 'profile_top.txt'
+
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 30
+
+# Where a thread sits while it has nothing to do: the event loop polling for I/O, pool workers and other
+# threads waiting for work. (file name, function)
+IDLE_FRAMES = {('selectors.py', 'select'), ('windows_events.py', '_poll'), ('threading.py', 'wait'),
+               ('thread.py', '_worker'), ('queue.py', 'get')}
+
+PROJECT_ROOT = str(Path(__file__).resolve().parents[1]) + os.sep
+
+# Profilers running on the event loop. Several exports can share one loop (see SessionPool), so each
+# profiler only samples the task it was started in and the tasks created from those, which the task
+# factory below hands to it as they are created.
+_running = []
+
+
+def _task_factory(loop, coro, **kwargs):
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    parent = asyncio.current_task(loop)
+    for profiler in _running:
+        if parent in profiler._tasks:
+            profiler._tasks.add(task)
+    return task
+
+
+# Wall-time sampling profiler that sees through asyncio. A thread takes the stack of every thread a few
+# hundred times a second. Only the profiled work's own tasks are sampled. While the event loop runs code,
+# the sample goes to the running task with the stack it runs; while the loop waits for I/O, the sample is
+# shared between the tasks that wait, each with the chain of coroutines it is suspended in, down to what it
+# awaits. Time spent waiting on Telegram thus shows under the call that waits for it, not as one anonymous
+# select(). Other threads (the database writer, download pools) are sampled whenever they are not idle.
+class SamplingProfiler:
+    def __init__(self, title: str, root=None, interval: float = SAMPLE_INTERVAL):
+        self.title = title
+        # Stacks are cut above the profiled call, so the flame graph starts at it.
+        self.root_code = getattr(root, '__code__', None)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.components: Dict[str, str] = {}
+        self._labels: Dict[object, str] = {}
+        self._prefixes = sorted({os.path.abspath(p) + os.sep for p in sys.path if p}, key=len, reverse=True)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = threading.get_ident()
+        self._tasks = weakref.WeakSet()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._started = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        if self._loop is not None:
+            self._tasks.add(asyncio.current_task(self._loop))
+            if self._loop.get_task_factory() in (None, _task_factory):
+                self._loop.set_task_factory(_task_factory)
+                _running.append(self)
+        self._loop_thread = threading.get_ident()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self in _running:
+            _running.remove(self)
+            if not _running:
+                self._loop.set_task_factory(None)
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = int((now - last) * 1_000_000), now
+            try:
+                self._sample(weight)
+            except (RuntimeError, ValueError, AttributeError):
+                # A task or thread that went away while it was looked at; the next sample catches up.
+                pass
+
+    def _sample(self, weight: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == threading.get_ident():
+                continue
+            if ident == self._loop_thread:
+                self._sample_loop(frame, weight)
+            elif not self._is_idle(frame):
+                self.stacks[(f"thread: {names.get(ident, ident)}",) + self._stack(frame)] += weight
+
+    def _sample_loop(self, frame, weight: int):
+        if self._loop is None:
+            self.stacks[("main",) + self._stack(frame)] += weight
+            return
+        if not self._is_idle(frame):
+            task = asyncio.current_task(self._loop)
+            if task is not None and task not in self._tasks:
+                # Another export's task.
+                return
+            root = f"task: {task.get_name()}" if task else "loop callbacks"
+            self.stacks[(root,) + self._stack(frame)] += weight
+            return
+        waiting = [task for task in asyncio.all_tasks(self._loop) if task in self._tasks]
+        if not waiting:
+            self.stacks[("[idle]",)] += weight
+            return
+        share = max(1, weight // len(waiting))
+        for task in waiting:
+            self.stacks[(f"task: {task.get_name()}",) + self._await_stack(task)] += share
+
+    @staticmethod
+    def _is_idle(frame) -> bool:
+        return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        start = 0
+        for i, f in enumerate(frames):
+            code = f.f_code
+            if code is self.root_code:
+                start = i
+                break
+            # Everything above the callback the event loop runs is the loop itself.
+            if code.co_name == '_run' and code.co_filename.endswith(f"asyncio{os.sep}events.py"):
+                start = i + 1
+        return tuple(self._label(f.f_code) for f in frames[start:])
+
+    def _await_stack(self, task: asyncio.Task) -> Tuple[str, ...]:
+        labels = []
+        awaitable = task.get_coro()
+        while awaitable is not None:
+            frame = (getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+                     or getattr(awaitable, 'ag_frame', None))
+            if frame is None:
+                break
+            if frame.f_code is self.root_code:
+                labels.clear()
+            labels.append(self._label(frame.f_code))
+            awaitable = (getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+                         or getattr(awaitable, 'ag_await', None))
+        if awaitable is None:
+            labels.append("[await]")
+        else:
+            # `await future` leaves the C future's iterator behind, not the future.
+            name = type(awaitable).__name__
+            labels.append(f"[await {'Future' if name == 'FutureIter' else name}]")
+        return tuple(labels)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            path = self._short_path(code.co_filename)
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = f"{name} ({path}:{code.co_firstlineno})".replace(';', ':')
+            self._labels[code] = label
+            self.components[label] = self._component(code.co_filename, path)
+        return label
+
+    def _short_path(self, filename: str) -> str:
+        if filename.startswith(PROJECT_ROOT):
+            return filename[len(PROJECT_ROOT):].replace(os.sep, '/')
+        for prefix in self._prefixes:
+            if filename.startswith(prefix):
+                return filename[len(prefix):].replace(os.sep, '/')
+        return filename
+
+    @staticmethod
+    def _component(filename: str, path: str) -> str:
+        if filename.startswith(PROJECT_ROOT):
+            return path[:-3].replace('/', '.') if path.endswith('.py') else path
+        top = path.split('/', 1)[0]
+        return top[:-3] if top.endswith('.py') else top
+
+    # Self time per component (the module of the innermost frame, split into running and awaiting) and the
+    # hottest functions, by self and by total time.
+    def summary(self, top: int = TOP_FUNCTIONS) -> str:
+        wall = self.duration or time.perf_counter() - self._started
+        sampled = sum(self.stacks.values())
+        self_time, total_time = Counter(), Counter()
+        components: Dict[str, list] = {}
+        for stack, weight in self.stacks.items():
+            self_time[stack[-1]] += weight
+            for label in set(stack[1:]):
+                total_time[label] += weight
+            frames = [label for label in stack if label in self.components]
+            component = self.components[frames[-1]] if frames else stack[0]
+            components.setdefault(component, [0, 0])[stack[-1].startswith('[await')] += weight
+
+        def seconds(us: int) -> str:
+            return f"{us / 1_000_000:9.3f}"
+
+        def share(us: int) -> str:
+            return f"{us / 10_000 / wall:6.1f}%" if wall else "     -"
+
+        lines = [f"Wall-time profile: {self.title}",
+                 f"{wall:.3f} s wall time, {sampled / 1_000_000:.3f} s sampled across tasks and threads, "
+                 f"one sample every {self.interval * 1000:g} ms",
+                 "Time waiting in the event loop is shared between the tasks that wait; other threads add to it.",
+                 "", "By component (innermost frame):",
+                 f"  {'running s':>9} {'':7} {'awaiting s':>10} {'':7}  component"]
+        for component, (running, awaiting) in sorted(components.items(), key=lambda item: -sum(item[1])):
+            lines.append(f"  {seconds(running)} {share(running)} {seconds(awaiting):>10} {share(awaiting)}  "
+                         f"{component}")
+        for title, counter in ((f"Top {top} functions by self time:", self_time),
+                               (f"Top {top} functions by total time:", total_time)):
+            lines += ["", title, f"  {'seconds':>9} {'':7}  function"]
+            lines += [f"  {seconds(us)} {share(us)}  {label}" for label, us in counter.most_common(top)]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output: ExportOutput):
+        with output.open_text(PROFILE_STACKS_NAME) as f:
+            for stack, weight in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {weight}\n")
+        with output.open_text(PROFILE_SUMMARY_NAME) as f:
+            f.write(self.summary())
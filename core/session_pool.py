@@ -0,0 +1,109 @@
+import asyncio
+from typing import Dict, List
+
+from telethon import TelegramClient
+
+from .client_manager import ClientManager
+from .dialog_cache import DialogCache
+from .exporter import ChatExporter
+from .settings import DelaySettings
+
+# Pooled clients sleep through a FloodWait of any length instead of failing the export: the wait only
+# parks the session that hit it, while the other sessions keep exporting.
+POOL_FLOOD_SLEEP_THRESHOLD = 24 * 3600
+
+
+class PooledSession:
+    def __init__(self, name: str, client: TelegramClient, dialogs: DialogCache):
+        self.name = name
+        self.client = client
+        self.dialogs = dialogs
+
+    # The same chat has a different access hash in every account, so each session resolves it on its own.
+    async def resolve(self, ref: str):
+        await self.dialogs.ensure_loaded()
+        if ref.lstrip('-').isdigit():
+            peer = int(ref)
+            dialog = self.dialogs.get(peer)
+        else:
+            peer = ref
+            dialog = self.dialogs.get_by_username(ref)
+        if dialog:
+            return dialog.entity
+        try:
+            return await self.client.get_entity(peer)
+        except Exception:
+            return None
+
+
+# Exports several chats at once with several accounts. Every session exports one chat at a time, taking
+# the next pending chat it is a member of, so the exports are spread over the request limits of all the
+# accounts. A single large channel can instead be split across the sessions (see ChatExporter.helpers).
+class SessionPool:
+    def __init__(self, client_manager: ClientManager, delay_settings: DelaySettings):
+        self.client_manager = client_manager
+        self.delay_settings = delay_settings
+        self.sessions: List[PooledSession] = []
+
+    async def connect(self, names: List[str]) -> List[PooledSession]:
+        for name in names:
+            print(f"\n🔐 Session: {name}")
+            client = await self.client_manager.get_client(name)
+            if not client:
+                continue
+            client.flood_sleep_threshold = POOL_FLOOD_SLEEP_THRESHOLD
+            dialogs = DialogCache(client, self.client_manager.sessions_folder / f"{name}.dialogs.json.gz")
+            self.sessions.append(PooledSession(name, client, dialogs))
+        return self.sessions
+
+    async def disconnect(self):
+        for session in self.sessions:
+            await session.client.disconnect()
+        self.sessions = []
+
+    async def _resolve_all(self, refs: List[str]) -> Dict[str, Dict[PooledSession, object]]:
+        async def resolve(session: PooledSession) -> list:
+            return [await session.resolve(ref) for ref in refs]
+
+        results = await asyncio.gather(*(resolve(session) for session in self.sessions))
+        access = {ref: {} for ref in refs}
+        for session, entities in zip(self.sessions, results):
+            for ref, entity in zip(refs, entities):
+                if entity is not None:
+                    access[ref][session] = entity
+        return access
+
+    async def export_chats(self, refs: List[str], options: dict, shard: bool = False) -> List[str]:
+        print(f"\n⏳ Looking up {len(refs)} chat(s) in {len(self.sessions)} session(s)...")
+        access = await self._resolve_all(refs)
+        unreachable = [ref for ref in refs if not access[ref]]
+        pending = [ref for ref in refs if access[ref]]
+        exported: List[str] = []
+
+        if shard and len(pending) == 1:
+            sessions = list(access[pending[0]].items())
+            (main, entity), helpers = sessions[0], sessions[1:]
+            print(f"🧵 Splitting the export across: {', '.join(session.name for session, _ in sessions)}")
+            exporter = ChatExporter(main.client, self.delay_settings,
+                                    helpers=[(session.client, chat) for session, chat in helpers])
+            await exporter.export_chat(entity, **options)
+            exported.append(pending[0])
+        else:
+            async def work(session: PooledSession):
+                while True:
+                    ref = next((ref for ref in pending if session in access[ref]), None)
+                    if ref is None:
+                        return
+                    pending.remove(ref)
+                    print(f"\n▶️ [{session.name}] {ref}")
+                    await ChatExporter(session.client, self.delay_settings).export_chat(access[ref][session],
+                                                                                       **options)
+                    exported.append(ref)
+
+            await asyncio.gather(*(work(session) for session in self.sessions))
+
+        print(f"\n{'=' * 60}\n🧵 POOL EXPORT FINISHED: {len(exported)} of {len(refs)} chat(s)")
+        if unreachable:
+            print(f"❌ Not accessible from any session: {', '.join(unreachable)}")
+        print("=" * 60)
+        return unreachable
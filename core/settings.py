@@ -8,6 +8,13 @@ class DelaySettings:
         self.delay_between_media = 1.5
         self.max_retries = 5
         self.retry_delay = 3
+        self.prometheus_metrics = False
+        self.record_cassette = False
+        self.parallel_connections = 4
+        self.download_part_size_kb = 512
+        self.keep_message_store = True
+        # Set for the session by `python main.py --profile`; not saved.
+        self.profile = False
         self.settings_file = Path("settings.json")
         self.load_settings()
 
@@ -20,6 +27,11 @@ class DelaySettings:
                     self.delay_between_media = data.get('delay_between_media', 1.5)
                     self.max_retries = data.get('max_retries', 5)
                     self.retry_delay = data.get('retry_delay', 3)
+                    self.prometheus_metrics = data.get('prometheus_metrics', False)
+                    self.record_cassette = data.get('record_cassette', False)
+                    self.parallel_connections = data.get('parallel_connections', 4)
+                    self.download_part_size_kb = data.get('download_part_size_kb', 512)
+                    self.keep_message_store = data.get('keep_message_store', True)
             except:
                 pass
 
@@ -28,7 +40,12 @@ class DelaySettings:
             'delay_between_messages': self.delay_between_messages,
             'delay_between_media': self.delay_between_media,
             'max_retries': self.max_retries,
-            'retry_delay': self.retry_delay
+            'retry_delay': self.retry_delay,
+            'prometheus_metrics': self.prometheus_metrics,
+            'record_cassette': self.record_cassette,
+            'parallel_connections': self.parallel_connections,
+            'download_part_size_kb': self.download_part_size_kb,
+            'keep_message_store': self.keep_message_store
         }
         with open(self.settings_file, 'w') as f:
             json.dump(data, f, indent=2)
@@ -41,6 +58,10 @@ class DelaySettings:
         print(f"  2. Delay between media downloads: {self.delay_between_media}s")
         print(f"  3. Max retries on error: {self.max_retries}")
         print(f"  4. Retry delay: {self.retry_delay}s")
+        print(f"  5. Large media downloads: {self.parallel_connections} connection(s), {self.download_part_size_kb} KB parts")
+        print(f"  6. Prometheus metrics file: {'On' if self.prometheus_metrics else 'Off'}")
+        print(f"  7. Record API cassette: {'On' if self.record_cassette else 'Off'}")
+        print(f"  8. Keep message store for syncing: {'On' if self.keep_message_store else 'Off'}")
         print("\n💡 Recommendations:")
         print("  - For safe export: 0.5s+ message delay, 2s+ media delay")
         print("  - For fast export: 0.2s message delay, 1s media delay (risky)")
@@ -50,9 +71,12 @@ class DelaySettings:
         print("  [2] Balanced (recommended): 0.3s / 1.5s")
         print("  [3] Fast (risky): 0.1s / 1s")
         print("  [4] Custom")
+        print("  [5] Toggle Prometheus metrics file (metrics.prom)")
+        print("  [6] Toggle recording of API traffic into a replayable cassette")
+        print("  [7] Toggle keeping messages.db in folder exports (needed to sync edits and deletions)")
         print("  [b] Back")
 
-        choice = input("\nChoose preset (1-5): ").strip()
+        choice = input("\nChoose preset (1-7): ").strip()
 
         if choice == '1':
             self.delay_between_messages = 0.5
@@ -88,10 +112,29 @@ class DelaySettings:
                 retry_delay = input(f"Retry delay (current: {self.retry_delay}s): ").strip().replace(',', '.')
                 if retry_delay: self.retry_delay = float(retry_delay)
 
+                connections = input(
+                    f"Parallel connections for large media, 1 = off (current: {self.parallel_connections}): ").strip()
+                if connections: self.parallel_connections = max(1, int(connections))
+
+                part_size = input(
+                    f"Download part size in KB, 64-1024 (current: {self.download_part_size_kb}): ").strip()
+                if part_size:
+                    from .parallel_download import valid_part_size_kb
+                    self.download_part_size_kb = valid_part_size_kb(int(part_size))
+
                 print("✅ Custom settings applied!")
             except ValueError:
                 print("❌ Invalid input! Settings not changed.")
                 return
+        elif choice == '5':
+            self.prometheus_metrics = not self.prometheus_metrics
+            print(f"✅ Prometheus metrics file {'enabled' if self.prometheus_metrics else 'disabled'}")
+        elif choice == '6':
+            self.record_cassette = not self.record_cassette
+            print(f"✅ API cassette recording {'enabled' if self.record_cassette else 'disabled'}")
+        elif choice == '7':
+            self.keep_message_store = not self.keep_message_store
+            print(f"✅ Message store {'kept' if self.keep_message_store else 'not kept'} in folder exports")
         elif choice == 'b':
             return
         else:
@@ -0,0 +1,167 @@
+import asyncio
+import io
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from telethon import TelegramClient
+from tqdm.asyncio import tqdm as async_tqdm
+
+from . import utils
+from .database import (STORE_NAME, delete_messages, get_export_info, iter_message_groups, iter_message_rows,
+                       iter_message_versions, message_group_stats, open_store, refresh_reply_previews,
+                       update_message_texts)
+from .export_output import FolderOutput
+from .html_generator import (HtmlGenerator, day_key, encode_page_text, load_page_index, parse_index_date,
+                             write_page_index)
+from .json_generator import JsonGenerator
+from .message_record import page_records
+from .precompress import open_page_file, page_formats, replace_page_file
+from .settings import DelaySettings
+
+# Ids per get_messages request, the most a single messages.getMessages call takes.
+SYNC_BATCH_SIZE = 100
+
+
+# Brings a folder export up to date with the edits and deletions made in its chat since. The ids kept in
+# the export's message store are fetched back a hundred at a time, so a sync costs one request per hundred
+# messages instead of a new export with its media, senders and replies. The changes go into the store and
+# only the days of messages.html that contain them are rendered again.
+class ExportSync:
+    def __init__(self, client: TelegramClient, delay_settings: DelaySettings, folder: Path):
+        self.client = client
+        self.delay_settings = delay_settings
+        self.folder = folder
+        self.store_path = folder / STORE_NAME
+        self.db = None
+        self.info = {}
+
+    @property
+    def chat_id(self) -> Optional[int]:
+        return self.info.get('chat_id')
+
+    def open(self) -> bool:
+        if not self.store_path.is_file():
+            print(f"❌ '{self.folder.name}' has no {STORE_NAME}. Only folder exports made while the message store "
+                  f"is kept (see Settings) can be synced.")
+            return False
+        self.db = open_store(self.store_path)
+        self.info = get_export_info(self.db)
+        if not self.chat_id:
+            print(f"❌ The message store of '{self.folder.name}' does not name its chat.")
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        if self.db and not self.db.is_closed():
+            self.db.close()
+
+    async def run(self, entity, remove_deleted: bool = True) -> dict:
+        print(f"\n⏳ Comparing '{self.info.get('chat_name')}' with the chat...")
+        versions = list(iter_message_versions(self.db))
+        edits, deleted = [], []
+        edited_days: Dict[str, date] = {}
+        deleted_days: Dict[str, date] = {}
+        pbar = async_tqdm(total=len(versions), unit=" msg", colour='cyan', desc="Syncing")
+        for start in range(0, len(versions), SYNC_BATCH_SIZE):
+            batch = versions[start:start + SYNC_BATCH_SIZE]
+            messages = await self.client.get_messages(entity, ids=[msg_id for msg_id, _, _ in batch])
+            for (msg_id, msg_date, edit_date), msg in zip(batch, messages):
+                if msg is None:
+                    deleted.append(msg_id)
+                    deleted_days[day_key(msg_date)] = msg_date.date()
+                elif msg.edit_date and msg.edit_date != edit_date:
+                    edits.append((msg_id, msg.message or '', utils.entities_to_json(msg.entities), msg.edit_date))
+                    edited_days[day_key(msg_date)] = msg_date.date()
+            pbar.update(len(batch))
+            await asyncio.sleep(self.delay_settings.delay_between_messages)
+        pbar.close()
+
+        print(f"✏️ Edited: {len(edits)}   🗑️ Deleted: {len(deleted)}{'' if remove_deleted else ' (kept)'}")
+        changed_days = dict(edited_days, **deleted_days) if remove_deleted else edited_days
+        if not changed_days:
+            print("✅ The export is up to date.")
+            return {'edited': 0, 'deleted': len(deleted), 'days': 0}
+
+        update_message_texts(self.db, edits)
+        if remove_deleted:
+            delete_messages(self.db, deleted)
+        # Reply previews keep the formatting written in, as an export stores them.
+        texts = {msg_id: utils.markdown_text(text, entities) for msg_id, text, entities, _ in edits}
+        for reply_date in refresh_reply_previews(self.db, texts, deleted if remove_deleted else []):
+            changed_days[day_key(reply_date)] = reply_date.date()
+        self._render(entity, changed_days)
+        print(f"✅ Synced: {len(changed_days)} day(s) of messages.html rendered again.")
+        return {'edited': len(edits), 'deleted': len(deleted), 'days': len(changed_days)}
+
+    def _render(self, entity, changed_days: Dict[str, date]):
+        total, first_date, last_date = message_group_stats(self.db)
+        index = load_page_index(self.folder)
+        minify = index.get('minified', False) if index else bool(self.info.get('minify_html'))
+        generator = HtmlGenerator(self.info.get('chat_name', ''), [], parse_index_date(self.info.get('start_date')),
+                                  parse_index_date(self.info.get('end_date')), total, first_date, last_date,
+                                  self.info.get('filters'), minify)
+        if index:
+            print("📄 Updating the changed days of messages.html...")
+            self._splice_days(generator, index, changed_days)
+        elif (self.folder / "messages.html").exists():
+            print("📄 Rendering messages.html again (it has no day index)...")
+            generator.messages = page_records(iter_message_groups(self.db))
+            html_path = self.folder / "messages.html"
+            with io.TextIOWrapper(open_page_file(html_path, page_formats(html_path)), encoding='utf-8') as f:
+                generator.write(f)
+            write_page_index(self.folder, generator.index())
+
+        formats = [name for name, file in (('json', 'result.json'), ('jsonl', 'messages.jsonl'))
+                   if (self.folder / file).exists()]
+        output = FolderOutput(self.folder)
+        if formats:
+            print("🧾 Writing JSON again...")
+            json_generator = JsonGenerator(entity, self.info.get('chat_name', ''), iter_message_rows(self.db))
+            json_file = output.open_text("result.json") if 'json' in formats else None
+            jsonl_file = output.open_text("messages.jsonl") if 'jsonl' in formats else None
+            try:
+                json_generator.write(json_file, jsonl_file)
+            finally:
+                if json_file: json_file.close()
+                if jsonl_file: jsonl_file.close()
+        if (self.folder / "parquet").is_dir():
+            print("📊 Writing the Parquet dataset again...")
+            from .parquet_generator import ParquetGenerator
+            ParquetGenerator(output, iter_message_rows(self.db)).write()
+
+    # Days without changes are copied from the page as they are; the changed ones are rendered from the
+    # store, and a day left without messages is dropped along with its separator.
+    def _splice_days(self, generator: HtmlGenerator, index: dict, changed_days: Dict[str, date]):
+        html_path = self.folder / "messages.html"
+        tmp_path = html_path.with_name(html_path.name + '.tmp')
+        # The pre-compressed copies the page has are written along with it.
+        formats = page_formats(html_path)
+        head, tail = (encode_page_text(part) for part in generator.template_parts())
+        bounds = [offset for _, offset in index['days'][1:]] + [index['body_bytes']]
+        days, position = [], 0
+        with open(html_path, 'rb') as src, open_page_file(tmp_path, formats) as dst:
+            dst.write(head)
+            for (key, start), end in zip(index['days'], bounds):
+                if key in changed_days:
+                    chunk = self._render_day(generator, changed_days[key])
+                    if not chunk:
+                        continue
+                else:
+                    src.seek(index['head_bytes'] + start)
+                    chunk = src.read(end - start)
+                days.append((key, position))
+                dst.write(chunk)
+                position += len(chunk)
+            dst.write(tail)
+        replace_page_file(tmp_path, html_path, formats)
+        write_page_index(self.folder, dict(generator.index(), head_bytes=len(head), body_bytes=position,
+                                           tail_bytes=len(tail), days=days))
+
+    def _render_day(self, generator: HtmlGenerator, day: date) -> bytes:
+        since = datetime.combine(day, time(), tzinfo=timezone.utc)
+        generator.messages = page_records(iter_message_groups(self.db, since, since + timedelta(days=1)))
+        buffer = io.StringIO()
+        generator.write_messages(buffer)
+        return encode_page_text(buffer.getvalue())
@@ -1,18 +1,23 @@
+import copy
+import importlib.util
 from typing import List, Optional
-from telethon.tl.types import User, Chat, Channel
 from .client_manager import ClientManager
 from .settings import DelaySettings
-from .exporter import ChatExporter
-from .merger import Merger
-from datetime import datetime
+from .export_output import ARCHIVE_FORMATS
+from .html_generator import load_page_index
+from datetime import datetime, timedelta
 from pathlib import Path
 
+# Telethon, the exporter (tqdm, peewee) and the merger (bs4, lxml) are imported where they are first
+# needed, so the session menu, settings and merging start without loading the rest.
+
 
 class AppUI:
     def __init__(self):
         self.client_manager = ClientManager()
         self.delay_settings = DelaySettings()
         self.client = None
+        self.dialogs = None
 
     def show_banner(self):
         print("\n" + "=" * 60)
@@ -32,10 +37,15 @@ class AppUI:
                 await self.client_manager.create_new_session()
             elif action == 'merge':
                 await self.run_merger()
+            elif action == 'pool':
+                await self.run_pool_export()
             elif action:
                 session_name = action
                 self.client = await self.client_manager.get_client(session_name)
                 if self.client:
+                    from .dialog_cache import DialogCache
+                    self.dialogs = DialogCache(self.client,
+                                               self.client_manager.sessions_folder / f"{session_name}.dialogs.json.gz")
                     await self.main_menu()
                     await self.client.disconnect()
 
@@ -51,17 +61,19 @@ class AppUI:
 
         print("-" * 20)
         print(f"   a. ➕ Add new session")
+        print(f"   p. 🧵 Pool export (several sessions)")
         print(f"   u. 🖇️ Unite two exports")
         print(f"   e. 🚪 Exit")
 
         while True:
-            options = "a, u, e"
+            options = "a, p, u, e"
             if session_files:
                 options = f"1-{len(session_files)}, " + options
             prompt = f"Choose action ({options}): "
             choice = input(f"\n{prompt}").strip().lower()
 
             if choice == 'a': return 'create'
+            if choice == 'p': return 'pool'
             if choice == 'u': return 'merge'
             if choice == 'e': return 'exit'
 
@@ -78,8 +90,10 @@ class AppUI:
         while True:
             print("\n" + "=" * 60 + "\n📋 MAIN MENU:")
             print(
-                "1. 📋 Show all chats\n2. 🔍 Search chat\n3. 🆔 Export by ID\n4. ⚙️ Settings\nb. ⬅️ Back to session select")
-            choice = input("\nChoose action (1-5): ").strip()
+                "1. 📋 Show all chats\n2. 🔍 Search chat\n3. 🆔 Export by ID\n4. ⚙️ Settings\n5. 🔄 Reload chat list"
+                "\n6. 🔁 Sync edits and deletions into an export\n7. 📥 Download the pending media of an export"
+                "\n8. 🔎 Verify the media of an export\nb. ⬅️ Back to session select")
+            choice = input("\nChoose action (1-8): ").strip()
             if choice == "1":
                 await self.show_all_chats()
             elif choice == "2":
@@ -88,14 +102,25 @@ class AppUI:
                 await self.export_by_id()
             elif choice == "4":
                 self.delay_settings.configure()
+            elif choice == "5":
+                print("\n⏳ Reloading the full chat list...")
+                dialogs = await self.dialogs.refresh(full=True)
+                print(f"✅ {len(dialogs)} chats loaded.")
+            elif choice == "6":
+                await self.sync_export()
+            elif choice == "7":
+                await self.download_pending_media()
+            elif choice == "8":
+                await self.verify_export_media()
             elif choice == "b":
                 break
             else:
                 print("❌ Invalid choice!")
 
     async def show_all_chats(self):
+        from telethon.tl.types import User, Chat, Channel
         print("\n⏳ Loading chat list...")
-        dialogs = await self.client.get_dialogs()
+        dialogs = await self.dialogs.refresh()
         chats = {'channels': [], 'groups': [], 'private': []}
         for d in dialogs:
             if isinstance(d.entity, Channel):
@@ -157,6 +182,7 @@ class AppUI:
                     print("❌ Invalid command!")
 
     def _get_formatted_name_for_ui(self, entity):
+        from telethon.tl.types import User
         if isinstance(entity, User):
             name_parts = []
             if first_name := getattr(entity, 'first_name', None): name_parts.append(first_name)
@@ -171,14 +197,15 @@ class AppUI:
         query = input("\n🔍 Enter chat name (or press Enter to cancel): ").strip()
         if not query: return
         print(f"\n⏳ Searching '{query}'...")
-        dialogs = await self.client.get_dialogs()
-        found = [d for d in dialogs if query.lower() in d.name.lower()]
+        await self.dialogs.refresh()
+        found = self.dialogs.search(query)
         if not found:
             print(f"❌ Nothing found for '{query}'")
             return
         await self.select_from_list(found, f"SEARCH RESULTS '{query}'")
 
     async def export_by_id(self):
+        from telethon.tl.types import User, Chat, Channel
         print("\n🆔 EXPORT BY ID/USERNAME (e.g., @durov, -100123..., +7...)")
         chat_id = input("Enter ID (or press Enter to cancel): ").strip()
         if not chat_id: return
@@ -187,16 +214,16 @@ class AppUI:
         print(f"\n⏳ Searching '{chat_id}'...")
 
         try:
+            await self.dialogs.ensure_loaded()
             if chat_id.replace('-', '').isdigit():
                 entity_id = int(chat_id)
-                dialogs = await self.client.get_dialogs()
-                for d in dialogs:
-                    if d.id == entity_id:
-                        entity = d.entity
-                        break
+                if dialog := self.dialogs.get(entity_id):
+                    entity = dialog.entity
                 if not entity: entity = await self.client.get_entity(entity_id)
             else:
-                entity = await self.client.get_entity(chat_id)
+                if dialog := self.dialogs.get_by_username(chat_id):
+                    entity = dialog.entity
+                if not entity: entity = await self.client.get_entity(chat_id)
 
             if not entity:
                 print("❌ Unable to resolve entity. Ensure you are a member of the chat.")
@@ -226,12 +253,63 @@ class AppUI:
     async def export_chat_interactive(self, entity):
         name = self._get_formatted_name_for_ui(entity)
         print(f"\n{'=' * 60}\n📥 EXPORT: {name}\n{'=' * 60}")
+        media_options = self._ask_media_options()
+        start_date, end_date, append_folder_path = await self._ask_date_range()
+
+        # An append has to carry every message after the page's last one: a filtered slice would leave gaps under
+        # a header that still names the page's own filters.
+        from_user, search = None, None
+        if append_folder_path and media_options['media_only']:
+            print("⚠️ Media-only is turned off: an append adds every message after the page's last one.")
+            media_options['media_only'] = False
+        if not append_folder_path:
+            from_user = await self._ask_from_user()
+            search = input("🔎 Only messages containing (optional, press Enter to skip): ").strip() or None
+
+        output_formats = self._ask_output_formats()
+        html_options = self._ask_html_options(output_formats, append_folder_path)
+        archive_format = None if append_folder_path else self._ask_archive_format()
+        options = dict(media_options, **html_options, start_date=start_date, end_date=end_date,
+                       output_formats=output_formats, archive_format=archive_format, from_user=from_user, search=search)
+
+        print(f"\n✅ READY TO EXPORT:\n   Chat: {name}")
+        self._print_export_options(options, append_folder_path)
+
+        confirm = input("\n▶️ Start export? [Y/n]: ").strip().lower()
+
+        if confirm != 'n':
+            from .exporter import ChatExporter
+            exporter = ChatExporter(self.client, self.delay_settings)
+            await exporter.export_chat(entity, **options)
+
+            if append_folder_path and exporter.export_folder and 'html' in output_formats:
+                print("\n" + "=" * 60)
+                print("🖇️ APPEND MODE: Automatically appending new export...")
+                print(f"   Original: {append_folder_path.name}")
+                print(f"   New data: {exporter.export_folder.name}")
+                print("=" * 60)
+                try:
+                    from .merger import Merger
+                    merger = Merger(str(append_folder_path), str(exporter.export_folder),
+                                    profile=self.delay_settings.profile)
+                    merger.append()
+                except Exception as e:
+                    print(f"\n❌ An unexpected error occurred during auto-merge: {e}")
+        else:
+            print("❌ Export cancelled. Returning to main menu.")
+
+    def _ask_media_options(self) -> dict:
         download_media = input("\n📥 Download media files? [Y/n]: ").strip().lower() != 'n'
+        media_preview = False
         max_file_size = None
-        append_folder_path = None
+        media_types = None
+        media_only = False
+        media_budget_mb, media_quotas, media_priority = None, None, None
+        media_later = False
 
         if download_media:
-            while True:
+            media_preview = input("Previews only (Telegram's small thumbnails, the original size is shown)? [y/N]: ").strip().lower() == 'y'
+            while not media_preview:
                 try:
                     max_size_mb_str = input("Enter max file size in MB (leave empty for no limit): ").strip().replace(
                         ',', '.')
@@ -243,24 +321,68 @@ class AppUI:
                         break
                 except ValueError:
                     print("❌ Invalid input! Please enter a number (e.g., 50, 2.5, 0.5) or leave empty.")
+            media_types = self._ask_media_types()
+            media_only = input("Export only the messages with this media (filtered by Telegram)? [y/N]: ").strip().lower() == 'y'
+            if input("Plan the downloads (total budget, per-type quotas, priority)? [y/N]: ").strip().lower() == 'y':
+                media_budget_mb, media_quotas, media_priority = self._ask_media_plan()
+            media_later = input("Export the text first and download the media in a later pass? [y/N]: ").strip().lower() == 'y'
+        return dict(download_media=download_media, media_preview=media_preview, max_file_size=max_file_size,
+                    media_types=media_types, media_only=media_only, media_budget_mb=media_budget_mb,
+                    media_quotas=media_quotas, media_priority=media_priority, media_later=media_later)
+
+    def _ask_media_plan(self) -> tuple:
+        from .media_handler import MEDIA_TYPES
+        from .media_scheduler import PRIORITIES, parse_quotas
+        while True:
+            try:
+                budget_str = input("Total media budget in MB (leave empty for no limit): ").strip().replace(',', '.')
+                budget_mb = float(budget_str) if budget_str else None
+                break
+            except ValueError:
+                print("❌ Invalid input! Please enter a number (e.g., 500, 2048) or leave empty.")
+        while True:
+            try:
+                quotas = parse_quotas(input("Per-type quotas in MB, e.g. video=500,document=100 (optional): "), MEDIA_TYPES)
+                break
+            except ValueError as e:
+                print(f"❌ Invalid quotas: {e}")
+        while True:
+            priority_str = input(f"Download first ({', '.join(PRIORITIES)}; comma-separated to combine) [message order]: ").strip().lower()
+            priority = [p.strip() for p in priority_str.split(',') if p.strip()]
+            unknown = [p for p in priority if p not in PRIORITIES]
+            if unknown:
+                print(f"❌ Unknown priority: {', '.join(unknown)}")
+                continue
+            return budget_mb, quotas or None, list(dict.fromkeys(priority)) or None
 
+    async def _ask_date_range(self, allow_append: bool = True) -> tuple:
         start_date, end_date = None, None
+        append_folder_path = None
+        append_hint = " or [a] to append to existing export" if allow_append else ""
         while True:
             try:
                 start_date_str = input(
-                    "\nEnter start date (YYYY-MM-DD HH:MM, UTC) or [a] to append to existing export (optional, press Enter to skip): ").strip().lower()
+                    f"\nEnter start date (YYYY-MM-DD HH:MM, UTC){append_hint} (optional, press Enter to skip): ").strip().lower()
 
                 if not start_date_str:
                     start_date = None
-                elif start_date_str == 'a':
+                elif start_date_str == 'a' and allow_append:
                     append_folder_path = await self._select_export_folder("Select an export to append to")
+                    index = load_page_index(append_folder_path) if append_folder_path else None
+                    if index and index.get('filters'):
+                        # The new messages are exported without filters; the page would mix both under its header.
+                        print(f"❌ '{append_folder_path.name}' only has messages {index['filters']}; an append adds "
+                              f"every message after the last one. Append cancelled.")
+                        append_folder_path = None
+                        continue
                     if append_folder_path:
+                        from .merger import Merger
                         print(f"\n⏳ Analyzing '{append_folder_path.name}' to find the last message date...")
-                        last_date = Merger.get_last_message_date(append_folder_path)
+                        last_date = Merger.get_append_start_date(append_folder_path)
                         if last_date:
                             start_date = last_date
                             print(
-                                f"✅ Start date set to {start_date.strftime('%Y-%m-%d %H:%M')} UTC from the last message.")
+                                f"✅ Start date set to {start_date.strftime('%Y-%m-%d %H:%M:%S')} UTC from the last message.")
                         else:
                             print(f"❌ Could not find any messages in '{append_folder_path.name}'. Append cancelled.")
                             append_folder_path = None
@@ -281,36 +403,109 @@ class AppUI:
             except ImportError:
                 print("\n❌ Error: Missing required libraries for this feature.")
                 print("   Please install them by running: pip install beautifulsoup4 lxml")
-
-        print(f"\n✅ READY TO EXPORT:\n   Chat: {name}\n   Media: {'yes' if download_media else 'no'}")
-        if download_media and max_file_size is not None:
-            print(f"   Max file size: {max_file_size} MB")
-        if start_date:
-            print(f"   From date: {start_date.strftime('%Y-%m-%d %H:%M')} UTC")
-        if end_date:
-            print(f"   To date:   {end_date.strftime('%Y-%m-%d %H:%M')} UTC")
+        return start_date, end_date, append_folder_path
+
+    def _print_export_options(self, options: dict, append_folder_path: Path = None):
+        print(f"   Media: {('previews' if options['media_preview'] else 'yes') if options['download_media'] else 'no'}")
+        if options['download_media'] and options['max_file_size'] is not None:
+            print(f"   Max file size: {options['max_file_size']} MB")
+        if options['media_types']:
+            print(f"   Media types: {', '.join(options['media_types'])}")
+        if options['media_budget_mb'] is not None:
+            print(f"   Media budget: {options['media_budget_mb']} MB")
+        if options['media_quotas']:
+            print(f"   Quotas: {', '.join(f'{kind} {mb} MB' for kind, mb in options['media_quotas'].items())}")
+        if options['media_priority']:
+            print(f"   Priority: {', '.join(options['media_priority'])}")
+        if options['media_later']:
+            print("   Media pass: later (text first)")
+        if options['media_only']:
+            print("   Messages:  media only")
+        if options['start_date']:
+            print(f"   From date: {options['start_date'].strftime('%Y-%m-%d %H:%M')} UTC")
+        if options['end_date']:
+            print(f"   To date:   {options['end_date'].strftime('%Y-%m-%d %H:%M')} UTC")
+        if options.get('from_user'):
+            print(f"   From:      {self._get_formatted_name_for_ui(options['from_user'])}")
+        if options['search']:
+            print(f"   Search:    \"{options['search']}\"")
         if append_folder_path:
             print(f"   Mode:      Append to '{append_folder_path.name}'")
+        print(f"   Formats:   {', '.join(options['output_formats'])}")
+        if options['minify_html'] or options['html_precompress']:
+            extras = (['minified'] if options['minify_html'] else []) + [f".{fmt}" for fmt in options['html_precompress']]
+            print(f"   HTML:      {', '.join(extras)}")
+        if options['archive_format']:
+            print(f"   Archive:   {options['archive_format']}")
+
+    def _ask_output_formats(self) -> List[str]:
+        from .exporter import OUTPUT_FORMATS
+        while True:
+            formats_str = input(f"\nOutput formats ({', '.join(OUTPUT_FORMATS)}; comma-separated) [html]: ").strip().lower()
+            formats = [f.strip() for f in formats_str.split(',') if f.strip()] or ['html']
+            unknown = [f for f in formats if f not in OUTPUT_FORMATS]
+            if unknown:
+                print(f"❌ Unknown format(s): {', '.join(unknown)}")
+                continue
+            if 'parquet' in formats and importlib.util.find_spec('pyarrow') is None:
+                print("❌ Parquet export requires pyarrow. Install it with: pip install pyarrow")
+                continue
+            return list(dict.fromkeys(formats))
 
-        confirm = input("\n▶️ Start export? [Y/n]: ").strip().lower()
+    # An append follows the page it goes into; the copies of that page are compressed again by the append.
+    def _ask_html_options(self, output_formats: List[str], append_folder_path: Optional[Path] = None) -> dict:
+        from .precompress import PRECOMPRESS_FORMATS, precompress_available
+        if 'html' not in output_formats:
+            return dict(minify_html=False, html_precompress=[])
+        if append_folder_path:
+            index = load_page_index(append_folder_path)
+            return dict(minify_html=bool(index and index.get('minified')), html_precompress=[])
+        minify_html = input("🗜️ Minify messages.html? [y/N]: ").strip().lower() == 'y'
+        while True:
+            formats_str = input(f"Pre-compressed copies of messages.html ({', '.join(PRECOMPRESS_FORMATS)}; comma-separated, optional): ").strip().lower()
+            formats = [f.strip().lstrip('.') for f in formats_str.split(',') if f.strip()]
+            unknown = [f for f in formats if f not in PRECOMPRESS_FORMATS]
+            if unknown:
+                print(f"❌ Unknown format(s): {', '.join(unknown)}")
+                continue
+            if not all(precompress_available(f) for f in formats):
+                print("❌ Brotli copies require brotli. Install it with: pip install brotli")
+                continue
+            return dict(minify_html=minify_html, html_precompress=list(dict.fromkeys(formats)))
 
-        if confirm != 'n':
-            exporter = ChatExporter(self.client, self.delay_settings)
-            await exporter.export_chat(entity, download_media, max_file_size, start_date, end_date)
+    async def _ask_from_user(self):
+        while True:
+            user_id = input("\n👤 Only messages from user (ID/username, optional, press Enter to skip): ").strip()
+            if not user_id:
+                return None
+            try:
+                return await self.client.get_entity(int(user_id) if user_id.lstrip('-').isdigit() else user_id)
+            except Exception as e:
+                print(f"❌ Could not find this user: {e}")
 
-            if append_folder_path and exporter.export_folder:
-                print("\n" + "=" * 60)
-                print("🖇️ APPEND MODE: Automatically merging new export...")
-                print(f"   Original: {append_folder_path.name}")
-                print(f"   New data: {exporter.export_folder.name}")
-                print("=" * 60)
-                try:
-                    merger = Merger(str(append_folder_path), str(exporter.export_folder))
-                    merger.merge()
-                except Exception as e:
-                    print(f"\n❌ An unexpected error occurred during auto-merge: {e}")
-        else:
-            print("❌ Export cancelled. Returning to main menu.")
+    def _ask_media_types(self) -> Optional[List[str]]:
+        from .media_handler import MEDIA_TYPES
+        while True:
+            types_str = input(f"Media types to download ({', '.join(MEDIA_TYPES)}; comma-separated) [all]: ").strip().lower()
+            media_types = [t.strip() for t in types_str.split(',') if t.strip()]
+            unknown = [t for t in media_types if t not in MEDIA_TYPES]
+            if unknown:
+                print(f"❌ Unknown media type(s): {', '.join(unknown)}")
+                continue
+            return list(dict.fromkeys(media_types)) or None
+
+    def _ask_archive_format(self) -> Optional[str]:
+        while True:
+            choice = input(f"Package export as (folder, {', '.join(ARCHIVE_FORMATS)}) [folder]: ").strip().lower()
+            if choice in ('', 'folder'):
+                return None
+            if choice not in ARCHIVE_FORMATS:
+                print("❌ Invalid choice!")
+                continue
+            if choice == 'tar.zst' and importlib.util.find_spec('zstandard') is None:
+                print("❌ tar.zst archives require zstandard. Install it with: pip install zstandard")
+                continue
+            return choice
 
     async def _select_export_folder(self, prompt: str, exclude: Path = None) -> Path | None:
         print(f"\n{'=' * 60}\n{prompt}\n")
@@ -370,6 +565,164 @@ class AppUI:
             else:
                 print("❌ Path is not a valid export folder (must contain messages.html).")
 
+    async def sync_export(self):
+        folder = await self._select_export_folder("🔁 Select an export to sync with its chat")
+        if not folder: return
+
+        from .sync import ExportSync
+        sync = ExportSync(self.client, self.delay_settings, folder)
+        if not sync.open(): return
+        try:
+            await self.dialogs.ensure_loaded()
+            dialog = self.dialogs.get(sync.chat_id)
+            entity = dialog.entity if dialog else await self.client.get_entity(sync.chat_id)
+            remove_deleted = input("Remove messages deleted from the chat from the export? [Y/n]: ").strip().lower() != 'n'
+            await sync.run(entity, remove_deleted)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            print("💡 Check that this session is a member of the exported chat.")
+        finally:
+            sync.close()
+
+    async def download_pending_media(self, folder: Path = None):
+        folder = folder or await self._select_export_folder("📥 Select an export to download its pending media into")
+        if not folder: return
+
+        from .media_pass import MediaPass
+        media_pass = MediaPass(self.client, self._ask_media_pass_delay(), folder)
+        if not media_pass.open(): return
+        try:
+            stop_at = self._ask_stop_time()
+            await self.dialogs.ensure_loaded()
+            dialog = self.dialogs.get(media_pass.chat_id)
+            entity = dialog.entity if dialog else await self.client.get_entity(media_pass.chat_id)
+            await media_pass.run(entity, stop_at)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            print("💡 Check that this session is a member of the exported chat.")
+        finally:
+            media_pass.close()
+
+    async def verify_export_media(self):
+        folder = await self._select_export_folder("🔎 Select an export to verify its media")
+        if not folder: return
+
+        from tqdm import tqdm
+        from .database import STORE_NAME
+        from .media_manifest import MANIFEST_NAME, MediaManifest
+        manifest = MediaManifest.load(folder)
+        if not manifest:
+            print(f"❌ '{folder.name}' has no {MANIFEST_NAME}, so its media cannot be verified.")
+            return
+        total = sum(entry.size for entry in manifest.entries.values())
+        with tqdm(total=total, unit='B', unit_scale=True, colour='cyan', desc="Verifying") as pbar:
+            problems = manifest.verify(folder, progress=lambda entry: pbar.update(entry.size))
+
+        missing = sum(1 for problem in problems.values() if problem == 'missing')
+        print(f"\n✅ Intact: {len(manifest.entries) - len(problems)}   ❌ Missing: {missing}   "
+              f"⚠️ Damaged: {len(problems) - missing}")
+        labels = {'missing': "missing", 'size': "wrong size", 'hash': "content changed"}
+        for key, problem in list(problems.items())[:20]:
+            print(f"   - {manifest.entries[key].path}: {labels[problem]}")
+        if len(problems) > 20:
+            print(f"   ... and {len(problems) - 20} more")
+        if not problems: return
+        if not (folder / STORE_NAME).is_file():
+            print(f"💡 This export has no {STORE_NAME}, so these files cannot be downloaded into it again.")
+            return
+        if input("Download these files again? [Y/n]: ").strip().lower() == 'n': return
+
+        from .media_pass import MediaPass
+        media_pass = MediaPass(self.client, self.delay_settings, folder)
+        if not media_pass.open(): return
+        try:
+            queued = media_pass.requeue(manifest, problems)
+        finally:
+            media_pass.close()
+        print(f"⏳ {queued} message(s) queued for the media pass.")
+        if queued:
+            await self.download_pending_media(folder)
+
+    # The pass can be throttled on its own, without changing the delay the exports use.
+    def _ask_media_pass_delay(self) -> DelaySettings:
+        current = self.delay_settings.delay_between_media
+        while True:
+            try:
+                delay_str = input(f"Seconds between files for this pass [{current}]: ").strip().replace(',', '.')
+                if not delay_str:
+                    return self.delay_settings
+                settings = copy.copy(self.delay_settings)
+                settings.delay_between_media = float(delay_str)
+                return settings
+            except ValueError:
+                print("❌ Invalid input! Please enter a number (e.g., 0.5, 2) or leave empty.")
+
+    def _ask_stop_time(self) -> Optional[datetime]:
+        while True:
+            stop_str = input("Stop at (HH:MM local time, leave empty to download everything): ").strip()
+            if not stop_str:
+                return None
+            try:
+                stop = datetime.combine(datetime.now().date(), datetime.strptime(stop_str, '%H:%M').time())
+            except ValueError:
+                print("❌ Invalid time! Please use HH:MM, e.g. 07:30.")
+                continue
+            # A time already past today is the one of tomorrow, for a pass run overnight.
+            return stop if stop > datetime.now() else stop + timedelta(days=1)
+
+    async def run_pool_export(self):
+        print("\n🧵 POOL EXPORT: export chats with several sessions at once")
+        session_files = self.client_manager.get_session_files()
+        if len(session_files) < 2:
+            print("❌ A pool needs at least two saved sessions.")
+            return
+        for idx, file in enumerate(session_files, 1):
+            print(f"   {idx}. 📂 {file.stem}")
+        while True:
+            choice = input("\nSessions to use (e.g. 1,3; Enter for all): ").strip()
+            try:
+                picked = [int(n) for n in choice.split(',') if n.strip()] or range(1, len(session_files) + 1)
+                names = list(dict.fromkeys(session_files[n - 1].stem for n in picked if n >= 1))
+                break
+            except (ValueError, IndexError):
+                print(f"❌ Enter numbers from 1 to {len(session_files)}, separated by commas.")
+
+        refs_str = input("Chats to export (IDs/usernames, comma-separated): ").strip()
+        refs = list(dict.fromkeys(ref.strip() for ref in refs_str.split(',') if ref.strip()))
+        if not refs:
+            return
+        shard = False
+        if len(refs) == 1 and len(names) > 1:
+            shard = input("Split this chat across the sessions (channels and supergroups)? [Y/n]: ").strip().lower() != 'n'
+
+        # Appending and the sender filter are left out: both are tied to one account's view of a chat.
+        media_options = self._ask_media_options()
+        start_date, end_date, _ = await self._ask_date_range(allow_append=False)
+        search = input("🔎 Only messages containing (optional, press Enter to skip): ").strip() or None
+        output_formats = self._ask_output_formats()
+        html_options = self._ask_html_options(output_formats)
+        archive_format = self._ask_archive_format()
+        options = dict(media_options, **html_options, start_date=start_date, end_date=end_date,
+                       output_formats=output_formats, archive_format=archive_format, search=search)
+
+        print(f"\n✅ READY TO EXPORT:\n   Chats: {', '.join(refs)}\n   Sessions: {', '.join(names)}")
+        if shard:
+            print("   Mode:      split across sessions")
+        self._print_export_options(options)
+        if input("\n▶️ Start export? [Y/n]: ").strip().lower() == 'n':
+            print("❌ Export cancelled.")
+            return
+
+        from .session_pool import SessionPool
+        pool = SessionPool(self.client_manager, self.delay_settings)
+        try:
+            if not await pool.connect(names):
+                print("❌ None of the sessions could connect.")
+                return
+            await pool.export_chats(refs, options, shard)
+        finally:
+            await pool.disconnect()
+
     async def run_merger(self):
         print("\n" + "=" * 60)
         print("🖇️ UNITE TWO EXPORTS")
@@ -392,7 +745,8 @@ class AppUI:
             return
 
         try:
-            merger = Merger(str(folder1), str(folder2))
+            from .merger import Merger
+            merger = Merger(str(folder1), str(folder2), profile=self.delay_settings.profile)
             merger.merge()
         except ImportError:
             print("\n❌ Error: Missing required libraries for merging.")
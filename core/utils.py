@@ -1,4 +1,7 @@
+import base64
+import json
 import re
+from typing import Optional
 
 
 def sanitize_filename(name: str) -> str:
@@ -48,4 +51,46 @@ def format_text(text: str) -> str:
 
     text = re.sub(url_pattern, repl_url, text)
 
-    return text
\ No newline at end of file
+    return text
+
+
+# Messages are stored with their plain text and their entities, as the dicts Telethon makes of them, in JSON.
+def entities_to_json(entities) -> Optional[str]:
+    return json.dumps([entity.to_dict() for entity in entities]) if entities else None
+
+
+def entities_from_json(value: Optional[str]) -> list:
+    # Telethon is left out of startup (see ui.py), and only formatted messages need it here.
+    from telethon.tl import types
+    entities = []
+    for data in json.loads(value) if value else []:
+        data = dict(data)
+        entities.append(getattr(types, data.pop('_'))(**data))
+    return entities
+
+
+# The text with its formatting written in as markdown, the way Telethon's Message.text has it; format_text
+# turns that into markup.
+def markdown_text(text: str, entities: Optional[str]) -> str:
+    if not text or not entities:
+        return text
+    from telethon.extensions import markdown
+    return markdown.unparse(text, entities_from_json(entities))
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+# TL objects (entities, messages) round-trip through their own serialization, stored as base64 text.
+def encode_tl(tl_object) -> Optional[str]:
+    return base64.b64encode(bytes(tl_object)).decode('ascii') if tl_object is not None else None
+
+
+def decode_tl(data: Optional[str]):
+    from telethon.extensions import BinaryReader
+    return BinaryReader(base64.b64decode(data)).tgread_object() if data else None
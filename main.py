@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import traceback
 import logging
@@ -6,8 +7,9 @@ from core.ui import AppUI
 logging.getLogger('telethon').setLevel(logging.ERROR)
 
 
-async def main():
+async def main(args):
     app = AppUI()
+    app.delay_settings.profile = args.profile
     try:
         await app.start()
     except KeyboardInterrupt:
@@ -18,4 +20,8 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Telegram Chat Exporter")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile exports and merges, writing a flame graph stack file and a hot function "
+                             "summary into their folder")
+    asyncio.run(main(parser.parse_args()))
\ No newline at end of file